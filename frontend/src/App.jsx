@@ -151,7 +151,7 @@ const App = () => {
       const interval = setInterval(async () => {
         const statusRes = await getExperimentStatus(experimentId);
         
-        if (statusRes.status === 'COMPLETED' || statusRes.status === 'FAILED') {
+        if (['COMPLETED', 'FAILED', 'CANCELLED'].includes(statusRes.status)) {
           clearInterval(interval);
           setStatus(statusRes.status);
           setData(statusRes);
@@ -18,7 +18,7 @@ export const uploadBatch = async (files) => {
 export const startExperiment = async (batchId, mode) => {
     const response = await api.post('/experiments/start/', {
         batch_id: batchId,
-        mode: mode // 'SERIAL' or 'PARALLEL'
+        mode: mode // 'SERIAL', 'PARALLEL', 'THREADED', 'HYBRID' or 'DISTRIBUTED'
     });
     return response.data;
 };
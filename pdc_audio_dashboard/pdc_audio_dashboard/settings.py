@@ -128,6 +128,58 @@ CORS_ALLOW_ALL_ORIGINS = True
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Shared worker pool (processor/pool.py): size (None = all cores) and
+# whether to spawn and warm it up when the server starts
+PROCESSOR_POOL_WORKERS = None
+PROCESSOR_POOL_PREWARM = True
+# Threads of THREADED runs (None = all cores) and per pool process in HYBRID runs
+PROCESSOR_THREADS = None
+PROCESSOR_HYBRID_THREADS = 2
+
+# Experiment queue (processor/jobs.py): cores all running experiments may use
+# together (None = all cores), whether the server runs the dispatcher itself
+# (False: run `manage.py run_queue` instead), the lock file that lets only one
+# process dispatch (None = run_queue.lock next to manage.py), its poll interval,
+# and when a running job without heartbeat is requeued (at most
+# PROCESSOR_QUEUE_MAX_ATTEMPTS runs)
+PROCESSOR_CORE_BUDGET = None
+PROCESSOR_QUEUE_DISPATCHER = True
+PROCESSOR_QUEUE_LOCK_FILE = None
+PROCESSOR_QUEUE_POLL_SECONDS = 1.0
+PROCESSOR_QUEUE_STALE_SECONDS = 60
+PROCESSOR_QUEUE_MAX_ATTEMPTS = 3
+
+# DISTRIBUTED runs (processor/distributed.py): the shared secret agents send
+# as X-Agent-Token (DISTRIBUTED mode and the agent protocol are refused while
+# it is unset), their heartbeat interval, how long a node may miss
+# heartbeats before its files are re-dispatched (at most
+# PROCESSOR_AGENT_MAX_ATTEMPTS times each), and how long files wait with no
+# live agent before they fail. Remote agents also need this host in ALLOWED_HOSTS.
+PROCESSOR_AGENT_TOKEN = os.environ.get('PROCESSOR_AGENT_TOKEN') or None
+PROCESSOR_AGENT_HEARTBEAT_SECONDS = 5
+PROCESSOR_AGENT_TIMEOUT_SECONDS = 30
+PROCESSOR_AGENT_MAX_ATTEMPTS = 3
+PROCESSOR_AGENT_WAIT_SECONDS = 300
+
+# Cold import budget of the worker entry point (manage.py import_budget)
+PROCESSOR_IMPORT_BUDGET_MS = 250
+
+# Size bound of the on-disk result cache (processor/lib/result_cache.py)
+PROCESSOR_RESULT_CACHE_BYTES = 2 * 1024 ** 3
+# Size bound of the stage checkpoint store (processor/lib/checkpoints.py)
+PROCESSOR_CHECKPOINT_CACHE_BYTES = 4 * 1024 ** 3
+# Size bound of the decoded-PCM cache of compressed uploads (processor/lib/decode.py)
+PROCESSOR_PCM_CACHE_BYTES = 4 * 1024 ** 3
+
+# PARALLEL runs split a file at least this long (seconds) into segments across
+# the pool when it would otherwise outlast the rest of the batch on one core
+PROCESSOR_SEGMENT_MIN_SECONDS = 600
+# Target segment length in seconds (see processor/lib/segmented.py)
+PROCESSOR_SEGMENT_SECONDS = 120
+# Shared memory (/dev/shm) a segmented run may use to pass audio and features
+# between processes; larger runs, or 0, use scratch .npy files (processor/lib/shm.py)
+PROCESSOR_SHM_MAX_BYTES = 1024 ** 3
+
 # DRF Config
 REST_FRAMEWORK = {
     'DEFAULT_PARSER_CLASSES': [
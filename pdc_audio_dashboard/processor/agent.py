@@ -0,0 +1,215 @@
+"""
+Worker agent for DISTRIBUTED experiments (see processor/distributed.py).
+
+    cd pdc_audio_dashboard
+    python -m processor.agent --coordinator http://HOST:8000/api --slots 4
+
+Needs this checkout and the DSP requirements, but no Django settings or
+database: it talks to the coordinator over HTTP only. The agent registers,
+heartbeats from a background thread, claims as many files as it has free
+slots, downloads each input, runs process_file_task in a local pre-warmed
+process pool and uploads the outputs and features under the directory the
+coordinator gave the task. Several agents with
+different --name values can run on one machine to try the mode on localhost.
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from .worker import init_pool_worker, process_file_task
+
+# Seconds to wait before retrying when the coordinator is unreachable or has no work
+POLL_SECONDS = 1.0
+
+
+class Agent:
+    def __init__(self, coordinator, name=None, slots=None, work_dir=None, token=None,
+                 cache_bytes=2 * 1024 ** 3, checkpoint_bytes=4 * 1024 ** 3, pcm_bytes=4 * 1024 ** 3):
+        self.coordinator = coordinator.rstrip('/')
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.slots = slots or os.cpu_count() or 1
+        self.work_dir = os.path.abspath(work_dir or os.path.join(tempfile.gettempdir(), f"pdc_agent_{self.name}"))
+        self.token = token
+        self.cache_bytes = cache_bytes
+        self.checkpoint_bytes = checkpoint_bytes
+        self.pcm_bytes = pcm_bytes
+        self.node_id = None
+        self.heartbeat_seconds = 5
+        self._stop = threading.Event()
+
+    def _request(self, method, path, payload=None, body=None, length=None, raw=False):
+        headers = {}
+        if self.token:
+            headers['X-Agent-Token'] = self.token
+        if payload is not None:
+            body = json.dumps(payload).encode()
+            headers['Content-Type'] = 'application/json'
+        elif body is not None:
+            headers['Content-Type'] = 'application/octet-stream'
+            headers['Content-Length'] = str(length)
+        request = urllib.request.Request(f"{self.coordinator}/{path}", data=body, method=method, headers=headers)
+        response = urllib.request.urlopen(request, timeout=60)
+        if raw:
+            return response
+        with response:
+            return json.loads(response.read() or b'null')
+
+    def register(self):
+        reply = self._request('POST', 'agents/register/', {'name': self.name, 'slots': self.slots})
+        self.node_id = reply['id']
+        self.heartbeat_seconds = reply.get('heartbeat_seconds', self.heartbeat_seconds)
+        print(f"Agent {self.name}: registered as node {self.node_id} with {self.slots} slot(s)")
+
+    def _forgotten(self, error):
+        # 404 on our node: the coordinator lost it (e.g. a fresh database), register again
+        if isinstance(error, urllib.error.HTTPError) and error.code == 404:
+            self.node_id = None
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_seconds):
+            if self.node_id is None:
+                continue
+            try:
+                self._request('POST', f"agents/{self.node_id}/heartbeat/", {})
+            except (OSError, ValueError) as e:
+                print(f"Agent {self.name}: heartbeat failed: {e}")
+                self._forgotten(e)
+
+    def _fetch(self, task):
+        """Download a task's input under the stored file name, so outputs are named as in local runs."""
+        folder = os.path.join(self.work_dir, 'inputs', str(task['id']))
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, task['file_name'])
+        with self._request('GET', f"agents/{self.node_id}/tasks/{task['id']}/input/", raw=True) as response:
+            with open(path, 'wb') as f:
+                shutil.copyfileobj(response, f)
+        return path
+
+    def _task_args(self, task, input_path):
+        result_cache, checkpoints, pcm_cache = None, None, None
+        if task['use_cache']:
+            result_cache = {'path': os.path.join(self.work_dir, 'cache', 'results'), 'max_bytes': self.cache_bytes}
+            checkpoints = {'path': os.path.join(self.work_dir, 'cache', 'checkpoints'),
+                           'max_bytes': self.checkpoint_bytes}
+            pcm_cache = {'path': os.path.join(self.work_dir, 'cache', 'pcm'), 'max_bytes': self.pcm_bytes}
+        # Features stay per-file .npy files; the coordinator adds them to the experiment's store
+        return (input_path, self.work_dir, task['file_id'], task['pipeline'], None, result_cache, checkpoints,
+                pcm_cache)
+
+    def _upload(self, task, result):
+        """Push output files, then the result. False if the coordinator gave the task to another node."""
+        base = f"agents/{self.node_id}/tasks/{task['id']}"
+        try:
+            if result.get('success'):
+                for relative in [result['processed_path']] + list(result['arrays'].values()):
+                    path = os.path.join(self.work_dir, relative)
+                    query = urllib.parse.urlencode({'path': relative.replace(os.sep, '/')})
+                    with open(path, 'rb') as f:
+                        self._request('PUT', f"{base}/files/?{query}", body=f, length=os.path.getsize(path))
+            self._request('POST', f"{base}/result/", result)
+            return True
+        except urllib.error.HTTPError as e:
+            if e.code in (404, 409):
+                return False
+            raise
+
+    def _cleanup(self, task, result):
+        shutil.rmtree(os.path.join(self.work_dir, 'inputs', str(task['id'])), ignore_errors=True)
+        if result.get('relative_dir'):
+            # <output_dir>/<name>: drop the whole run folder
+            run_dir = os.path.dirname(os.path.join(self.work_dir, result['relative_dir']))
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+    def _finish(self, task, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            # A crashed pool process; report the file so it is not held until the node times out
+            result = {'success': False, 'original_id': task['file_id'], 'error': f"Worker process failed: {e}"}
+        try:
+            if self._upload(task, result):
+                state = 'done' if result.get('success') else 'failed'
+            else:
+                state = 'dropped, re-dispatched by the coordinator'
+            print(f"Agent {self.name}: task {task['id']} (file {task['file_id']}) {state}")
+        except (OSError, ValueError) as e:
+            print(f"Agent {self.name}: could not upload task {task['id']}: {e}")
+        self._cleanup(task, result)
+
+    def run(self):
+        os.makedirs(self.work_dir, exist_ok=True)
+        threading.Thread(target=self._heartbeat_loop, daemon=True, name='agent-heartbeat').start()
+
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.slots, initializer=init_pool_worker)
+        in_flight = {}
+        try:
+            while not self._stop.is_set():
+                if self.node_id is None:
+                    try:
+                        self.register()
+                    except (OSError, ValueError) as e:
+                        print(f"Agent {self.name}: coordinator unreachable ({e}), retrying")
+                        self._stop.wait(POLL_SECONDS * 5)
+                        continue
+                free = self.slots - len(in_flight)
+                tasks = []
+                if free:
+                    try:
+                        tasks = self._request('POST', f"agents/{self.node_id}/claim/", {'count': free})['tasks']
+                    except (OSError, ValueError) as e:
+                        print(f"Agent {self.name}: claim failed: {e}")
+                        self._forgotten(e)
+                for task in tasks:
+                    try:
+                        input_path = self._fetch(task)
+                    except OSError as e:
+                        # The coordinator takes the task back once it misses our result
+                        print(f"Agent {self.name}: could not fetch task {task['id']}: {e}")
+                        continue
+                    if getattr(executor, '_broken', False):
+                        executor = concurrent.futures.ProcessPoolExecutor(
+                            max_workers=self.slots, initializer=init_pool_worker
+                        )
+                    in_flight[executor.submit(process_file_task, *self._task_args(task, input_path),
+                                              run_dir=task['output_dir'])] = task
+                if not in_flight:
+                    self._stop.wait(POLL_SECONDS)
+                    continue
+                done, _ = concurrent.futures.wait(
+                    in_flight, timeout=POLL_SECONDS, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    self._finish(in_flight.pop(future), future)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stop(self):
+        self._stop.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Worker agent for DISTRIBUTED experiments")
+    parser.add_argument('--coordinator', required=True, help="API root of the coordinator, e.g. http://host:8000/api")
+    parser.add_argument('--name', help="Unique node name (default: hostname-pid)")
+    parser.add_argument('--slots', type=int, help="Files processed at once (default: all cores)")
+    parser.add_argument('--work-dir', help="Scratch folder for inputs, outputs and caches (default: under the temp dir)")
+    parser.add_argument('--token', default=os.environ.get('PROCESSOR_AGENT_TOKEN'),
+                        help="Shared secret the coordinator expects (default: $PROCESSOR_AGENT_TOKEN)")
+    args = parser.parse_args(argv)
+    agent = Agent(args.coordinator, args.name, args.slots, args.work_dir, args.token)
+    try:
+        agent.run()
+    except KeyboardInterrupt:
+        agent.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class ProcessorConfig(AppConfig):
     name = 'processor'
+
+    def ready(self):
+        # Spawn and warm the shared worker pool while the server starts
+        from .pool import prewarm_in_background
+        prewarm_in_background()
+        # Admit queued experiments (see processor/jobs.py)
+        from .jobs import start_in_background
+        start_in_background()
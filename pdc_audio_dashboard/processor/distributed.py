@@ -0,0 +1,271 @@
+"""
+Coordinator side of DISTRIBUTED experiments.
+
+Worker agents (processor/agent.py) on any host register over HTTP, heartbeat
+every PROCESSOR_AGENT_HEARTBEAT_SECONDS and pull tasks: one DistributedTask
+per file, handed out in the experiment's longest-first order. An agent
+downloads the input, runs process_file_task locally, uploads the output
+files under the same relative paths and posts the result dict. Features are
+appended to the experiment's store here, so the run leaves the same
+container as the local modes.
+
+Agents authenticate with the shared PROCESSOR_AGENT_TOKEN; without one the
+mode is refused. Every attempt at a task writes under its own directory
+(task_dir), and uploads or results naming any other path are rejected.
+
+A node that misses heartbeats for PROCESSOR_AGENT_TIMEOUT_SECONDS counts as
+dead: its assigned tasks go back to PENDING for another node, at most
+PROCESSOR_AGENT_MAX_ATTEMPTS times per task. Uploads from a node whose task
+was re-dispatched meanwhile are rejected.
+"""
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from .models import DistributedTask, WorkerNode
+
+# Seconds between checks of an experiment's tasks
+POLL_SECONDS = 1.0
+
+
+def agent_token():
+    """The shared secret agents must send; None disables DISTRIBUTED mode."""
+    return getattr(settings, 'PROCESSOR_AGENT_TOKEN', None) or None
+
+
+def heartbeat_seconds():
+    return getattr(settings, 'PROCESSOR_AGENT_HEARTBEAT_SECONDS', 5)
+
+
+def live_nodes():
+    """Nodes that heartbeated within PROCESSOR_AGENT_TIMEOUT_SECONDS."""
+    timeout = getattr(settings, 'PROCESSOR_AGENT_TIMEOUT_SECONDS', 30)
+    return WorkerNode.objects.filter(last_heartbeat__gte=timezone.now() - timedelta(seconds=timeout))
+
+
+def live_slots():
+    return sum(live_nodes().values_list('slots', flat=True))
+
+
+def release_tasks(tasks):
+    """Put ASSIGNED tasks back in the queue, or fail those out of attempts. Returns how many were taken back."""
+    max_attempts = getattr(settings, 'PROCESSOR_AGENT_MAX_ATTEMPTS', 3)
+    released = 0
+    for task in tasks.filter(state='ASSIGNED').select_related('node'):
+        if task.attempts >= max_attempts:
+            done = DistributedTask.objects.filter(pk=task.pk, state='ASSIGNED').update(
+                state='FAILED', finished_at=timezone.now(),
+                result={'success': False, 'original_id': task.original_file_id,
+                        'error': f"Lost with a worker node {task.attempts} time(s)"}
+            )
+        else:
+            done = DistributedTask.objects.filter(pk=task.pk, state='ASSIGNED').update(state='PENDING', node=None)
+        if done:
+            released += 1
+            if task.node_id:
+                WorkerNode.objects.filter(pk=task.node_id).update(tasks_lost=F('tasks_lost') + 1)
+                print(f"Task {task.pk} (file {task.original_file_id}): lost with node {task.node.name}")
+    return released
+
+
+def reclaim_lost():
+    """Re-dispatch the tasks of nodes that stopped heartbeating."""
+    return release_tasks(DistributedTask.objects.exclude(node__in=live_nodes()))
+
+
+def register(name, host, slots):
+    """Create or refresh a node. A node registering again restarted, so its old tasks are gone."""
+    node, _ = WorkerNode.objects.update_or_create(
+        name=name, defaults={'host': host, 'slots': max(1, slots), 'last_heartbeat': timezone.now()}
+    )
+    release_tasks(node.tasks.all())
+    print(f"Worker node {name} registered from {host} with {node.slots} slot(s)")
+    return node
+
+
+def heartbeat(node):
+    WorkerNode.objects.filter(pk=node.pk).update(last_heartbeat=timezone.now())
+
+
+def claim(node, count):
+    """Assign up to `count` pending tasks to `node`, oldest experiment first."""
+    heartbeat(node)
+    claimed = []
+    with transaction.atomic():
+        pending = DistributedTask.objects.filter(state='PENDING').order_by('experiment_id', 'priority')
+        for task in pending[:count]:
+            if DistributedTask.objects.filter(pk=task.pk, state='PENDING').update(
+                state='ASSIGNED', node=node, assigned_at=timezone.now(), attempts=F('attempts') + 1
+            ):
+                claimed.append(task.pk)
+    return list(DistributedTask.objects.filter(pk__in=claimed).select_related('experiment', 'original_file'))
+
+
+def task_payload(task):
+    """What an agent needs to run one task."""
+    return {
+        'id': task.pk,
+        'file_id': task.original_file_id,
+        'file_name': os.path.basename(task.original_file.file.name),
+        # The stages the coordinator's runner chose, reordered by rate planning or not
+        'pipeline': (task.experiment.rate_plan or {}).get('pipeline', task.experiment.pipeline),
+        'use_cache': task.experiment.use_cache,
+        'output_dir': task_dir(task),
+    }
+
+
+def assigned_task(node, task_id):
+    """The task if it is still assigned to `node`, else None (re-dispatched, cancelled or gone)."""
+    return (DistributedTask.objects.filter(pk=task_id, node=node, state='ASSIGNED')
+            .select_related('experiment', 'original_file').first())
+
+
+def task_dir(task):
+    """Run directory of the current attempt at `task`, relative to the media root."""
+    return f"processed/task_{task.pk}_{task.attempts}"
+
+
+def output_path(relative_path, task):
+    """Absolute path of an uploaded output file; ValueError if it would land outside task_dir(task)."""
+    relative_path = os.path.normpath(str(relative_path).replace('\\', '/'))
+    parts = relative_path.split(os.sep)
+    if os.path.isabs(relative_path) or '..' in parts or parts[:2] != task_dir(task).split('/') or len(parts) < 3:
+        raise ValueError(f"Output path must be relative and under {task_dir(task)}/: {relative_path}")
+    return os.path.join(str(settings.MEDIA_ROOT), relative_path)
+
+
+def store_file(relative_path, stream, task, chunk_bytes=1024 * 1024):
+    path = output_path(relative_path, task)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.part"
+    with open(tmp, 'wb') as f:
+        # DRF gives no stream for an empty body
+        while stream is not None:
+            chunk = stream.read(chunk_bytes)
+            if not chunk:
+                break
+            f.write(chunk)
+    os.replace(tmp, path)
+
+
+def complete(node, task, result):
+    """
+    Record an agent's result for `task`. Features it uploaded go into the
+    experiment's store; the node's counters are updated. Returns False if
+    the task is no longer assigned to `node`.
+
+    Raises:
+        ValueError: if an output named in the result is outside the task's
+        directory or was not uploaded.
+    """
+    from .worker import store_features
+
+    result = {**result, 'original_id': task.original_file_id, 'node': node.pk}
+    arrays = {}
+    if result.get('success'):
+        # The runner files the output as relative_dir/<name of processed_path>
+        output_path(os.path.join(result.get('relative_dir') or '', os.path.basename(result['processed_path'])), task)
+        paths = [result['processed_path']] + list((result.get('arrays') or {}).values())
+        missing = [p for p in paths if not os.path.exists(output_path(p, task))]
+        if missing:
+            raise ValueError(f"Outputs not uploaded: {', '.join(missing)}")
+        if task.experiment.feature_store and result.get('arrays'):
+            arrays = {name: output_path(p, task) for name, p in result['arrays'].items()}
+
+    with transaction.atomic():
+        # Claim the task first, so a node it was taken from cannot write features
+        if not DistributedTask.objects.filter(pk=task.pk, node=node, state='ASSIGNED').update(
+            state='DONE', result=result, finished_at=timezone.now()
+        ):
+            return False
+        if arrays:
+            has_spectrogram, ref = store_features(str(settings.MEDIA_ROOT), task.experiment.feature_store,
+                                                  task.original_file_id, arrays)
+            result['spectrogram_path'] = ref if has_spectrogram else None
+            result['arrays'] = {}
+            DistributedTask.objects.filter(pk=task.pk).update(result=result)
+    if result.get('success'):
+        WorkerNode.objects.filter(pk=node.pk).update(
+            tasks_completed=F('tasks_completed') + 1,
+            busy_seconds=F('busy_seconds') + result.get('duration', 0),
+            audio_seconds=F('audio_seconds') + (task.original_file.duration_seconds or 0),
+        )
+    else:
+        WorkerNode.objects.filter(pk=node.pk).update(tasks_failed=F('tasks_failed') + 1)
+    return True
+
+
+def run_tasks(experiment, file_ids, should_cancel=None):
+    """
+    Queue one task per file (in the given order) and wait until agents have
+    finished them all. After cancellation pending tasks are dropped and
+    assigned ones are waited for. Tasks left pending with no live node for
+    PROCESSOR_AGENT_WAIT_SECONDS fail.
+
+    Returns:
+        list: process_file_task-style result dicts, with 'node' set.
+    """
+    # Tasks of an earlier, interrupted run of this experiment are stale
+    experiment.tasks.all().delete()
+    DistributedTask.objects.bulk_create([
+        DistributedTask(experiment=experiment, original_file_id=file_id, priority=i)
+        for i, file_id in enumerate(file_ids)
+    ])
+    tasks = experiment.tasks.all()
+    wait_seconds = getattr(settings, 'PROCESSOR_AGENT_WAIT_SECONDS', 300)
+    idle_since = None
+    while True:
+        reclaim_lost()
+        if should_cancel is not None and should_cancel():
+            tasks.filter(state='PENDING').update(state='CANCELLED', finished_at=timezone.now())
+        if not tasks.filter(state__in=['PENDING', 'ASSIGNED']).exists():
+            break
+        if tasks.filter(state='PENDING').exists() and not live_nodes().exists():
+            idle_since = idle_since or time.monotonic()
+            if time.monotonic() - idle_since > wait_seconds:
+                print(f"Experiment {experiment.id}: no worker agent for {wait_seconds}s, failing pending files")
+                for task in tasks.filter(state='PENDING'):
+                    DistributedTask.objects.filter(pk=task.pk, state='PENDING').update(
+                        state='FAILED', finished_at=timezone.now(),
+                        result={'success': False, 'original_id': task.original_file_id,
+                                'error': 'No worker agent available'}
+                    )
+        else:
+            idle_since = None
+        time.sleep(POLL_SECONDS)
+    return [t.result for t in tasks.filter(state__in=['DONE', 'FAILED']).order_by('priority') if t.result]
+
+
+def node_stats(node):
+    """Liveness and throughput of one node for the API."""
+    return {
+        'alive': live_nodes().filter(pk=node.pk).exists(),
+        'assigned': node.tasks.filter(state='ASSIGNED').count(),
+        # Seconds of audio processed per second of processing
+        'realtime_factor': node.audio_seconds / node.busy_seconds if node.busy_seconds else None,
+        'seconds_per_file': node.busy_seconds / node.tasks_completed if node.tasks_completed else None,
+    }
+
+
+def experiment_nodes(experiment):
+    """Per-node file count, processing time and audio length of one experiment's results."""
+    rows = (experiment.results.filter(node__isnull=False)
+            .values('node_id', 'node__name')
+            .annotate(files=Count('id'), processing_ms=Sum('processing_time_ms'),
+                      audio_seconds=Sum('original_file__duration_seconds'))
+            .order_by('node__name'))
+    return [
+        {
+            'node': row['node_id'],
+            'name': row['node__name'],
+            'files': row['files'],
+            'processing_seconds': (row['processing_ms'] or 0) / 1000,
+            'audio_seconds': row['audio_seconds'],
+        }
+        for row in rows
+    ]
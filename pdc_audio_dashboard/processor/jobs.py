@@ -0,0 +1,264 @@
+"""
+DB-backed experiment queue.
+
+POST /experiments/start/ only enqueues an ExperimentJob. A dispatcher
+(`manage.py run_queue`, or a thread of the server) admits queued jobs while
+their cores fit in the global budget PROCESSOR_CORE_BUDGET and runs each one
+on a thread with ExperimentRunner; PARALLEL and HYBRID work still goes to the
+shared worker pool. The dispatcher refreshes the heartbeat of the jobs it
+runs, so after a restart jobs left RUNNING go back to the queue once their
+heartbeat is stale.
+
+Only the process holding the lock file PROCESSOR_QUEUE_LOCK_FILE dispatches,
+so several server workers and run_queue do not each start one. Admission
+itself is a single conditional UPDATE that re-checks the cores in use, so
+even dispatchers on different hosts cannot exceed the budget.
+
+Admission is fair across batches: queued jobs of the batch with the fewest
+running jobs go first, oldest first within it. A job that does not fit
+blocks the ones behind it, so a stream of small jobs cannot starve a big one.
+"""
+import os
+import threading
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import F, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ExperimentJob, ProcessingExperiment
+
+
+def core_budget():
+    return getattr(settings, 'PROCESSOR_CORE_BUDGET', None) or os.cpu_count() or 4
+
+
+def job_cores(experiment):
+    """Cores an experiment occupies while it runs, capped at the budget."""
+    from .utils import mode_concurrency
+    if experiment.mode == 'DISTRIBUTED':
+        # Files run on the worker agents; locally it only waits and stores uploads
+        return 1
+    processes, threads = mode_concurrency(experiment.mode, experiment.threads)
+    return min(core_budget(), processes * threads)
+
+
+def enqueue(experiment):
+    experiment.status = 'QUEUED'
+    experiment.save(update_fields=['status'])
+    return ExperimentJob.objects.create(experiment=experiment, cores=job_cores(experiment))
+
+
+def cancel(experiment):
+    """
+    Cancel a queued or running experiment. A running one stops starting new
+    files and ends as CANCELLED once the files in flight are done.
+
+    Returns:
+        bool: False if the experiment is not queued or running.
+    """
+    job = ExperimentJob.objects.filter(experiment=experiment).first()
+    if job is None:
+        return False
+    if ExperimentJob.objects.filter(pk=job.pk, state='QUEUED').update(state='CANCELLED', finished_at=timezone.now()):
+        ProcessingExperiment.objects.filter(pk=experiment.pk).update(status='CANCELLED')
+        return True
+    return bool(ExperimentJob.objects.filter(pk=job.pk, state='RUNNING').update(cancel_requested=True))
+
+
+def _admission_key(per_batch):
+    # Fewest running jobs of the same batch first, then oldest
+    return lambda job: (per_batch[job.experiment.batch_id], job.queued_at, job.pk)
+
+
+def _running_per_batch():
+    return Counter(ExperimentJob.objects.filter(state='RUNNING').values_list('experiment__batch_id', flat=True))
+
+
+def claim_next():
+    """Mark the next admissible queued job RUNNING and return it, or None."""
+    queued = list(ExperimentJob.objects.filter(state='QUEUED').select_related('experiment'))
+    if not queued:
+        return None
+    job = min(queued, key=_admission_key(_running_per_batch()))
+    if job.cores > core_budget():
+        return None
+    # Cores in use are summed inside the UPDATE, so concurrent claims cannot over-admit
+    used = (ExperimentJob.objects.filter(state='RUNNING').order_by()
+            .values('state').annotate(total=Sum('cores')).values('total'))
+    now = timezone.now()
+    claimed = (ExperimentJob.objects.filter(pk=job.pk, state='QUEUED')
+               .alias(used=Coalesce(Subquery(used), 0))
+               .filter(used__lte=core_budget() - job.cores)
+               .update(state='RUNNING', started_at=now, heartbeat_at=now, attempts=F('attempts') + 1))
+    return job if claimed else None
+
+
+def admission_order():
+    """Queued jobs in the order claim_next will admit them."""
+    per_batch = _running_per_batch()
+    key = _admission_key(per_batch)
+    queued = list(ExperimentJob.objects.filter(state='QUEUED').select_related('experiment'))
+    order = []
+    while queued:
+        job = min(queued, key=key)
+        queued.remove(job)
+        order.append(job)
+        per_batch[job.experiment.batch_id] += 1
+    return order
+
+
+def requeue_stale():
+    """Put RUNNING jobs whose dispatcher stopped heartbeating back in the queue (or fail them)."""
+    stale_seconds = getattr(settings, 'PROCESSOR_QUEUE_STALE_SECONDS', 60)
+    max_attempts = getattr(settings, 'PROCESSOR_QUEUE_MAX_ATTEMPTS', 3)
+    cutoff = timezone.now() - timedelta(seconds=stale_seconds)
+    for job in ExperimentJob.objects.filter(state='RUNNING', heartbeat_at__lt=cutoff).select_related('experiment'):
+        experiment = job.experiment
+        # Results of the interrupted run are incomplete; the rerun writes them again
+        experiment.results.all().delete()
+        if job.attempts >= max_attempts or job.cancel_requested:
+            state, status = ('CANCELLED', 'CANCELLED') if job.cancel_requested else ('DONE', 'FAILED')
+            ExperimentJob.objects.filter(pk=job.pk, state='RUNNING').update(state=state, finished_at=timezone.now())
+            ProcessingExperiment.objects.filter(pk=experiment.pk).update(status=status)
+            print(f"Experiment {experiment.id}: interrupted {job.attempts} time(s), marked {status}")
+        elif ExperimentJob.objects.filter(pk=job.pk, state='RUNNING').update(state='QUEUED'):
+            ProcessingExperiment.objects.filter(pk=experiment.pk).update(status='QUEUED')
+            print(f"Experiment {experiment.id}: interrupted, requeued")
+
+
+def run_job(job_pk):
+    """Run one claimed job to the end (on its own dispatcher thread)."""
+    from .utils import ExperimentRunner
+
+    job = ExperimentJob.objects.select_related('experiment__batch').get(pk=job_pk)
+    runner = ExperimentRunner(
+        job.experiment,
+        should_cancel=lambda: ExperimentJob.objects.filter(pk=job_pk, cancel_requested=True).exists()
+    )
+    try:
+        runner.run()
+    except Exception as e:
+        print(f"Experiment {job.experiment_id} failed: {e}")
+        ProcessingExperiment.objects.filter(pk=job.experiment_id).update(status='FAILED')
+    finally:
+        ExperimentJob.objects.filter(pk=job_pk).update(
+            state='CANCELLED' if runner.cancelled else 'DONE', finished_at=timezone.now()
+        )
+        connection.close()
+
+
+class Dispatcher:
+    """Admits queued jobs within the core budget and heartbeats the ones it runs."""
+
+    def __init__(self, poll_seconds=None):
+        self.poll_seconds = poll_seconds or getattr(settings, 'PROCESSOR_QUEUE_POLL_SECONDS', 1.0)
+        self.running = {}
+        self._orphans_failed = False
+        self._stop = threading.Event()
+
+    def tick(self):
+        if not self._orphans_failed:
+            # Experiments started before the queue existed can never finish
+            ProcessingExperiment.objects.filter(
+                status__in=['PENDING', 'PROCESSING'], job__isnull=True
+            ).update(status='FAILED')
+            self._orphans_failed = True
+        self.running = {pk: t for pk, t in self.running.items() if t.is_alive()}
+        if self.running:
+            ExperimentJob.objects.filter(pk__in=list(self.running)).update(heartbeat_at=timezone.now())
+        requeue_stale()
+        while True:
+            job = claim_next()
+            if job is None:
+                break
+            print(f"Experiment {job.experiment_id}: admitted ({job.cores} cores)")
+            thread = threading.Thread(target=run_job, args=(job.pk,), daemon=True,
+                                      name=f"experiment-{job.experiment_id}")
+            self.running[job.pk] = thread
+            thread.start()
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except DatabaseError as e:
+                # e.g. SQLite's "database is locked" under write contention; retry next poll
+                print(f"Experiment queue: {e}")
+            self._stop.wait(self.poll_seconds)
+        connection.close()
+
+    def stop(self):
+        self._stop.set()
+
+
+_lock_file = None
+
+
+def acquire_dispatcher_lock():
+    """
+    Take the dispatcher lock (PROCESSOR_QUEUE_LOCK_FILE) for the life of the process.
+
+    Returns:
+        bool: False if another process holds it.
+    """
+    global _lock_file
+    if _lock_file is not None:
+        return True
+    path = getattr(settings, 'PROCESSOR_QUEUE_LOCK_FILE', None) or os.path.join(settings.BASE_DIR, 'run_queue.lock')
+    handle = open(path, 'a+')
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+    _lock_file = handle
+    return True
+
+
+def start_in_background():
+    """Run the dispatcher on a daemon thread of the serving process, if no other process runs one."""
+    from .pool import _is_serving
+    if not getattr(settings, 'PROCESSOR_QUEUE_DISPATCHER', True) or not _is_serving():
+        return
+    if not acquire_dispatcher_lock():
+        return
+    threading.Thread(target=Dispatcher().run_forever, daemon=True, name='experiment-queue').start()
+
+
+def job_info(job):
+    """Queue state of one experiment for the API."""
+    now = timezone.now()
+    info = {
+        'state': job.state,
+        'cores': job.cores,
+        'attempts': job.attempts,
+        # Time spent in the queue so far, or until it started / was cancelled
+        'wait_seconds': ((job.started_at or job.finished_at or now) - job.queued_at).total_seconds(),
+    }
+    if job.state == 'QUEUED':
+        order = [queued.pk for queued in admission_order()]
+        info['position'] = order.index(job.pk) + 1 if job.pk in order else None
+        info['depth'] = len(order)
+    return info
+
+
+def queue_stats():
+    running = ExperimentJob.objects.filter(state='RUNNING')
+    queued = ExperimentJob.objects.filter(state='QUEUED')
+    oldest = queued.order_by('queued_at').values_list('queued_at', flat=True).first()
+    return {
+        'core_budget': core_budget(),
+        'cores_in_use': sum(running.values_list('cores', flat=True)),
+        'running': running.count(),
+        'depth': queued.count(),
+        'oldest_wait_seconds': (timezone.now() - oldest).total_seconds() if oldest else None,
+    }
@@ -1,28 +1,17 @@
 import numpy as np
-import soundfile as sf
-from scipy.signal import butter, lfilter
+from scipy.signal import sosfilt
+from .filter_bank import design_sos
 
 def butter_filter(data, sr, cutoff, btype='low', order=5):
-    nyq = 0.5 * sr
+    # Cached SOS design (cutoffs are clamped below Nyquist there)
+    sos = design_sos(btype, cutoff, order, sr)
 
-    # Ensure cutoff is less than Nyquist
-    if isinstance(cutoff, list):
-        normal_cutoff = [min(f / nyq, 0.999) for f in cutoff]
-    else:
-        normal_cutoff = min(cutoff / nyq, 0.999)
-
-    b, a = butter(order, normal_cutoff, btype=btype, analog=False)
-
-    # Handle multi-channel audio by filtering each channel
-    if data.ndim == 1:
-        filtered = lfilter(b, a, data)
-    else:
-        filtered = np.zeros_like(data)
-        for ch in range(data.shape[1]):
-            filtered[:, ch] = lfilter(b, a, data[:, ch])
-    return filtered
+    # Filters every channel of (samples, channels) data in one call
+    return sosfilt(sos, data, axis=0)
 
 def apply_filter(input_path, output_path, filter_type='bandpass', low_cut=80, high_cut=8000):
+    import soundfile as sf
+
     data, sr = sf.read(input_path)
     
     if high_cut >= sr / 2:
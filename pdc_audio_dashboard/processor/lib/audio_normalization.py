@@ -1,11 +1,8 @@
 # audio_normalization.py
 
-from pydub import AudioSegment
-import pyloudnorm as pyln
-import soundfile as sf
 import numpy as np
 
-def normalize_peak(audio: AudioSegment, target_dBFS=-1.0):
+def normalize_peak(audio, target_dBFS=-1.0):
     """
     Normalize the audio to a target peak dBFS.
     
@@ -17,21 +14,42 @@ def normalize_peak(audio: AudioSegment, target_dBFS=-1.0):
     return audio.apply_gain(change_in_dBFS)
 
 
-def normalize_lufs(input_wav, output_wav, target_lufs=-23.0):
+def normalize_lufs(input_wav, output_wav, target_lufs=-23.0, block_size=65536):
     """
     Normalize the audio to a target LUFS level.
     
+    Two passes over the file in blocks: the first measures the integrated
+    loudness (lib/loudness.py), the second applies the gain while writing.
+    
     :param input_wav: path to input wav file
     :param output_wav: path to output normalized wav
     :param target_lufs: target loudness in LUFS
+    :return: {'integrated_loudness', 'true_peak'} of the output
     """
-    data, rate = sf.read(input_wav)
-    
-    meter = pyln.Meter(rate)  # create LUFS meter
-    loudness = meter.integrated_loudness(data)
-    
+    import soundfile as sf
+    from .loudness import LoudnessMeter, loudness_gain, loudness_stats
+
+    info = sf.info(input_wav)
+    meter = LoudnessMeter(info.samplerate, info.channels)
+    for block in sf.blocks(input_wav, blocksize=block_size, always_2d=True):
+        meter.add(block)
+
     # Apply gain to reach target LUFS
-    normalized_audio = pyln.normalize.loudness(data, loudness, target_lufs)
-    
-    # Save normalized audio
-    sf.write(output_wav, normalized_audio, rate)
+    gain_db = loudness_gain(meter.integrated_loudness(), target_lufs)
+    gain = 10 ** (gain_db / 20)
+    with sf.SoundFile(output_wav, 'w', samplerate=info.samplerate, channels=info.channels) as out:
+        for block in sf.blocks(input_wav, blocksize=block_size, always_2d=True):
+            out.write(block * gain)
+    return loudness_stats(meter, gain_db)
+
+
+def normalize_peak_array(data, target_dBFS=-1.0):
+    """
+    Array variant of normalize_peak for float audio in [-1, 1].
+    Silent input is returned unchanged.
+    """
+    peak = np.max(np.abs(data)) if data.size else 0.0
+    if peak == 0:
+        return data
+    change_in_dBFS = target_dBFS - 20 * np.log10(peak)
+    return data * (10 ** (change_in_dBFS / 20))
@@ -2,29 +2,24 @@
 
 import os
 import numpy as np
-from pydub import AudioSegment
-from .trim_silence import trim_silence
-from .noise_reduction import noise_reduction
-from .audio_normalization import normalize_peak
-from .resample import resample_audio
-from .channel_conversion import convert_to_mono
+from .pipeline import default_pipeline, run_pipeline
 # from vad import vad_trim  # VAD commented out
-from .audio_filter import apply_filter
-from .clipping import repair_clipping
-from .spectrogram import compute_mel_spectrogram, compute_mfcc, compute_log_mel
-from .hum_reduction import remove_hum
-import noisereduce as nr
-from pydub import effects
-import librosa
-import soundfile as sf
 
+# The DSP stack (librosa, noisereduce, pydub, soundfile) and the per-stage
+# modules are imported where they are used, so importing this module (and
+# spawning a worker) only loads what the active pipeline needs.
 
-def enhance_voice(input_path, output_path, sr=16000, gain_db=6):
+
+def enhance_voice(input_path, output_path, sr=16000, gain_db=6, target_dBFS=None):
     """
     Enhance speech in noisy audio:
     - Mild noise reduction
     - Apply gain / compression
+    - Peak normalization to target_dBFS, if given
     """
+    import librosa
+    import soundfile as sf
+
     # Load audio
     y, sr = librosa.load(input_path, sr=sr)
 
@@ -32,25 +27,107 @@ def enhance_voice(input_path, output_path, sr=16000, gain_db=6):
     noise_clip = y[:int(0.5*sr)]
 
     # Mild noise reduction
-    reduced = nr.reduce_noise(y=y, y_noise=noise_clip, sr=sr, prop_decrease=0.8)
+    reduced = reduce_voice_noise(y, sr, noise_clip)
+
+    # Gain / compression (and normalization) on the array, no temp WAV
+    boosted = compress_voice(reduced, sr, gain_db, target_dBFS=target_dBFS)
+    sf.write(output_path, boosted, sr, subtype='PCM_16')
+
+
+def segment_to_array(audio):
+    """
+    Decode an AudioSegment into float32 samples in [-1, 1].
+    Returns (samples,) for mono and (samples, channels) otherwise.
+    """
+    samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
+    samples /= audio.max_possible_amplitude
+    if audio.channels > 1:
+        samples = samples.reshape(-1, audio.channels)
+    return samples
+
+
+def array_to_segment(data, sr):
+    """
+    Wrap a float array as a 16-bit AudioSegment without touching disk.
+    """
+    from pydub import AudioSegment
+    channels = 1 if data.ndim == 1 else data.shape[1]
+    pcm = np.clip(np.round(data * 32768), -32768, 32767).astype(np.int16)
+    return AudioSegment(data=pcm.tobytes(), sample_width=2, frame_rate=sr, channels=channels)
+
+
+# noisereduce.reduce_noise defaults: long inputs are gated in chunks of
+# NR_CHUNK_SIZE samples, each with NR_PADDING samples of context per side
+NR_CHUNK_SIZE = 600000
+NR_PADDING = 30000
+
+
+def reduce_voice_noise(y, sr, noise_clip, **options):
+    """enhance_voice's noise gate; options are passed to noisereduce.reduce_noise."""
+    import noisereduce as nr
+    # logmmse switches numpy to np.seterr('raise') on import; an exp underflow
+    # inside noisereduce's sigmoid is harmless (it just rounds to 0)
+    with np.errstate(under='ignore'):
+        return nr.reduce_noise(y=y, y_noise=noise_clip, sr=sr, prop_decrease=0.8, **options)
+
+
+def compress_voice(reduced, sr, gain_db=6, target_dBFS=None):
+    """
+    enhance_voice's compressor and make-up gain (lib/dynamics.py), with
+    pydub's settings. A limiter at 0 dBFS stands in for the int16 clip.
+    """
+    from .dynamics import compress
+    return compress(reduced, sr, threshold=-20.0, ratio=3.0, attack=5.0, release=50.0, gain_db=gain_db,
+                    ceiling_dBFS=0.0, target_dBFS=target_dBFS)
+
+
+def enhance_voice_array(y, sr, target_sr=16000, gain_db=6, noise_clip=None, speech_segments=None):
+    """
+    In-memory variant of enhance_voice. Returns (enhanced, sr).
+    The noise profile defaults to the first 0.5 s of y. With speech_segments
+    ([[start_s, end_s], ...]) only those regions are enhanced, the rest is
+    output as silence.
+    """
+    from .resample import resample_array
+
+    if y.ndim > 1:
+        y = y.mean(axis=1)
+    if sr != target_sr:
+        y = resample_array(y, sr, target_sr)
+        sr = target_sr
 
-    # Save temporarily
-    temp_path = output_path.rsplit('.', 1)[0] + "_tmp.wav"
-    sf.write(temp_path, reduced, sr)
+    # librosa.load hands the file-based path float32, keep the same precision
+    # (subnormal samples flush to 0, which raises under logmmse's np.seterr)
+    with np.errstate(under='ignore'):
+        y = y.astype(np.float32)
+    if noise_clip is None:
+        noise_clip = y[:int(0.5*sr)]
 
-    # Apply gain / compression with pydub
-    audio = AudioSegment.from_file(temp_path)
-    compressed = effects.compress_dynamic_range(audio, threshold=-20.0, ratio=3.0)
-    boosted = compressed.apply_gain(gain_db)
+    def enhance(region):
+        return compress_voice(reduce_voice_noise(region, sr, noise_clip), sr, gain_db)
 
-    boosted.export(output_path, format="wav")
-    os.remove(temp_path)
+    if not speech_segments:
+        return enhance(y), sr
+
+    from .vad import speech_sample_ranges
+    out = np.zeros_like(y)
+    for start, end in speech_sample_ranges(speech_segments, sr, len(y)):
+        out[start:end] = enhance(y[start:end])[:end - start]
+    return out, sr
 
 
 class AudioProcessor:
     def __init__(self, input_file_path):
         self.input_file_path = input_file_path
-        self.audio = AudioSegment.from_file(input_file_path)
+        self._audio = None
+
+    @property
+    def audio(self):
+        # pydub decode for the file-based chain; the in-memory path uses lib/decode.py
+        if self._audio is None:
+            from pydub import AudioSegment
+            self._audio = AudioSegment.from_file(self.input_file_path)
+        return self._audio
 
     def process_audio(
         self,
@@ -58,11 +135,89 @@ class AudioProcessor:
         min_silence_len=100,
         silence_thresh=-40,
         target_sr=16000,
-        hum_freq=50.0
+        hum_freq=50.0,
+        in_memory=True,
+        pipeline=None,
+        streaming=False,
+        checkpoints=None,
+        segmented=None,
+        pcm_cache=None
     ):
+        """
+        Run the cleaning pipeline and write the final WAV plus features.
+
+        By default every stage works on one in-memory NumPy buffer and only
+        the final output and feature files touch disk. `pipeline` is a stage
+        list (see lib/pipeline.py); when omitted the historical ten-step chain
+        is built from the keyword arguments.
+
+        streaming=True reads the input in fixed-size blocks instead (see
+        lib/streaming.py) so memory stays flat for multi-hour recordings.
+
+        checkpoints is an optional CheckpointStore (lib/checkpoints.py) that
+        lets the in-memory path skip stages whose output is already stored.
+
+        segmented={'executor': ..., 'segment_seconds': ...} cuts one long
+        file into overlapping segments processed on the executor (see
+        lib/segmented.py). Checkpoints are not used then.
+
+        pcm_cache is an optional PCMCache (lib/decode.py) holding decoded
+        samples of compressed inputs for the in-memory path.
+
+        Pass in_memory=False to run the original file-based chain, which
+        writes (and then removes) a WAV per stage - handy when debugging a
+        single step. That path always runs the fixed default chain.
+        """
         os.makedirs(output_folder, exist_ok=True)
         base_name = os.path.splitext(os.path.basename(self.input_file_path))[0]
 
+        if not in_memory:
+            if pipeline is not None:
+                raise ValueError("Custom pipelines are only supported with in_memory=True")
+            return self._process_with_files(
+                output_folder, base_name, min_silence_len, silence_thresh, target_sr, hum_freq
+            )
+
+        if pipeline is None:
+            pipeline = default_pipeline(min_silence_len, silence_thresh, target_sr, hum_freq)
+        normalized_path = os.path.join(output_folder, f"{base_name}_final_output.wav")
+
+        if streaming:
+            from .streaming import run_pipeline_streaming
+            _, self.artifacts = run_pipeline_streaming(
+                self.input_file_path, pipeline, normalized_path, output_folder, base_name
+            )
+            return normalized_path
+
+        if segmented:
+            from .segmented import run_pipeline_segmented
+            _, self.artifacts = run_pipeline_segmented(
+                self.input_file_path, pipeline, normalized_path, output_folder, base_name, **segmented
+            )
+            return normalized_path
+
+        # Decode once (libsndfile in process, ffmpeg only if needed), then
+        # hand one buffer from stage to stage
+        from .decode import decode
+        samples, sr = decode(self.input_file_path, cache=pcm_cache)
+        y, sr, self.artifacts = run_pipeline(
+            samples, sr, pipeline, output_folder, base_name, checkpoints=checkpoints
+        )
+        import soundfile as sf
+        sf.write(normalized_path, y, sr, subtype='PCM_16')
+        return normalized_path
+
+    def _process_with_files(self, output_folder, base_name, min_silence_len,
+                            silence_thresh, target_sr, hum_freq):
+        from .trim_silence import trim_silence
+        from .noise_reduction import noise_reduction
+        from .resample import resample_audio
+        from .channel_conversion import convert_to_mono
+        from .clipping import repair_clipping
+        from .audio_filter import apply_filter
+        from .hum_reduction import remove_hum
+        from .spectrogram import compute_features
+
         # Step 1: Trim silence
         trimmed_audio = trim_silence(self.audio, min_silence_len, silence_thresh)
         trimmed_wav_path = os.path.join(output_folder, f"{base_name}_trimmed.wav")
@@ -92,31 +247,17 @@ class AudioProcessor:
         hum_removed_path = os.path.join(output_folder, f"{base_name}_hum_removed.wav")
         remove_hum(voice_filtered_path, hum_removed_path, hum_freq=hum_freq, Q=30.0)
 
-        # Step 8: Voice enhancement
-        enhanced_path = os.path.join(output_folder, f"{base_name}_voice_enhanced.wav")
-        enhance_voice(hum_removed_path, enhanced_path, gain_db=6)
-
-        # Step 9: Normalization
-        normalized_audio = AudioSegment.from_file(enhanced_path)
-        normalized_audio = normalize_peak(normalized_audio)
+        # Steps 8-9: Voice enhancement and normalization, in one pass
         normalized_path = os.path.join(output_folder, f"{base_name}_final_output.wav")
-        normalized_audio.export(normalized_path, format="wav")
+        enhance_voice(hum_removed_path, normalized_path, gain_db=6, target_dBFS=-1.0)
 
         # Step 10: Spectrogram features
-        # Replace spectrogram section with array-based computation to avoid re-read
-        y, sr = librosa.load(normalized_path, sr=16000, mono=True)
-        mel_spec = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=128, hop_length=512)
-        mel_spec_db = librosa.power_to_db(mel_spec, ref=np.max)
-        mfcc_feat = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13, hop_length=512)
-        log_mel_spec = librosa.power_to_db(mel_spec)
-
-        np.save(os.path.join(output_folder, f"{base_name}_mel_spectrogram.npy"), mel_spec_db)
-        np.save(os.path.join(output_folder, f"{base_name}_mfcc.npy"), mfcc_feat)
-        np.save(os.path.join(output_folder, f"{base_name}_log_mel.npy"), log_mel_spec)
+        for name, feat in compute_features(normalized_path, sr=16000).items():
+            np.save(os.path.join(output_folder, f"{base_name}_{name}.npy"), feat)
 
         # Cleanup intermediate files
         for f in [trimmed_wav_path, noise_reduced_path, resampled_path,
-                  mono_path, clipping_path, voice_filtered_path, hum_removed_path, enhanced_path]:
+                  mono_path, clipping_path, voice_filtered_path, hum_removed_path]:
             if os.path.exists(f):
                 os.remove(f)
 
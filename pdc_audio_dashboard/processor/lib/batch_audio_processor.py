@@ -3,7 +3,9 @@
 import os
 from pathlib import Path
 from multiprocessing import Pool, cpu_count
-from audio_processor import AudioProcessor
+from .audio_processor import AudioProcessor
+from .probe import probe_audio
+from .scheduling import lpt_order, work_msamples, CostModel
 
 def process_file(file_path: str):
     try:
@@ -36,8 +38,17 @@ def batch_process(folder_path: str, num_workers: int | None = None):
     os.makedirs("processed", exist_ok=True)
     print(f"Processing {len(audio_files)} files using {num_workers} workers...")
 
-    # Tune chunksize to keep workers busy and reduce scheduling overhead
-    chunksize = max(1, len(audio_files) // (num_workers * 4))
+    # Longest files first, one at a time: a long file handed out last (or
+    # buried in a chunk) would leave the other workers idle at the end
+    model = CostModel()
+    jobs = []
+    for f in audio_files:
+        info = probe_audio(f)
+        cost = model.predict_ms(work_msamples(info['duration_seconds'], info['sample_rate'],
+                                              info['channels'], os.path.getsize(f)))
+        jobs.append((f, cost))
+    audio_files = [f for f, _ in lpt_order(jobs)]
+    chunksize = 1
 
     success = 0
     failed = 0
@@ -1,7 +1,5 @@
 # channel_conversion.py
 
-from pydub import AudioSegment
-
 def convert_to_mono(input_path, output_path):
     """
     Convert audio to mono.
@@ -13,6 +11,8 @@ def convert_to_mono(input_path, output_path):
     Returns:
         str: Path to mono audio file.
     """
+    from pydub import AudioSegment
+
     audio = AudioSegment.from_file(input_path)
     
     # Convert to mono if not already
@@ -22,3 +22,13 @@ def convert_to_mono(input_path, output_path):
     audio.export(output_path, format="wav")
     print(f"Mono audio saved to: {output_path}")
     return output_path
+
+
+def convert_to_mono_array(data):
+    """
+    Average a (samples, channels) array down to (samples,).
+    Mono input is returned unchanged.
+    """
+    if data.ndim > 1:
+        return data.mean(axis=1)
+    return data
@@ -0,0 +1,114 @@
+# checkpoints.py
+"""
+Stage-level checkpoints for run_pipeline.
+
+Every step of a compiled plan gets a key chained from the step before it:
+
+    key[0] = sha256(decoded input samples + sample rate)
+    key[i] = sha256(key[i-1] + step name and params)
+
+so a step's key changes exactly when its own params or anything upstream
+changes. A run looks for the latest step whose checkpoint exists, restores
+its output (signal, sample rate and the pipeline context such as VAD
+segments) and only runs the steps after it. Tuning hum_freq therefore
+reruns hum removal and later stages, not trimming, logmmse and resampling.
+
+Steps with file side outputs (features) are never checkpointed. Streaming
+runs do not use checkpoints either.
+
+Entries are <root>/<key>/ directories holding y.npy and state.json. They are
+bounded by total size and evicted least recently used first, like the
+result cache.
+"""
+import os
+import json
+import shutil
+import threading
+import hashlib
+
+import numpy as np
+
+from .result_cache import evict_lru
+
+CHECKPOINT_VERSION = 6
+
+STATE_FILE = 'state.json'
+SIGNAL_FILE = 'y.npy'
+
+
+def signal_key(y, sr):
+    h = hashlib.sha256(f"{CHECKPOINT_VERSION}:{sr}:{y.dtype}:{y.shape}".encode())
+    h.update(np.ascontiguousarray(y).data)
+    return h.hexdigest()
+
+
+def chain_keys(root_key, plan):
+    """One key per plan step, each derived from the previous one."""
+    keys, key = [], root_key
+    for step in plan:
+        key = hashlib.sha256((key + json.dumps(step, sort_keys=True)).encode()).hexdigest()
+        keys.append(key)
+    return keys
+
+
+class CheckpointStore:
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def get(self, key):
+        """(y, sr, state) for a key, or None."""
+        entry = os.path.join(self.root, key)
+        state_path = os.path.join(entry, STATE_FILE)
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+            y = np.load(os.path.join(entry, SIGNAL_FILE))
+            os.utime(state_path)
+        except (OSError, ValueError):
+            return None
+        return y, state.pop('sr'), state
+
+    def put(self, key, y, sr, state):
+        entry = os.path.join(self.root, key)
+        if os.path.exists(entry):
+            return
+        tmp = os.path.join(self.root, f".tmp-{os.getpid()}-{threading.get_ident()}-{key[:16]}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        try:
+            np.save(os.path.join(tmp, SIGNAL_FILE), y)
+            with open(os.path.join(tmp, STATE_FILE), 'w') as f:
+                json.dump({**state, 'sr': sr}, f)
+            os.rename(tmp, entry)
+        except (OSError, TypeError):
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.evict()
+
+    def entries(self):
+        out = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            state_path = os.path.join(path, STATE_FILE)
+            if name.startswith('.') or not os.path.exists(state_path):
+                continue
+            try:
+                size = sum(e.stat().st_size for e in os.scandir(path))
+                out.append((os.path.getmtime(state_path), size, path))
+            except OSError:
+                continue
+        return out
+
+    def evict(self):
+        evict_lru(self.entries(), self.max_bytes)
+
+
+def merge_stats(total, stats):
+    """Add one run's {step: 'hit'|'miss'} into {step: {'hits', 'misses', 'hit_rate'}}."""
+    for step, outcome in stats.items():
+        entry = total.setdefault(step, {'hits': 0, 'misses': 0})
+        entry['hits' if outcome == 'hit' else 'misses'] += 1
+        entry['hit_rate'] = entry['hits'] / (entry['hits'] + entry['misses'])
+    return total
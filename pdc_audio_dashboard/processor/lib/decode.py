@@ -0,0 +1,131 @@
+# decode.py
+"""
+One decoder for the in-memory pipeline.
+
+decode() returns float32 samples in [-1, 1], (frames,) for mono and
+(frames, channels) otherwise, scaled like segment_to_array so results do
+not depend on which decoder produced them. Decoders are tried in order:
+
+- plain WAV: the data chunk is memory-mapped and scaled (lib/pcm.py);
+- libsndfile, in process: FLAC, OGG/Vorbis, Opus, AIFF, and MP3 with
+  libsndfile >= 1.1;
+- ffmpeg through pydub, only for what libsndfile cannot read (m4a/AAC,
+  WMA, ...). That is a subprocess plus a 16/32-bit round trip.
+
+With a PCMCache, inputs that needed libsndfile or ffmpeg are stored
+decoded, as <sha256 of the file>_<sr>.npy, so a later experiment on the
+same upload loads the samples instead of decoding again. The cache is
+bounded by total size; the least recently used entries go first.
+"""
+import glob
+import os
+import threading
+
+import numpy as np
+
+from .result_cache import evict_lru, file_digest
+
+# Bump when a decoder change alters the samples of the same file
+DECODER_VERSION = 1
+
+
+def _decode_ffmpeg(path):
+    from pydub import AudioSegment
+    from .audio_processor import segment_to_array
+    audio = AudioSegment.from_file(path)
+    return segment_to_array(audio), audio.frame_rate
+
+
+def decode_file(path):
+    """
+    Returns:
+        tuple: (samples, sr, decoder) with decoder 'wav', 'libsndfile' or 'ffmpeg'.
+    """
+    from .pcm import open_pcm
+    try:
+        reader = open_pcm(path)
+    except ValueError:
+        # libsndfile cannot open it (or cannot tell its length)
+        samples, sr = _decode_ffmpeg(path)
+        return samples, sr, 'ffmpeg'
+    return reader.read(0, reader.frames), reader.sr, 'wav' if reader.memory_mapped else 'libsndfile'
+
+
+class PCMCache:
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(path):
+        return f"v{DECODER_VERSION}-{file_digest(path)}"
+
+    def get(self, key):
+        """(samples, sr) of an entry, or None on a miss."""
+        for path in glob.glob(os.path.join(self.root, f"{key}_*.npy")):
+            try:
+                samples = np.load(path)
+                os.utime(path)
+            except (OSError, ValueError):
+                # Half-written or evicted meanwhile: a miss
+                continue
+            return samples, int(path[:-len('.npy')].rsplit('_', 1)[1])
+        return None
+
+    def put(self, key, samples, sr):
+        """Store decoded samples, then evict down to max_bytes."""
+        path = os.path.join(self.root, f"{key}_{sr}.npy")
+        tmp = os.path.join(self.root, f".tmp-{os.getpid()}-{threading.get_ident()}-{key[:24]}.npy")
+        try:
+            np.save(tmp, samples)
+            # Atomic publish; another worker may have stored the same file meanwhile
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        self.evict()
+
+    def entries(self):
+        """[(last_used, size_bytes, path)] of every entry."""
+        out = []
+        for entry in os.scandir(self.root):
+            if entry.name.startswith('.') or not entry.name.endswith('.npy'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            out.append((stat.st_mtime, stat.st_size, entry.path))
+        return out
+
+    def evict(self):
+        evict_lru(self.entries(), self.max_bytes)
+
+
+def decode(path, cache=None):
+    """
+    Decode an audio file to float32 (see the module docstring).
+
+    `cache` is an optional PCMCache; plain WAVs are never cached, mapping
+    them is as cheap as loading an entry.
+
+    Returns:
+        tuple: (samples, sr)
+    """
+    key = None
+    if cache is not None:
+        from .pcm import memory_mappable
+        if not memory_mappable(path):
+            key = cache.key(path)
+            hit = cache.get(key)
+            if hit is not None:
+                return hit
+    samples, sr, _ = decode_file(path)
+    samples = np.ascontiguousarray(samples, dtype=np.float32)
+    if key is not None:
+        cache.put(key, samples, sr)
+    return samples, sr
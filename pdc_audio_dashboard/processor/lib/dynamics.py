@@ -0,0 +1,133 @@
+# dynamics.py
+"""
+Array compressor, limiter and gain for float audio in [-1, 1].
+
+Replaces pydub's compress_dynamic_range + apply_gain, which need the
+signal as an int16 AudioSegment and walk it sample by sample in Python.
+Here every step is a whole-block NumPy or scipy operation:
+
+- level: RMS over the trailing attack window, all channels together (as
+  pydub measures it), from a running sum of squares;
+- gain reduction: (1 - 1/ratio) dB per dB above the threshold;
+- release: a peak detector in dB that holds rises and decays exponentially,
+  y[n] = max(x[n], a * y[n-1]). Unrolled, that is a running maximum of
+  x[n] / a^n, computed with np.maximum.accumulate on logs;
+- attack: one-pole smoothing of that envelope (scipy lfilter);
+- limiter: the same detector with instant attack on the sample peaks, so
+  no sample ends up above the ceiling; this replaces the int16 hard clip.
+
+Long signals are processed in blocks of BLOCK samples; the filter states
+are carried over, so the result does not depend on the block size. A
+Compressor keeps that state between calls for streamed input.
+"""
+import numpy as np
+
+BLOCK = 1 << 16
+
+
+def _coefficient(time_ms, sr):
+    # Per-sample factor of a one-pole with time constant time_ms (0 = instant)
+    samples = time_ms * sr / 1000
+    return float(np.exp(-1 / samples)) if samples > 0 else 0.0
+
+
+def _release(x, coeff, state):
+    """y[n] = max(x[n], coeff * y[n-1]) with y[-1] = state, for x >= 0. Returns (y, y[-1])."""
+    if coeff == 0:
+        return x, float(x[-1])
+    decay = np.arange(1, len(x) + 1) * -np.log(coeff)
+    with np.errstate(divide='ignore', under='ignore'):
+        held = np.maximum.accumulate(np.log(x) + decay)
+        if state > 0:
+            np.maximum(held, np.log(state), out=held)
+        y = np.exp(held - decay)
+    return y, float(y[-1])
+
+
+class Compressor:
+    """
+    The compressor and limiter of compress() with their state kept between
+    calls, so a stream fed block by block gives the same output as one call.
+    """
+
+    def __init__(self, sr, threshold=-20.0, ratio=4.0, attack=5.0, release=50.0, gain_db=0.0,
+                 ceiling_dBFS=None):
+        if ratio < 1:
+            raise ValueError("ratio must be at least 1")
+        self.threshold, self.gain_db = threshold, gain_db
+        self.window = max(1, int(sr * attack / 1000))
+        self.slope = 1 - 1 / ratio
+        self.a_attack, self.a_release = _coefficient(attack, sr), _coefficient(release, sr)
+        self.ceiling = 10 ** (ceiling_dBFS / 20) if ceiling_dBFS is not None else None
+        # Squares of the last window - 1 samples of the previous block
+        self._history = np.zeros(0)
+        self._held, self._envelope, self._limit = 0.0, 0.0, 0.0
+        self._started = False
+
+    def process(self, y):
+        """Compress the next (samples,) or (samples, channels) block; returns float32."""
+        x = np.asarray(y)
+        out = np.empty(x.shape, np.float32)
+        for start in range(0, len(x), BLOCK):
+            out[start:start + BLOCK] = self._block(x[start:start + BLOCK].astype(np.float64))
+        return out
+
+    def _block(self, block):
+        from scipy.signal import lfilter
+        window = self.window
+        power = block ** 2 if block.ndim == 1 else np.mean(block ** 2, axis=1)
+
+        history = self._history
+        sums = np.concatenate(([0.0], np.cumsum(np.concatenate((history, power)))))
+        ends = np.arange(len(history) + 1, len(sums))
+        # Full windows except at the very start of the signal
+        counts = np.full(len(ends), window) if self._started else np.minimum(ends, window)
+        level = np.maximum(sums[ends] - sums[ends - counts], 0) / counts
+        if window > 1:
+            self._history = np.concatenate((history, power))[-(window - 1):]
+        self._started = True
+
+        with np.errstate(divide='ignore'):
+            over = 10 * np.log10(level) - self.threshold
+        reduction, self._held = _release(self.slope * np.maximum(over, 0), self.a_release, self._held)
+        if self.a_attack:
+            a = self.a_attack
+            reduction, _ = lfilter([1 - a], [1, -a], reduction, zi=[a * self._envelope])
+        self._envelope = float(reduction[-1])
+
+        gain = 10 ** ((self.gain_db - reduction) / 20)
+        block = block * (gain if block.ndim == 1 else gain[:, None])
+
+        if self.ceiling is not None:
+            peaks = np.abs(block) if block.ndim == 1 else np.max(np.abs(block), axis=1)
+            with np.errstate(divide='ignore'):
+                excess = np.maximum(20 * np.log10(peaks / self.ceiling), 0)
+            excess, self._limit = _release(excess, self.a_release, self._limit)
+            scale = 10 ** (-excess / 20)
+            block = block * (scale if block.ndim == 1 else scale[:, None])
+            # Rounding of the last ulp
+            np.clip(block, -self.ceiling, self.ceiling, out=block)
+        return block
+
+
+def compress(y, sr, threshold=-20.0, ratio=4.0, attack=5.0, release=50.0, gain_db=0.0,
+             ceiling_dBFS=None, target_dBFS=None):
+    """
+    Compress, apply make-up gain, limit and peak-normalize in one call.
+
+    :param y: float array, (samples,) or (samples, channels)
+    :param threshold: RMS level in dBFS above which the signal is compressed
+    :param ratio: compression ratio
+    :param attack: attack time in ms (also the RMS window, as in pydub)
+    :param release: release time in ms
+    :param gain_db: make-up gain applied after compression
+    :param ceiling_dBFS: if given, limit sample peaks to this level
+    :param target_dBFS: if given, scale the result to this peak (normalize_peak)
+    :return: float32 array of the same shape
+    """
+    out = Compressor(sr, threshold, ratio, attack, release, gain_db, ceiling_dBFS).process(y)
+    if target_dBFS is not None and out.size:
+        peak = float(np.max(np.abs(out)))
+        if peak > 0:
+            out *= np.float32(10 ** ((target_dBFS - 20 * np.log10(peak)) / 20))
+    return out
@@ -0,0 +1,317 @@
+# enhancement.py
+"""
+Speech enhancement in one STFT pass: logMMSE and spectral gating combined.
+
+noise_reduction (the logmmse package) and enhance_voice (noisereduce) each
+take the signal to the STFT domain, estimate the noise their own way and
+transform back. enhance() does one forward STFT per chunk, runs the logMMSE
+recursion, multiplies its gain with noisereduce's non-stationary gating
+mask and inverts once. The mask is thresholded against the noise power the
+logMMSE recursion tracks (noise='tracked'), so both gains share one noise
+estimate; noise='smoothed' uses noisereduce's own time-smoothed floor.
+
+Two framings reproduce the current stages:
+
+- 'logmmse': 20 ms Hann frames, 50% overlap, FFT of twice the frame, in
+  60 s chunks that carry the recursion state and drop their last frame
+  (the output is shorter than the input, as noise_reduction's). With
+  gate=False this is the logmmse package's output, to rounding.
+- 'gate': noisereduce's 1024-point STFT with a 256 hop, on chunks of
+  NR_CHUNK_SIZE samples padded by NR_PADDING. Gate only; with
+  logmmse=False and noise='smoothed' this is enhance_voice's
+  reduce_voice_noise, to rounding. (enhance_voice passes a noise clip,
+  which the non-stationary gate never reads.)
+
+Channels and batch items (a list of arrays, e.g. the speech regions of a
+file) go through the logMMSE frame recursion together, so its per-frame
+Python overhead is paid once per frame rather than once per channel and
+region.
+"""
+import math
+
+import numpy as np
+
+from .audio_processor import NR_CHUNK_SIZE, NR_PADDING
+
+FRAMINGS = ('logmmse', 'gate')
+NOISE_FLOORS = ('tracked', 'smoothed')
+
+# logmmse package constants
+LOGMMSE_CHUNK_SECONDS = 60
+_AA = 0.98
+_MU = 0.98
+_KSI_MIN = 10 ** (-25 / 10)
+
+# noisereduce non-stationary defaults used by enhance_voice
+GATE_N_FFT = 1024
+_GATE = {'time_constant_s': 2.0, 'freq_mask_smooth_hz': 500, 'time_mask_smooth_ms': 50,
+         'thresh_n_mult': 2, 'sigmoid_slope': 10}
+
+
+def validate_options(logmmse=True, gate=True, framing='logmmse', noise=None):
+    """Raises ValueError for combinations enhance() cannot run; returns the noise floor to use."""
+    if not (logmmse or gate):
+        raise ValueError("Enable at least one of 'logmmse' and 'gate'")
+    if framing not in FRAMINGS:
+        raise ValueError(f"'framing' must be one of {', '.join(FRAMINGS)}")
+    if framing == 'gate' and logmmse:
+        raise ValueError("logMMSE needs the 'logmmse' framing")
+    if noise is None:
+        return 'tracked' if logmmse else 'smoothed'
+    if noise not in NOISE_FLOORS:
+        raise ValueError(f"'noise' must be one of {', '.join(NOISE_FLOORS)}")
+    if noise == 'tracked' and not logmmse:
+        raise ValueError("noise='tracked' is the logMMSE noise estimate and needs logmmse")
+    return noise
+
+
+def _smoothing_kernel(sr, hop, n_fft, freq_mask_smooth_hz, time_mask_smooth_ms):
+    """noisereduce's triangular mask smoothing filter, laid out (time, frequency); None if 1x1."""
+    n_freq = int(freq_mask_smooth_hz / (sr / (n_fft / 2)))
+    n_time = int(time_mask_smooth_ms / ((hop / sr) * 1000))
+    if n_freq < 1 or n_time < 1:
+        raise ValueError("Mask smoothing is finer than one STFT bin at this rate")
+    if n_freq == 1 and n_time == 1:
+        return None
+
+    def ramp(n):
+        return np.concatenate([np.linspace(0, 1, n + 1, endpoint=False), np.linspace(1, 0, n + 2)])[1:-1]
+    kernel = np.outer(ramp(n_time), ramp(n_freq))
+    return kernel / np.sum(kernel)
+
+
+def gate_mask(mag, floor, sr, hop, n_fft, prop_decrease=0.8, time_constant_s=2.0, freq_mask_smooth_hz=500,
+              time_mask_smooth_ms=50, thresh_n_mult=2, sigmoid_slope=10):
+    """
+    noisereduce's non-stationary gating mask for magnitudes `mag`
+    (rows, frames, bins). floor=None thresholds against the magnitude
+    smoothed over time_constant_s, as noisereduce does; otherwise against
+    the given floor (same shape), e.g. the logMMSE noise estimate.
+    """
+    from scipy.signal import fftconvolve, filtfilt
+
+    if floor is None:
+        t_frames = time_constant_s * sr / float(hop)
+        b = (np.sqrt(1 + 4 * t_frames ** 2) - 1) / (2 * t_frames ** 2)
+        floor = filtfilt([b], [1, b - 1], mag, axis=1, padtype=None)
+    # A bin silent for the whole chunk has no floor; keep it out of 0 / 0
+    floor = np.maximum(floor, np.finfo(np.float64).tiny)
+    with np.errstate(under='ignore'):
+        mask = 1 / (1 + np.exp(-((mag - floor) / floor - thresh_n_mult) * sigmoid_slope))
+    kernel = _smoothing_kernel(sr, hop, n_fft, freq_mask_smooth_hz, time_mask_smooth_ms)
+    if kernel is not None:
+        mask = fftconvolve(mask, kernel[np.newaxis], mode='same', axes=(1, 2))
+    return mask * prop_decrease + (1.0 - prop_decrease)
+
+
+class _Frames:
+    """logmmse's framing at one sample rate."""
+
+    def __init__(self, sr):
+        self.slen = int(math.floor(0.02 * sr))
+        self.slen += self.slen % 2
+        self.hop = self.slen // 2
+        self.n_fft = 2 * self.slen
+        win = np.hanning(self.slen)
+        self.win = win * self.hop / np.sum(win)
+        self.chunk = int(np.floor(LOGMMSE_CHUNK_SECONDS * sr))
+        # Sums over the full spectrum from rfft bins: DC and Nyquist once, the rest twice
+        self.weights = np.full(self.n_fft // 2 + 1, 2.0)
+        self.weights[[0, -1]] = 1.0
+
+    def count(self, n):
+        """Frames logmmse computes on a chunk of n samples."""
+        return max(0, n // self.hop - self.slen // self.hop)
+
+    def spectra(self, x, count):
+        frames = np.lib.stride_tricks.sliding_window_view(x, self.slen, axis=-1)[:, ::self.hop][:, :count]
+        return np.fft.rfft(frames * self.win, self.n_fft)
+
+    def initial_noise(self, x, noise_frames):
+        """Noise power from the first noise_frames non-overlapping frames, as logmmse starts."""
+        head = np.zeros((len(x), noise_frames * self.slen))
+        n = min(head.shape[1], x.shape[1])
+        head[:, :n] = x[:, :n]
+        frames = head.reshape(len(x), noise_frames, self.slen) * self.win
+        mean = np.abs(np.fft.rfft(frames, self.n_fft)).sum(axis=1)
+        # Floored like the frame powers in _logmmse_gains
+        return np.maximum((mean / noise_frames) ** 2, np.finfo(np.float64).tiny)
+
+    def synthesize(self, spec, gain, x_old):
+        """Overlap-add of the inverse frames. Returns (samples (rows, count * hop), x_old for the next chunk)."""
+        xi = np.fft.irfft(spec * gain, self.n_fft)[..., :self.slen]
+        out = xi[..., :self.hop].copy()
+        out[:, 1:] += xi[:, :-1, self.hop:]
+        out[:, 0] += x_old
+        return out.reshape(len(out), -1), xi[:, -1, self.hop:].copy()
+
+
+def _logmmse_gains(spec, noise, prev, frames, eta, track):
+    """
+    The logMMSE recursion over the frames of one chunk, every row at once.
+
+    Returns:
+        tuple: (gains, noise power per frame or None, noise, prev) with the
+        last two carried into the next chunk.
+    """
+    from scipy.special import expn
+
+    # Digital silence can leave a bin at exactly 0 (the full FFT logmmse takes
+    # rounds it to ~1e-70): 0 * an infinite gain would poison the recursion
+    power = np.maximum(np.abs(spec) ** 2, np.finfo(np.float64).tiny)
+    gains = np.empty(power.shape)
+    floors = np.empty(power.shape) if track else None
+    weights = frames.weights
+    with np.errstate(under='ignore'):
+        for t in range(power.shape[1]):
+            sig2 = power[:, t]
+            gammak = np.minimum(sig2 / noise, 40)
+            excess = (1 - _AA) * np.maximum(gammak - 1, 0)
+            ksi = np.maximum(_KSI_MIN, _AA * prev / noise + excess)
+            # Rows with no previous estimate yet start from the prior alone, unfloored
+            fresh = ~prev.all(axis=1)
+            if fresh.any():
+                ksi[fresh] = _AA + excess[fresh]
+            if track:
+                floors[:, t] = noise
+            log_sigma = gammak * ksi / (1 + ksi) - np.log(1 + ksi)
+            quiet = (log_sigma @ weights) / frames.slen < eta
+            if quiet.any():
+                noise = noise.copy()
+                noise[quiet] = _MU * noise[quiet] + (1 - _MU) * sig2[quiet]
+            a = ksi / (1 + ksi)
+            hw = a * np.exp(0.5 * expn(1, a * gammak))
+            gains[:, t] = hw
+            prev = sig2 * hw ** 2
+    return gains, floors, noise, prev
+
+
+def _run_logmmse_framing(items, sr, logmmse, gate, noise, gate_options, noise_frames=6, eta=0.15):
+    frames = _Frames(sr)
+    bounds = np.cumsum([0] + [len(item) for item in items])
+    lengths = [item.shape[1] for item in items]
+    # The logmmse wrapper's float64 + eps; batch items are padded to one length
+    eps = np.finfo(np.float64).eps
+    x = np.full((bounds[-1], max(lengths)), eps)
+    for item, lo in zip(items, bounds):
+        x[lo:lo + len(item), :item.shape[1]] += item
+
+    noise_mu2, prev = None, np.zeros((len(x), frames.n_fft // 2 + 1))
+    x_old = np.zeros((len(x), frames.hop))
+    outs = [[] for _ in items]
+    for c0 in range(0, x.shape[1], frames.chunk):
+        block = x[:, c0:c0 + frames.chunk]
+        if noise_mu2 is None:
+            noise_mu2 = frames.initial_noise(block, noise_frames)
+        count = frames.count(block.shape[1])
+        if not count:
+            continue
+        spec = frames.spectra(block, count)
+        floors = None
+        if logmmse:
+            gains, floors, noise_mu2, prev = _logmmse_gains(
+                spec, noise_mu2, prev, frames, eta, track=gate and noise == 'tracked'
+            )
+        for i, length in enumerate(lengths):
+            # Frames of this item's own chunk; padding frames of shorter items are dropped
+            n = frames.count(min(length - c0, frames.chunk)) if length > c0 else 0
+            if not n:
+                continue
+            rows = slice(bounds[i], bounds[i + 1])
+            gain = gains[rows, :n] if logmmse else 1.0
+            if gate:
+                floor = np.sqrt(floors[rows, :n]) if floors is not None else None
+                gain = gain * gate_mask(np.abs(spec[rows, :n]), floor, sr, frames.hop, frames.n_fft,
+                                        **gate_options)
+            out, x_old[rows] = frames.synthesize(spec[rows, :n], gain, x_old[rows])
+            outs[i].append(out)
+    return [np.concatenate(out, axis=1) if out else np.zeros((len(item), 0))
+            for out, item in zip(outs, items)]
+
+
+def _run_gate_framing(item, sr, gate_options):
+    """noisereduce's chunking and STFT for one item (all its channels at once)."""
+    from scipy.signal import istft, stft
+
+    hop = GATE_N_FFT // 4
+    n, pad = item.shape[1], NR_PADDING
+    # Short inputs are one chunk; longer ones are cut on a grid of full-size chunks
+    size = n if n <= NR_CHUNK_SIZE else NR_CHUNK_SIZE
+    out = np.empty_like(item)
+    for start in range(0, n, size):
+        padded = np.zeros((len(item), size + 2 * pad))
+        lo, hi = max(0, start - pad), min(n, start + size + pad)
+        padded[:, lo - start + pad:hi - start + pad] = item[:, lo:hi]
+        _, _, spec = stft(padded, nfft=GATE_N_FFT, noverlap=GATE_N_FFT - hop, nperseg=GATE_N_FFT, padded=False)
+        spec = spec.swapaxes(1, 2)
+        mask = gate_mask(np.abs(spec), None, sr, hop, GATE_N_FFT, **gate_options)
+        _, y = istft((spec * mask).swapaxes(1, 2), nfft=GATE_N_FFT, noverlap=GATE_N_FFT - hop, nperseg=GATE_N_FFT)
+        denoised = np.zeros_like(padded)
+        denoised[:, :y.shape[1]] = y[:, :padded.shape[1]]
+        end = min(n, start + size)
+        out[:, start:end] = denoised[:, pad:pad + end - start]
+    return out
+
+
+def enhance(signals, sr, logmmse=True, gate=True, framing='logmmse', noise=None, prop_decrease=0.8):
+    """
+    logMMSE and/or spectral gating in one STFT pass (see the module docstring).
+
+    signals is a (samples,) or (samples, channels) array, or a list of such
+    arrays processed as one batch, each item on its own.
+    prop_decrease is how far the gate pulls noise down (1.0: fully).
+
+    Returns:
+        The enhanced float32 signal(s), in the layout given. The 'logmmse'
+        framing returns fewer samples than it is given.
+    """
+    noise = validate_options(logmmse, gate, framing, noise)
+    batch = isinstance(signals, (list, tuple))
+    arrays = [np.asarray(s, dtype=np.float32) for s in (signals if batch else [signals])]
+    # (channels, samples) rows in float64, as both packages compute
+    items = [(a[np.newaxis] if a.ndim == 1 else a.T).astype(np.float64) for a in arrays]
+    gate_options = {**_GATE, 'prop_decrease': prop_decrease}
+
+    if framing == 'logmmse':
+        outs = _run_logmmse_framing(items, sr, logmmse, gate, noise, gate_options)
+    else:
+        outs = [_run_gate_framing(item, sr, gate_options) for item in items]
+
+    outs = [(out[0] if a.ndim == 1 else out.T).astype(np.float32) for out, a in zip(outs, arrays)]
+    return outs if batch else outs[0]
+
+
+def enhance_array(y, sr, speech_segments=None, compress=True, gain_db=6, peak_gate=False, **options):
+    """
+    The 'enhance' pipeline stage: enhance(), then enhance_voice's compressor
+    and make-up gain (compress=True) and/or noise_reduction's peak scaling
+    and gate at 0.01 (peak_gate=True).
+
+    With speech_segments ([[start_s, end_s], ...] from vad.detect_speech_array)
+    the regions are enhanced as one batch, each on its own, and everything
+    else is output as silence.
+    """
+    from .audio_processor import compress_voice
+
+    y = np.asarray(y, dtype=np.float32)
+    if speech_segments:
+        from .vad import speech_sample_ranges
+        ranges = speech_sample_ranges(speech_segments, sr, len(y))
+        regions = enhance([y[start:end] for start, end in ranges], sr, **options)
+        out = np.zeros_like(y)
+        for (start, end), region in zip(ranges, regions):
+            if compress:
+                region = compress_voice(region, sr, gain_db)
+            region = region[:end - start]
+            out[start:start + len(region)] = region
+    else:
+        out = enhance(y, sr, **options)
+        if compress:
+            out = compress_voice(out, sr, gain_db)
+
+    if peak_gate:
+        peak = np.max(np.abs(out)) if out.size else 0.0
+        if peak > 0:
+            out /= peak
+        out[np.abs(out) < 0.01] = 0
+    return out
@@ -0,0 +1,241 @@
+# feature_store.py
+"""
+One feature container per experiment instead of three .npy files per input.
+
+Layout of a store directory (media/features/experiment_<id>/):
+
+    features.bin   every array of every file, back to back
+    index.json     {"files": {"<file_id>": {"<feature>": entry}}, ...}
+
+Arrays are (rows, frames) and stored in Fortran order, so consecutive frames
+are contiguous: an uncompressed array can be opened with np.memmap and any
+time range is a single contiguous read. With compression="zlib" each array
+is split into chunks of `chunk_frames` frames that are compressed separately,
+and reads only decompress the chunks they touch. dtype="float16" halves the
+size either way.
+
+Workers run in separate processes (and, in THREADED / HYBRID runs, several
+threads), so each thread appends to its own shard (shard-<pid>-<thread>.bin
+/ .jsonl) and merge_shards() concatenates them into the final container once
+the experiment is done.
+"""
+import os
+import json
+import glob
+import zlib
+import shutil
+import threading
+
+import numpy as np
+
+DATA_FILE = 'features.bin'
+INDEX_FILE = 'index.json'
+
+DTYPES = ('float32', 'float16')
+COMPRESSIONS = (None, 'zlib')
+
+DEFAULT_OPTIONS = {'dtype': 'float32', 'compression': None, 'chunk_frames': 1024}
+
+
+def validate_store_options(options):
+    """
+    Normalise the experiment's feature_store option.
+    True -> defaults, False/None -> no store (per-file .npy), dict -> merged with defaults.
+    """
+    if options is None or options is False:
+        return None
+    if options is True:
+        return dict(DEFAULT_OPTIONS)
+    if not isinstance(options, dict):
+        raise ValueError("feature_store must be true, false or an object")
+
+    unknown = set(options) - set(DEFAULT_OPTIONS)
+    if unknown:
+        raise ValueError(f"Unknown feature_store options: {', '.join(sorted(unknown))}")
+    merged = {**DEFAULT_OPTIONS, **options}
+    if merged['dtype'] not in DTYPES:
+        raise ValueError(f"feature_store dtype must be one of: {', '.join(DTYPES)}")
+    if merged['compression'] not in COMPRESSIONS:
+        raise ValueError("feature_store compression must be null or 'zlib'")
+    if not isinstance(merged['chunk_frames'], int) or merged['chunk_frames'] <= 0:
+        raise ValueError("feature_store chunk_frames must be a positive integer")
+    return merged
+
+
+def feature_ref(store_path, file_id, feature):
+    """Reference stored in ProcessedResult.spectrogram_path, e.g. 'features/experiment_3#12/mel_spectrogram'."""
+    return f"{store_path}#{file_id}/{feature}"
+
+
+class FeatureStoreWriter:
+    """Appends the features of one file at a time to this thread's shard."""
+
+    def __init__(self, store_dir, dtype='float32', compression=None, chunk_frames=1024):
+        os.makedirs(store_dir, exist_ok=True)
+        self.dtype = np.dtype(dtype)
+        self.compression = compression
+        self.chunk_frames = chunk_frames
+        shard = os.path.join(store_dir, f"shard-{os.getpid()}-{threading.get_ident()}")
+        self.data_path, self.index_path = shard + '.bin', shard + '.jsonl'
+
+    def _write_array(self, f, arr):
+        rows, frames = arr.shape
+        entry = {'shape': [rows, frames], 'dtype': self.dtype.name, 'offset': f.tell()}
+        chunks = []
+        for a in range(0, frames, self.chunk_frames):
+            block = np.asarray(arr[:, a:a + self.chunk_frames], dtype=self.dtype).tobytes(order='F')
+            if self.compression == 'zlib':
+                block = zlib.compress(block, 6)
+                chunks.append([f.tell(), len(block)])
+            f.write(block)
+        entry['nbytes'] = f.tell() - entry['offset']
+        if self.compression:
+            entry['compression'] = self.compression
+            entry['chunk_frames'] = self.chunk_frames
+            entry['chunks'] = chunks
+        return entry
+
+    def append(self, file_id, paths, remove=True):
+        """
+        Copy {feature: path.npy} into the shard and (by default) delete the
+        .npy files. Arrays are read through a memmap, chunk by chunk.
+
+        Returns:
+            list: The feature names stored.
+        """
+        entries = {}
+        with open(self.data_path, 'ab') as f:
+            for name, path in paths.items():
+                arr = np.load(path, mmap_mode='r')
+                if arr.ndim == 1:
+                    arr = arr[np.newaxis, :]
+                entries[name] = self._write_array(f, arr)
+                del arr
+        # Index line last, so a crash never leaves an entry pointing at missing data
+        with open(self.index_path, 'a') as f:
+            f.write(json.dumps({'file_id': str(file_id), 'features': entries}) + '\n')
+
+        if remove:
+            for path in paths.values():
+                os.remove(path)
+        return list(entries)
+
+
+def merge_shards(store_dir):
+    """
+    Concatenate every shard into features.bin and rewrite index.json.
+    Safe to call again later: new shards are appended to the existing store.
+    """
+    data_path = os.path.join(store_dir, DATA_FILE)
+    index_path = os.path.join(store_dir, INDEX_FILE)
+    index = {'version': 1, 'files': {}}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+
+    shards = sorted(glob.glob(os.path.join(store_dir, 'shard-*.jsonl')))
+    if not shards and os.path.exists(index_path):
+        return index
+
+    with open(data_path, 'ab') as out:
+        for shard_index in shards:
+            shard_data = shard_index[:-len('.jsonl')] + '.bin'
+            base = out.tell()
+            with open(shard_data, 'rb') as src:
+                shutil.copyfileobj(src, out, 1 << 20)
+            with open(shard_index) as f:
+                for line in f:
+                    record = json.loads(line)
+                    for entry in record['features'].values():
+                        entry['offset'] += base
+                        for chunk in entry.get('chunks', ()):
+                            chunk[0] += base
+                    index['files'].setdefault(record['file_id'], {}).update(record['features'])
+            os.remove(shard_data)
+            os.remove(shard_index)
+
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+    return index
+
+
+class FeatureStore:
+    """
+    Read access to a merged store.
+
+    store = FeatureStore(path)
+    mel = store.load(12, 'mel_spectrogram', start=100, stop=400)   # frames 100..399
+    mfcc = store.load_all('mfcc')                                   # {file_id: array}
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.data_path = os.path.join(store_dir, DATA_FILE)
+        with open(os.path.join(store_dir, INDEX_FILE)) as f:
+            self.index = json.load(f)
+
+    def file_ids(self):
+        return list(self.index['files'])
+
+    def features(self, file_id):
+        return list(self.index['files'][str(file_id)])
+
+    def entry(self, file_id, feature):
+        try:
+            return self.index['files'][str(file_id)][feature]
+        except KeyError:
+            raise KeyError(f"No '{feature}' stored for file {file_id}")
+
+    def shape(self, file_id, feature):
+        return tuple(self.entry(file_id, feature)['shape'])
+
+    def memmap(self, file_id, feature):
+        """Zero-copy (rows, frames) view of an uncompressed array."""
+        entry = self.entry(file_id, feature)
+        if entry.get('compression'):
+            raise ValueError("Compressed arrays cannot be memory-mapped; use load()")
+        shape = tuple(entry['shape'])
+        if not shape[1]:
+            return np.zeros(shape, dtype=entry['dtype'])
+        return np.memmap(self.data_path, dtype=entry['dtype'], mode='r',
+                         offset=entry['offset'], shape=shape, order='F')
+
+    def load(self, file_id, feature, start=0, stop=None):
+        """Frames [start, stop) of one array, reading only the bytes (or chunks) needed."""
+        entry = self.entry(file_id, feature)
+        rows, frames = entry['shape']
+        start, stop, _ = slice(start, stop).indices(frames)
+        if stop <= start:
+            return np.zeros((rows, 0), dtype=entry['dtype'])
+        if not entry.get('compression'):
+            return np.array(self.memmap(file_id, feature)[:, start:stop])
+
+        step = entry['chunk_frames']
+        first, last = start // step, (stop - 1) // step
+        parts = []
+        with open(self.data_path, 'rb') as f:
+            for offset, nbytes in entry['chunks'][first:last + 1]:
+                f.seek(offset)
+                raw = zlib.decompress(f.read(nbytes))
+                parts.append(np.frombuffer(raw, dtype=entry['dtype']).reshape((rows, -1), order='F'))
+        block = np.concatenate(parts, axis=1)
+        return block[:, start - first * step:stop - first * step]
+
+    def load_all(self, feature, file_ids=None):
+        """{file_id: array} for a whole batch from a single container."""
+        ids = self.file_ids() if file_ids is None else [str(i) for i in file_ids]
+        return {i: self.load(i, feature) for i in ids if feature in self.index['files'].get(i, {})}
+
+
+def load_feature(ref, root):
+    """
+    Resolve a ProcessedResult.spectrogram_path relative to `root` (MEDIA_ROOT):
+    either a plain .npy path or a store reference made by feature_ref().
+    """
+    if '#' not in ref:
+        return np.load(os.path.join(root, ref), mmap_mode='r')
+    store_path, key = ref.split('#', 1)
+    file_id, feature = key.split('/', 1)
+    return FeatureStore(os.path.join(root, store_path)).load(file_id, feature)
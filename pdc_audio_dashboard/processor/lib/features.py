@@ -0,0 +1,207 @@
+# features.py
+"""
+Shared-STFT feature extraction: one transform per file, many features.
+
+librosa.feature.mfcc(y=...) recomputes the mel spectrogram that
+melspectrogram() already produced, and every helper in spectrogram.py used
+to reload the file. FeatureEngine instead computes a single power
+spectrogram and derives every requested feature from it. Mel filterbanks,
+DCT matrices and windows are cached per (sr, n_fft, n_mels) so repeated
+files only pay for the STFT and the matrix products.
+
+Results match librosa's defaults (centred frames, zero padding, Slaney mel,
+power_to_db with top_db=80, orthonormal DCT-II).
+"""
+import os
+from functools import lru_cache
+
+import numpy as np
+
+# Written by default, in this order
+DEFAULT_FEATURES = ('mel_spectrogram', 'mfcc', 'log_mel')
+
+# Derived from the mel power with a whole-file dB reference
+MEL_FEATURES = ('mel_spectrogram', 'log_mel', 'mfcc')
+
+# Derived frame by frame from the linear power spectrum
+FRAME_FEATURES = ('spectral_centroid', 'spectral_rolloff', 'spectral_flatness', 'rms')
+
+AVAILABLE_FEATURES = MEL_FEATURES + FRAME_FEATURES
+
+AMIN = 1e-10
+TOP_DB = 80.0
+
+
+@lru_cache(maxsize=16)
+def mel_basis(sr, n_fft, n_mels):
+    import librosa
+    return librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels)
+
+
+@lru_cache(maxsize=16)
+def dct_basis(n_mels, n_mfcc):
+    """Orthonormal DCT-II rows, so mfcc = dct_basis @ log_mel."""
+    import scipy.fft
+    return scipy.fft.dct(np.eye(n_mels), type=2, norm='ortho', axis=0)[:n_mfcc]
+
+
+@lru_cache(maxsize=16)
+def stft_window(n_fft):
+    from scipy.signal import get_window
+    return get_window('hann', n_fft, fftbins=True)
+
+
+def validate_features(features):
+    unknown = [f for f in features if f not in AVAILABLE_FEATURES]
+    if unknown:
+        raise ValueError(f"Unknown features: {', '.join(unknown)}. Available: {', '.join(AVAILABLE_FEATURES)}")
+
+
+class FeatureEngine:
+    def __init__(self, sr=16000, n_fft=2048, hop_length=512, n_mels=128, n_mfcc=13,
+                 features=DEFAULT_FEATURES):
+        validate_features(features)
+        self.sr, self.n_fft, self.hop_length = sr, n_fft, hop_length
+        self.n_mels, self.n_mfcc = n_mels, n_mfcc
+        self.features = tuple(features)
+        self.freqs = np.fft.rfftfreq(n_fft, 1.0 / sr)
+
+    @property
+    def needs_mel(self):
+        return any(f in MEL_FEATURES for f in self.features)
+
+    # -- transform ---------------------------------------------------------
+
+    def n_frames(self, n_samples):
+        return 1 + n_samples // self.hop_length
+
+    def frame_power(self, frames):
+        """|rfft|^2 of already framed (n_frames, n_fft) samples -> (bins, n_frames)."""
+        return (np.abs(np.fft.rfft(frames * stft_window(self.n_fft), axis=1)) ** 2).T
+
+    def power_spectrogram(self, y, regions=None):
+        """
+        Centred power spectrogram (bins, frames), as |librosa.stft(y)|**2.
+
+        regions: optional [(start, end), ...] sample ranges. Only frames
+        around them are transformed; all other frames are left at zero.
+        """
+        import librosa
+        if not regions:
+            return np.abs(librosa.stft(y, n_fft=self.n_fft, hop_length=self.hop_length)) ** 2
+
+        hop = self.hop_length
+        n_frames = self.n_frames(len(y))
+        power = np.zeros((1 + self.n_fft // 2, n_frames), dtype=np.float32)
+        for start, end in regions:
+            f0, f1 = start // hop, min(n_frames - 1, -(-end // hop))
+            S = np.abs(librosa.stft(y[f0 * hop:f1 * hop], n_fft=self.n_fft, hop_length=hop)) ** 2
+            power[:, f0:f0 + S.shape[1]] = S[:, :n_frames - f0]
+        return power
+
+    def frame_sources(self, regions, first, last, n):
+        """
+        Sample range [lo, hi) each frame in [first, last) of an n sample
+        signal is transformed from by power_spectrogram(y, regions); (0, 0)
+        for frames outside every region, which stay at zero power.
+        """
+        hop, n_frames = self.hop_length, self.n_frames(n)
+        lo, hi = np.zeros(last - first, np.int64), np.zeros(last - first, np.int64)
+        for start, end in regions:
+            f0, f1 = start // hop, min(n_frames - 1, -(-end // hop))
+            # Same frames (and overwrite order) as power_spectrogram's per-region STFTs
+            s, e = max(f0, first), min(f1 + 1, n_frames, last)
+            if s < e:
+                lo[s - first:e - first], hi[s - first:e - first] = f0 * hop, f1 * hop
+        return lo, hi
+
+    # -- derived features --------------------------------------------------
+
+    def mel_power(self, power):
+        return mel_basis(self.sr, self.n_fft, self.n_mels) @ power
+
+    def mel_features(self, mel_power, max_db=None):
+        """
+        dB-scaled mel features. max_db is the whole-file peak in dB; pass it
+        when mel_power is only a chunk of the file.
+        """
+        log_power = 10 * np.log10(np.maximum(AMIN, mel_power))
+        if max_db is None:
+            max_db = float(log_power.max()) if log_power.size else 0.0
+        out = {}
+        if 'mel_spectrogram' in self.features:
+            out['mel_spectrogram'] = np.maximum(log_power - max_db, -TOP_DB)  # power_to_db(ref=np.max)
+        log_mel = np.maximum(log_power, max_db - TOP_DB)                       # power_to_db()
+        if 'log_mel' in self.features:
+            out['log_mel'] = log_mel
+        if 'mfcc' in self.features:
+            out['mfcc'] = dct_basis(self.n_mels, self.n_mfcc) @ log_mel
+        return out
+
+    def frame_features(self, power):
+        """Per-frame features that need no whole-file statistics."""
+        out = {}
+        magnitude = None
+        if 'spectral_centroid' in self.features or 'spectral_rolloff' in self.features:
+            magnitude = np.sqrt(power)
+            total = np.maximum(magnitude.sum(axis=0), AMIN)
+        if 'spectral_centroid' in self.features:
+            out['spectral_centroid'] = (self.freqs @ magnitude / total)[np.newaxis, :]
+        if 'spectral_rolloff' in self.features:
+            cumulative = np.cumsum(magnitude, axis=0)
+            idx = np.argmax(cumulative >= 0.85 * total, axis=0)
+            out['spectral_rolloff'] = self.freqs[idx][np.newaxis, :]
+        if 'spectral_flatness' in self.features:
+            p = np.maximum(AMIN, power)
+            out['spectral_flatness'] = (np.exp(np.mean(np.log(p), axis=0)) / np.mean(p, axis=0))[np.newaxis, :]
+        if 'rms' in self.features:
+            # librosa.feature.rms(S=...) for an even n_fft
+            energy = 2 * np.sum(power, axis=0) - power[0] - power[-1]
+            out['rms'] = np.sqrt(np.maximum(energy, 0) / self.n_fft ** 2)[np.newaxis, :]
+        return out
+
+    def from_power(self, power):
+        out = {}
+        if self.needs_mel:
+            out.update(self.mel_features(self.mel_power(power)))
+        out.update(self.frame_features(power))
+        return {name: out[name] for name in self.features}
+
+    def compute(self, y, regions=None):
+        """All requested features of a mono signal from one STFT."""
+        return self.from_power(self.power_spectrogram(y, regions))
+
+
+def write_features(engine, chunks, n_frames, max_power, folder, base_name, artifacts):
+    """
+    Write <base_name>_<feature>.npy files from raw frame rows computed piece
+    by piece (the streaming and segmented runners). Each chunk maps
+    'mel_power' and the frame features to (frames, rows) arrays, in frame
+    order; max_power is the largest mel power of the whole file, which sets
+    the dB reference of the mel features.
+    """
+    from numpy.lib.format import open_memmap
+
+    rows = {'mfcc': engine.n_mfcc, 'mel_spectrogram': engine.n_mels, 'log_mel': engine.n_mels}
+    outputs = {}
+    for name in engine.features:
+        path = os.path.join(folder, f"{base_name}_{name}.npy")
+        # Fortran order so each chunk of frames is a contiguous write
+        outputs[name] = open_memmap(path, mode='w+', dtype=np.float32,
+                                    shape=(rows.get(name, 1), n_frames), fortran_order=True)
+        artifacts[name] = path
+
+    max_db = 10 * np.log10(max(AMIN, max_power))
+    a = 0
+    for chunk in chunks:
+        count = len(next(iter(chunk.values()))) if chunk else 0
+        if engine.needs_mel:
+            mel = engine.mel_features(np.asarray(chunk['mel_power']).T.astype(np.float64), max_db)
+            for name, feat in mel.items():
+                outputs[name][:, a:a + count] = feat
+        for name in engine.features:
+            if name not in MEL_FEATURES:
+                outputs[name][:, a:a + count] = np.asarray(chunk[name]).T
+        a += count
+    for arr in outputs.values():
+        arr.flush()
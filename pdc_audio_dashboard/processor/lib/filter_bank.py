@@ -0,0 +1,246 @@
+# filter_bank.py
+"""
+Cached second-order-section (SOS) filter designs and cascades.
+
+Designing a Butterworth or notch filter costs far more than running it on a
+short clip, and the pipeline asks for the same few designs for every file.
+Designs are therefore cached per (type, cutoffs, order, sr). Everything is
+kept in SOS form, which stays numerically stable at orders and cutoffs where
+the (b, a) polynomial form used by lfilter/filtfilt loses precision, and
+every call filters all channels of a (samples, channels) array at once.
+
+A FilterBank chains several designs (e.g. voice bandpass + 50 Hz notch and
+its harmonics) into one cascade that is applied in a single pass. Designs
+added with zero_phase=True run forward and backward like filtfilt; when
+filtering block by block, such a run holds back enough samples for the
+backward pass to settle, so streamed output still matches apply().
+"""
+from functools import lru_cache
+
+import numpy as np
+from scipy.signal import butter, iirnotch, sosfilt, sosfilt_zi, sosfiltfilt, tf2sos
+
+
+def _normalize(cutoff, sr):
+    # Keep cutoffs strictly below Nyquist, as butter_filter always has
+    nyq = 0.5 * sr
+    if isinstance(cutoff, (list, tuple)):
+        return tuple(min(f / nyq, 0.999) for f in cutoff)
+    return min(cutoff / nyq, 0.999)
+
+
+@lru_cache(maxsize=128)
+def _design(ftype, cutoffs, order, sr):
+    if ftype == 'notch':
+        freq, Q = cutoffs
+        return tf2sos(*iirnotch(w0=freq / (sr / 2), Q=Q))
+    return butter(order, _normalize(cutoffs, sr), btype=ftype, output='sos')
+
+
+def design_sos(ftype, cutoffs, order=5, sr=16000):
+    """
+    Return the (cached) SOS matrix for a filter.
+
+    Args:
+        ftype (str): 'low', 'high', 'band' or 'notch'.
+        cutoffs: Cutoff in Hz, [low, high] for 'band', (freq, Q) for 'notch'.
+        order (int): Butterworth order (ignored for notches).
+        sr (int): Sample rate in Hz.
+
+    Returns:
+        np.ndarray: (n_sections, 6) array shared between callers; do not
+        modify it in place.
+    """
+    if isinstance(cutoffs, list):
+        cutoffs = tuple(cutoffs)
+    if ftype == 'notch':
+        order = 2
+    return _design(ftype, cutoffs, int(order), int(sr))
+
+
+def hum_notch_sos(sr, hum_freq=50.0, Q=30.0, harmonics=1):
+    """
+    Notches at hum_freq and its first `harmonics - 1` overtones, skipping any
+    that would land at or above Nyquist.
+    """
+    sections = [
+        design_sos('notch', (k * hum_freq, Q), sr=sr)
+        for k in range(1, int(harmonics) + 1)
+        if k * hum_freq < sr / 2
+    ]
+    return np.vstack(sections) if sections else np.zeros((0, 6))
+
+
+class _CausalRun:
+    """Consecutive causal sections, filtered with their state carried across blocks."""
+
+    def __init__(self, sos):
+        self.sos = sos
+        self._zi = None
+
+    def apply(self, data):
+        return sosfilt(self.sos, data, axis=0)
+
+    def process(self, block):
+        if self._zi is None:
+            self._zi = np.zeros((len(self.sos), 2) + block.shape[1:])
+        out, self._zi = sosfilt(self.sos, block, axis=0, zi=self._zi)
+        return out
+
+    def flush(self):
+        return None
+
+
+class _ZeroPhaseRun:
+    """
+    Consecutive zero-phase sections. Block by block this reproduces
+    sosfiltfilt's odd-extension edges exactly and runs the backward pass over
+    a lookahead long enough for its start-up transient to decay below 1e-12.
+    """
+
+    def __init__(self, sos):
+        self.sos = sos
+        ntaps = 2 * len(sos) + 1 - min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+        self.edge = 3 * ntaps  # sosfiltfilt's default padlen
+        radius = max((np.abs(np.roots(section[3:])).max() for section in sos), default=0.0)
+        self.lookahead = int(np.ceil(np.log(1e-12) / np.log(radius))) if 0 < radius < 1 else self.edge
+        self._zi = sosfilt_zi(sos)
+        self._state = None
+        self._head = None   # input until the leading edge extension can be built
+        self._tail = None   # last edge + 1 input samples, for the trailing extension
+        self._fwd = None    # forward-filtered samples not yet emitted
+
+    def apply(self, data):
+        return sosfiltfilt(self.sos, data, axis=0)
+
+    def _initial(self, x0):
+        return self._zi.reshape(self._zi.shape + (1,) * (x0.ndim)) * x0
+
+    def _forward(self, x):
+        y, self._state = sosfilt(self.sos, x, axis=0, zi=self._state)
+        self._fwd = y if self._fwd is None else np.concatenate([self._fwd, y])
+
+    def _backward(self, y):
+        out, _ = sosfilt(self.sos, y[::-1], axis=0, zi=self._initial(y[-1]))
+        return out[::-1]
+
+    def process(self, block):
+        if self._state is None:
+            self._head = block if self._head is None else np.concatenate([self._head, block])
+            if len(self._head) <= self.edge:
+                return block[:0]
+            block, self._head = self._head, None
+            ext = 2 * block[0] - block[self.edge:0:-1]
+            self._state = self._initial(ext[0])
+            self._forward(ext)
+            self._fwd = self._fwd[:0]
+        self._tail = block[-(self.edge + 1):] if self._tail is None else \
+            np.concatenate([self._tail, block])[-(self.edge + 1):]
+        self._forward(block)
+        ready = len(self._fwd) - self.lookahead
+        if ready <= 0:
+            return block[:0]
+        out = self._backward(self._fwd)[:ready]
+        self._fwd = self._fwd[ready:]
+        return out
+
+    def flush(self):
+        if self._state is None:
+            # Too short to stream; sosfiltfilt raises exactly as apply() would
+            return None if self._head is None else self.apply(self._head)
+        x = self._tail
+        self._forward(2 * x[-1] - x[-2::-1])
+        return self._backward(self._fwd)[:-self.edge]
+
+
+class FilterBank:
+    """
+    An ordered cascade of SOS filters applied as one filter.
+
+    bank = FilterBank(16000).bandpass(80, 3500).hum_notch(50.0, harmonics=3)
+    y = bank.apply(y)
+    """
+
+    def __init__(self, sr):
+        self.sr = sr
+        self._sections = []
+        self._runs = None
+
+    def add(self, sos, zero_phase=False):
+        if sos is not None and len(sos):
+            self._sections.append((np.asarray(sos), zero_phase))
+            self._runs = None
+        return self
+
+    def lowpass(self, high_cut, order=5):
+        return self.add(design_sos('low', min(high_cut, self.sr / 2 - 1), order, self.sr))
+
+    def highpass(self, low_cut, order=5):
+        return self.add(design_sos('high', low_cut, order, self.sr))
+
+    def bandpass(self, low_cut, high_cut, order=5):
+        return self.add(design_sos('band', (low_cut, min(high_cut, self.sr / 2 - 1)), order, self.sr))
+
+    def hum_notch(self, hum_freq=50.0, Q=30.0, harmonics=1):
+        return self.add(hum_notch_sos(self.sr, hum_freq, Q, harmonics))
+
+    @property
+    def sos(self):
+        if not self._sections:
+            return np.zeros((0, 6))
+        return np.vstack([sos for sos, _ in self._sections])
+
+    def __len__(self):
+        return sum(len(sos) for sos, _ in self._sections)
+
+    def _build_runs(self):
+        # Adjacent sections of the same kind run as one cascade
+        runs = []
+        for sos, zero_phase in self._sections:
+            if runs and runs[-1][1] == zero_phase:
+                runs[-1] = (np.vstack([runs[-1][0], sos]), zero_phase)
+            else:
+                runs.append((sos, zero_phase))
+        return [_ZeroPhaseRun(sos) if zero_phase else _CausalRun(sos) for sos, zero_phase in runs]
+
+    def apply(self, data, zero_phase=False):
+        """
+        Filter a (samples,) or (samples, channels) array in one call.
+        zero_phase=True runs the whole cascade forward and backward (like
+        filtfilt); otherwise only the sections added with zero_phase=True are.
+        """
+        if not len(self):
+            return data
+        if zero_phase:
+            return sosfiltfilt(self.sos, data, axis=0)
+        for run in self._build_runs():
+            data = run.apply(data)
+        return data
+
+    def process_block(self, block):
+        """
+        Filter consecutive blocks, carrying state across calls. Zero-phase
+        sections hold samples back; flush() returns them at the end.
+        """
+        if not len(self) or not len(block):
+            return block
+        if self._runs is None:
+            self._runs = self._build_runs()
+        for run in self._runs:
+            if not len(block):
+                break
+            block = run.process(block)
+        return block
+
+    def flush(self):
+        """The samples process_block still holds back, once the input has ended."""
+        if not self._runs:
+            return None
+        out = None
+        for run in self._runs:
+            if out is not None and len(out):
+                out = run.process(out)
+            tail = run.flush()
+            if tail is not None and len(tail):
+                out = tail if out is None or not len(out) else np.concatenate([out, tail])
+        return out
@@ -1,9 +1,8 @@
 # hum_reduction.py
 import numpy as np
-from scipy.signal import iirnotch, filtfilt
-import soundfile as sf
+from .filter_bank import FilterBank
 
-def remove_hum(input_path, output_path, hum_freq=50.0, Q=30.0):
+def remove_hum(input_path, output_path, hum_freq=50.0, Q=30.0, harmonics=1):
     """
     Remove electrical hum (50/60 Hz) from audio using a notch filter.
     
@@ -12,24 +11,25 @@ def remove_hum(input_path, output_path, hum_freq=50.0, Q=30.0):
         output_path (str): Path to save cleaned WAV
         hum_freq (float): Frequency to remove (50 or 60 Hz)
         Q (float): Quality factor, higher = narrower notch
+        harmonics (int): Also notch 2*hum_freq ... harmonics*hum_freq
     """
+    import soundfile as sf
+
     data, sr = sf.read(input_path)
     
     # Handle stereo
     if len(data.shape) == 2:
         data = data.mean(axis=1)  # convert to mono
 
-    # Design notch filter
-    b, a = iirnotch(w0=hum_freq/(sr/2), Q=Q)
-    filtered = filtfilt(b, a, data)
+    # Cached notch cascade, run forward-backward like filtfilt
+    filtered = FilterBank(sr).hum_notch(hum_freq, Q, harmonics).apply(data, zero_phase=True)
 
     # Save
     sf.write(output_path, filtered, sr)
     print(f"Hum removed: {output_path}")
 
 # Add below existing functions
-def remove_hum_array(data, sr, hum_freq=50.0, Q=30.0):
+def remove_hum_array(data, sr, hum_freq=50.0, Q=30.0, harmonics=1):
     if data.ndim > 1:
         data = data.mean(axis=1)
-    b, a = iirnotch(w0=hum_freq/(sr/2), Q=Q)
-    return filtfilt(b, a, data)
+    return FilterBank(sr).hum_notch(hum_freq, Q, harmonics).apply(data, zero_phase=True)
@@ -1,8 +1,9 @@
 import numpy as np
-from scipy.io.wavfile import read, write
-from logmmse import logmmse_from_file
+from logmmse import logmmse, logmmse_from_file
 
 def noise_reduction(input_wav_path, output_wav_path):
+    from scipy.io.wavfile import read, write
+
     fs, _ = read(input_wav_path)
     processed_audio = logmmse_from_file(input_wav_path)
 
@@ -13,3 +14,30 @@ def noise_reduction(input_wav_path, output_wav_path):
 
     write(output_wav_path, fs, processed_audio)
     print(f"Noise-reduced audio saved to: {output_wav_path}")
+
+
+def noise_reduction_array(data, sr, speech_segments=None):
+    """
+    In-memory variant of noise_reduction: same logMMSE + peak scaling + gate,
+    but on a float array instead of a WAV file.
+
+    With speech_segments ([[start_s, end_s], ...] from vad.detect_speech_array)
+    logMMSE only runs over those regions; everything else is output as silence.
+    """
+    data = np.asarray(data, dtype=np.float32)
+    if speech_segments:
+        from .vad import speech_sample_ranges
+        processed_audio = np.zeros_like(data)
+        for start, end in speech_sample_ranges(speech_segments, sr, len(data)):
+            region = logmmse(data[start:end], sr)
+            processed_audio[start:start + len(region)] = region
+    else:
+        processed_audio = logmmse(data, sr)
+
+    processed_audio = processed_audio.astype(np.float32)
+    peak = np.max(np.abs(processed_audio)) if processed_audio.size else 0.0
+    if peak > 0:
+        processed_audio /= peak
+
+    processed_audio[np.abs(processed_audio) < 0.01] = 0
+    return processed_audio
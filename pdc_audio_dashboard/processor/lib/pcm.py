@@ -0,0 +1,119 @@
+# pcm.py
+"""
+Random access to decoded samples without decoding the whole file.
+
+The data chunk of an uncompressed WAV is memory-mapped, so reading frames
+[start, stop) only touches those pages. Other formats libsndfile can seek
+in (FLAC, AIFF, W64, ...) are read with SoundFile.seek. Samples come back
+as float32 scaled like AudioProcessor's decode (segment_to_array): (frames,)
+for mono, (frames, channels) otherwise.
+"""
+import os
+import struct
+
+import numpy as np
+
+# (format tag, bits) -> sample dtype; 24-bit and compressed data use soundfile
+_WAV_DTYPES = {
+    (1, 8): np.dtype('u1'),
+    (1, 16): np.dtype('<i2'),
+    (1, 32): np.dtype('<i4'),
+    (3, 32): np.dtype('<f4'),
+    (3, 64): np.dtype('<f8'),
+}
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def _wav_layout(path):
+    """(dtype, channels, sr, data offset, frames) of a plain RIFF/WAVE file, or None."""
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            return None
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            tag, size = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+            if tag == b'fmt ':
+                data = f.read(size)
+                if len(data) < 16:
+                    return None
+                format_tag, channels, sr, _, block_align, bits = struct.unpack('<HHIIHH', data[:16])
+                if format_tag == _WAVE_FORMAT_EXTENSIBLE and len(data) >= 26:
+                    format_tag = struct.unpack('<H', data[24:26])[0]  # first bytes of the sub-format GUID
+                fmt = (format_tag, channels, sr, bits, block_align)
+                f.seek(size % 2, 1)
+            elif tag == b'data':
+                if fmt is None:
+                    return None
+                format_tag, channels, sr, bits, block_align = fmt
+                dtype = _WAV_DTYPES.get((format_tag, bits))
+                if dtype is None or not channels or block_align != channels * dtype.itemsize:
+                    return None
+                offset = f.tell()
+                # Streamed writers leave the size at 0 or 0xFFFFFFFF; trust the file length then
+                available = file_size - offset
+                size = available if size in (0, 0xFFFFFFFF) else min(size, available)
+                return dtype, channels, sr, offset, size // block_align
+            else:
+                f.seek(size + size % 2, 1)
+
+
+class PCMReader:
+    def __init__(self, path):
+        self.path = path
+        layout = _wav_layout(path)
+        if layout is not None:
+            dtype, self.channels, self.sr, offset, self.frames = layout
+            self._map = np.memmap(path, dtype=dtype, mode='r', offset=offset,
+                                  shape=(self.frames, self.channels))
+            self._dtype = dtype
+        else:
+            import soundfile as sf
+            try:
+                info = sf.info(path)
+            except RuntimeError as e:
+                raise ValueError(f"Cannot seek in {os.path.basename(path)}: {e}")
+            if not info.frames:
+                raise ValueError(f"{os.path.basename(path)} has no frame count, it cannot be read by offset")
+            self.channels, self.sr, self.frames = info.channels, info.samplerate, info.frames
+            self._map = None
+
+    @property
+    def memory_mapped(self):
+        return self._map is not None
+
+    def _scale(self, block):
+        if self._dtype.kind == 'f':
+            return block.astype(np.float32)
+        if self._dtype.kind == 'u':
+            return (block.astype(np.float32) - 128) / np.float32(128)
+        return block.astype(np.float32) / np.float32(2 ** (8 * self._dtype.itemsize - 1))
+
+    def read(self, start, stop):
+        """Frames [start, stop); frames past the end of the file read as silence."""
+        start, stop = max(0, int(start)), max(0, int(stop))
+        end = min(stop, self.frames)
+        if self._map is not None:
+            block = self._scale(self._map[start:end]) if end > start else np.zeros((0, self.channels), np.float32)
+        else:
+            import soundfile as sf
+            with sf.SoundFile(self.path) as f:
+                f.seek(min(start, self.frames))
+                block = f.read(max(0, end - start), dtype='float32', always_2d=True)
+        if stop - start > len(block):
+            block = np.concatenate([block, np.zeros((stop - start - len(block), self.channels), np.float32)])
+        return block[:, 0] if self.channels == 1 else block
+
+
+def memory_mappable(path):
+    """True for a plain WAV whose samples open_pcm maps instead of decoding."""
+    return _wav_layout(path) is not None
+
+
+def open_pcm(path):
+    """PCMReader for `path`; ValueError if its samples cannot be read by offset."""
+    return PCMReader(path)
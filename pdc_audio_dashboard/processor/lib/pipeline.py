@@ -0,0 +1,417 @@
+# pipeline.py
+"""
+Declarative description of the audio cleaning chain.
+
+A pipeline is a JSON-serialisable list of named stages, executed in order:
+
+    [
+        {"stage": "trim_silence", "params": {"min_silence_len": 100, "silence_thresh": -40}},
+        {"stage": "noise_reduction"},
+        {"stage": "resample", "params": {"target_sr": 16000}},
+        ...
+    ]
+
+A bare string ("noise_reduction") is shorthand for a stage with default params.
+Stages can be reordered, dropped or re-parameterised per experiment.
+
+Runs of adjacent linear stages (mono downmix, low/high/band-pass, hum notch)
+are fused into one second-order-section cascade (lib/filter_bank.py), so the signal is downmixed
+once and traversed by a single filter pass instead of one pass per stage.
+
+plan_rates() rewrites a definition so the mono downmix and the resample run
+ahead of rate-flexible stages (logMMSE noise reduction): those then run once
+on the downmix at the target rate instead of per channel at the input rate.
+
+This module only imports the DSP stack lazily (inside each stage), so it is
+cheap to import from Django views for validation.
+"""
+import os
+import copy
+import inspect
+
+_STAGES = {}
+
+
+def stage(name, linear=False, downmix=False, validate=None, checkpoint=True, rate_flexible=False,
+          zero_phase=False):
+    """
+    Register a pipeline stage.
+
+    Regular stages are called as fn(y, sr, ctx, **params) and return (y, sr).
+    Linear stages are called as fn(sr, **params) and return the SOS sections
+    they contribute to a fused filter cascade (or None for a pure downmix).
+    validate, if given, is called with the stage params and raises ValueError
+    for values the signature check cannot catch. Stages that write files
+    pass checkpoint=False (see lib/checkpoints.py). rate_flexible stages work
+    on any sample rate and channel count, so plan_rates() may downmix and
+    resample ahead of them. zero_phase linear stages are filtered forward and
+    backward (like filtfilt) inside the fused cascade.
+    """
+    def register(fn):
+        _STAGES[name] = {'fn': fn, 'linear': linear, 'downmix': downmix, 'validate': validate,
+                         'checkpoint': checkpoint, 'rate_flexible': rate_flexible,
+                         'zero_phase': zero_phase}
+        return fn
+    return register
+
+
+# ---------------------------------------------------------------------------
+# Regular stages
+# ---------------------------------------------------------------------------
+
+@stage('trim_silence')
+def _trim_silence(y, sr, ctx, min_silence_len=100, silence_thresh=-40):
+    from .trim_silence import trim_silence_array
+    y, ctx['nonsilent_ranges'] = trim_silence_array(
+        y, sr, min_silence_len, silence_thresh, return_ranges=True
+    )
+    return y, sr
+
+
+@stage('vad')
+def _vad(y, sr, ctx, aggressiveness=2, padding_ms=300):
+    """
+    Mark speech regions. The signal is untouched; noise_reduction,
+    enhance_voice and features then only process ctx['speech_segments'].
+    """
+    from .vad import detect_speech_array, speech_fraction
+    segments = detect_speech_array(y, sr, aggressiveness=aggressiveness, padding_ms=padding_ms)
+    ctx['artifacts']['speech_fraction'] = speech_fraction(segments, len(y) / sr)
+    # A recording with no detected speech is processed in full rather than muted
+    ctx['speech_segments'] = segments or None
+    return y, sr
+
+
+@stage('noise_reduction', rate_flexible=True)
+def _noise_reduction(y, sr, ctx):
+    from .noise_reduction import noise_reduction_array
+    return noise_reduction_array(y, sr, speech_segments=ctx.get('speech_segments')), sr
+
+
+@stage('resample')
+def _resample(y, sr, ctx, target_sr=16000):
+    from .resample import resample_array
+    return resample_array(y, sr, target_sr=target_sr), target_sr
+
+
+@stage('repair_clipping')
+def _repair_clipping(y, sr, ctx, threshold=0.99):
+    from .clipping import declip
+    y, ctx['artifacts']['clipping'] = declip(y, threshold=threshold)
+    return y, sr
+
+
+@stage('enhance_voice')
+def _enhance_voice(y, sr, ctx, target_sr=16000, gain_db=6):
+    from .audio_processor import enhance_voice_array
+    return enhance_voice_array(y, sr, target_sr=target_sr, gain_db=gain_db,
+                               speech_segments=ctx.get('speech_segments'))
+
+
+def _validate_enhance(params):
+    from .enhancement import validate_options
+    validate_options(**{k: params[k] for k in ('logmmse', 'gate', 'framing', 'noise') if k in params})
+    if not 0 <= params.get('prop_decrease', 0.8) <= 1:
+        raise ValueError("'prop_decrease' must be between 0 and 1")
+
+
+@stage('enhance', validate=_validate_enhance, rate_flexible=True)
+def _enhance(y, sr, ctx, logmmse=True, gate=True, framing='logmmse', noise=None, prop_decrease=0.8,
+             compress=True, gain_db=6, peak_gate=False):
+    """
+    noise_reduction and enhance_voice's gate in one STFT pass (lib/enhancement.py).
+    gate=False, compress=False, peak_gate=True is noise_reduction;
+    logmmse=False, framing='gate' after mono and resample is enhance_voice.
+    """
+    from .enhancement import enhance_array
+    return enhance_array(y, sr, speech_segments=ctx.get('speech_segments'), compress=compress, gain_db=gain_db,
+                         peak_gate=peak_gate, logmmse=logmmse, gate=gate, framing=framing, noise=noise,
+                         prop_decrease=prop_decrease), sr
+
+
+@stage('normalize_peak')
+def _normalize_peak(y, sr, ctx, target_dBFS=-1.0):
+    from .audio_normalization import normalize_peak_array
+    return normalize_peak_array(y, target_dBFS=target_dBFS), sr
+
+
+@stage('normalize_lufs')
+def _normalize_lufs(y, sr, ctx, target_lufs=-23.0):
+    """EBU R128 loudness normalization; records the output's loudness and true peak."""
+    from .loudness import LoudnessMeter, loudness_gain, loudness_stats
+    meter = LoudnessMeter(sr, 1 if y.ndim == 1 else y.shape[1])
+    meter.add(y)
+    gain_db = loudness_gain(meter.integrated_loudness(), target_lufs)
+    ctx['artifacts'].update(loudness_stats(meter, gain_db))
+    return (y * 10 ** (gain_db / 20)).astype(y.dtype, copy=False), sr
+
+
+def _validate_features(params):
+    from .features import validate_features
+    features = params.get('features')
+    if features is not None:
+        if not isinstance(features, (list, tuple)) or not features:
+            raise ValueError("'features' must be a non-empty list of feature names")
+        validate_features(features)
+
+
+@stage('features', validate=_validate_features, checkpoint=False)
+def _features(y, sr, ctx, sr_features=16000, n_mels=128, n_mfcc=13, hop_length=512, n_fft=2048,
+              features=None):
+    import numpy as np
+    from .features import DEFAULT_FEATURES, FeatureEngine
+    from .resample import resample_array
+
+    # Features are a side output, the signal itself passes through untouched
+    mono = y.mean(axis=1) if y.ndim > 1 else y
+    if sr != sr_features:
+        mono = resample_array(mono, sr, sr_features)
+
+    engine = FeatureEngine(sr_features, n_fft=n_fft, hop_length=hop_length, n_mels=n_mels,
+                           n_mfcc=n_mfcc, features=features or DEFAULT_FEATURES)
+    regions = None
+    segments = ctx.get('speech_segments')
+    if segments:
+        # Only transform frames around speech; the rest stay at zero power
+        from .vad import speech_sample_ranges
+        regions = speech_sample_ranges(segments, sr_features, len(mono))
+
+    folder, base_name = ctx['output_folder'], ctx['base_name']
+    ctx['artifacts']['feature_frame_rate'] = sr_features / hop_length
+    for name, feat in engine.compute(mono, regions).items():
+        path = os.path.join(folder, f"{base_name}_{name}.npy")
+        np.save(path, feat)
+        ctx['artifacts'][name] = path
+    return y, sr
+
+
+# ---------------------------------------------------------------------------
+# Linear (fusable) stages
+# ---------------------------------------------------------------------------
+
+@stage('mono', linear=True, downmix=True)
+def _mono(sr):
+    return None
+
+
+@stage('bandpass', linear=True)
+def _bandpass(sr, low_cut=80, high_cut=3500, order=5):
+    from .filter_bank import design_sos
+    return design_sos('band', (low_cut, min(high_cut, sr / 2 - 1)), order, sr)
+
+
+@stage('lowpass', linear=True)
+def _lowpass(sr, high_cut=8000, order=5):
+    from .filter_bank import design_sos
+    return design_sos('low', min(high_cut, sr / 2 - 1), order, sr)
+
+
+@stage('highpass', linear=True)
+def _highpass(sr, low_cut=80, order=5):
+    from .filter_bank import design_sos
+    return design_sos('high', low_cut, order, sr)
+
+
+@stage('hum_removal', linear=True, downmix=True, zero_phase=True)
+def _hum_removal(sr, hum_freq=50.0, Q=30.0, harmonics=1):
+    from .filter_bank import hum_notch_sos
+    return hum_notch_sos(sr, hum_freq, Q, harmonics)
+
+
+def _build_filter_bank(sr, group):
+    from .filter_bank import FilterBank
+    bank = FilterBank(sr)
+    for name, params in group:
+        bank.add(_STAGES[name]['fn'](sr, **params), zero_phase=_STAGES[name]['zero_phase'])
+    return bank
+
+
+def _run_linear_group(y, sr, group):
+    """Downmix once (if any stage asks for it), then run one SOS cascade (see FilterBank.apply)."""
+    if y.ndim > 1 and any(_STAGES[name]['downmix'] for name, _ in group):
+        y = y.mean(axis=1)
+    return _build_filter_bank(sr, group).apply(y), sr
+
+
+# ---------------------------------------------------------------------------
+# Definition handling
+# ---------------------------------------------------------------------------
+
+def default_pipeline(min_silence_len=100, silence_thresh=-40, target_sr=16000, hum_freq=50.0):
+    """The historical ten-step chain of AudioProcessor.process_audio."""
+    return [
+        {"stage": "trim_silence", "params": {"min_silence_len": min_silence_len, "silence_thresh": silence_thresh}},
+        {"stage": "vad", "params": {"aggressiveness": 2}},
+        {"stage": "noise_reduction", "params": {}},
+        {"stage": "resample", "params": {"target_sr": target_sr}},
+        {"stage": "mono", "params": {}},
+        {"stage": "repair_clipping", "params": {"threshold": 0.99}},
+        {"stage": "bandpass", "params": {"low_cut": 80, "high_cut": 3500}},
+        {"stage": "hum_removal", "params": {"hum_freq": hum_freq, "Q": 30.0, "harmonics": 3}},
+        {"stage": "enhance_voice", "params": {"gain_db": 6}},
+        {"stage": "normalize_peak", "params": {"target_dBFS": -1.0}},
+        {"stage": "features", "params": {}},
+    ]
+
+
+DEFAULT_PIPELINE = default_pipeline()
+
+
+def available_stages():
+    return sorted(_STAGES)
+
+
+def validate_pipeline(definition):
+    """
+    Normalise a pipeline definition to a list of {"stage", "params"} dicts.
+    Raises ValueError for unknown stages or parameters.
+    """
+    if not isinstance(definition, (list, tuple)) or not definition:
+        raise ValueError("Pipeline must be a non-empty list of stages")
+
+    normalized = []
+    for entry in definition:
+        if isinstance(entry, str):
+            entry = {"stage": entry}
+        if not isinstance(entry, dict) or 'stage' not in entry:
+            raise ValueError(f"Invalid pipeline entry: {entry!r}")
+
+        name = entry['stage']
+        if name not in _STAGES:
+            raise ValueError(f"Unknown stage '{name}'. Available: {', '.join(available_stages())}")
+
+        params = entry.get('params') or {}
+        if not isinstance(params, dict):
+            raise ValueError(f"Params for stage '{name}' must be an object")
+
+        accepted = set(inspect.signature(_STAGES[name]['fn']).parameters) - {'y', 'sr', 'ctx'}
+        unknown = set(params) - accepted
+        if unknown:
+            raise ValueError(f"Unknown params for stage '{name}': {', '.join(sorted(unknown))}")
+        if _STAGES[name]['validate']:
+            _STAGES[name]['validate'](params)
+
+        normalized.append({"stage": name, "params": copy.deepcopy(params)})
+    return normalized
+
+
+def _hoists_over(name, other):
+    """True if stage `name` may run right before `other` instead of right after it."""
+    if name == 'mono':
+        # Downmixing and resampling are both linear and per channel: they commute exactly
+        return other == 'resample' or _STAGES[other]['rate_flexible']
+    return name == 'resample' and _STAGES[other]['rate_flexible']
+
+
+def plan_rates(definition):
+    """
+    Move 'mono' and 'resample' stages ahead of the rate-flexible stages
+    (and 'mono' ahead of 'resample') that precede them. Everything else keeps
+    its place, so trim_silence, vad and the filters see what they did before.
+
+    Only the downmix-before-resample move is exact. Moving either ahead of
+    noise_reduction changes the output slightly: logMMSE then estimates noise
+    on the downmix instead of on each channel, and without the content above
+    the new Nyquist frequency, which the resample used to drop afterwards.
+
+    Returns:
+        tuple: (definition, moves) with the normalised, reordered definition
+        and one {'stage', 'ahead_of', 'exact'} per move (empty if none).
+    """
+    steps = validate_pipeline(definition)
+    moves = []
+    for i in range(1, len(steps)):
+        j = i
+        while j > 0 and _hoists_over(steps[j]['stage'], steps[j - 1]['stage']):
+            name, other = steps[j]['stage'], steps[j - 1]['stage']
+            moves.append({'stage': name, 'ahead_of': other, 'exact': other == 'resample'})
+            steps[j - 1], steps[j] = steps[j], steps[j - 1]
+            j -= 1
+    return steps, moves
+
+
+def compile_pipeline(definition, fuse=True):
+    """
+    Turn a definition into an execution plan: a list of steps where each step
+    is either ('stage', name, params) or ('fused', [(name, params), ...]).
+    """
+    plan = []
+    for entry in validate_pipeline(definition):
+        name, params = entry['stage'], entry['params']
+        if not _STAGES[name]['linear']:
+            plan.append(('stage', name, params))
+        elif fuse and plan and plan[-1][0] == 'fused':
+            plan[-1][1].append((name, params))
+        else:
+            plan.append(('fused', [(name, params)]))
+    return plan
+
+
+def describe_plan(plan):
+    """Human-readable form of a compiled plan, e.g. 'resample -> [bandpass+hum_removal]'."""
+    parts = []
+    for step in plan:
+        if step[0] == 'stage':
+            parts.append(step[1])
+        else:
+            parts.append('[' + '+'.join(name for name, _ in step[1]) + ']')
+    return ' -> '.join(parts)
+
+
+def _checkpointable_steps(plan):
+    """Steps before the first one with file side outputs; later state could point at old files."""
+    count = 0
+    for step in plan:
+        names = [step[1]] if step[0] == 'stage' else [name for name, _ in step[1]]
+        if not all(_STAGES[name]['checkpoint'] for name in names):
+            break
+        count += 1
+    return count
+
+
+def run_pipeline(y, sr, definition, output_folder, base_name, fuse=True, checkpoints=None):
+    """
+    Execute a pipeline on an in-memory signal.
+
+    checkpoints: optional CheckpointStore (lib/checkpoints.py). The run then
+    resumes after the latest step whose output is already stored and stores
+    the output of every step it computes.
+
+    Returns:
+        tuple: (y, sr, artifacts) where artifacts holds side outputs: the
+        files written for features (e.g. 'mel_spectrogram') and small stats
+        such as the VAD 'speech_fraction'. With checkpoints, artifacts also
+        has 'checkpoint_stats': {step: 'hit' | 'miss'}.
+    """
+    plan = compile_pipeline(definition, fuse=fuse)
+    ctx = {'output_folder': output_folder, 'base_name': base_name, 'artifacts': {}}
+
+    start, keys, stats = 0, [], {}
+    usable = _checkpointable_steps(plan) if checkpoints is not None else 0
+    if usable:
+        from .checkpoints import chain_keys, signal_key
+        keys = chain_keys(signal_key(y, sr), plan[:usable])
+        for i in range(usable - 1, -1, -1):
+            restored = checkpoints.get(keys[i])
+            if restored is not None:
+                y, sr, state = restored
+                ctx.update(state)
+                start = i + 1
+                break
+        # A stage counts as a hit when its output did not have to be recomputed
+        stats = {describe_plan([step]): 'hit' if i < start else 'miss'
+                 for i, step in enumerate(plan[:usable])}
+
+    for i, step in enumerate(plan[start:], start):
+        if step[0] == 'fused':
+            y, sr = _run_linear_group(y, sr, step[1])
+        else:
+            _, name, params = step
+            y, sr = _STAGES[name]['fn'](y, sr, ctx, **params)
+        if i < usable:
+            state = {k: v for k, v in ctx.items() if k not in ('output_folder', 'base_name')}
+            checkpoints.put(keys[i], y, sr, state)
+
+    if usable:
+        ctx['artifacts']['checkpoint_stats'] = stats
+    return y, sr, ctx['artifacts']
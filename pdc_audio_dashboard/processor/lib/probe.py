@@ -0,0 +1,41 @@
+# probe.py
+"""
+Read an audio file's header (duration, sample rate, channels, codec)
+without decoding the samples. Used at upload time so the scheduler knows
+how long every file is before an experiment starts.
+"""
+
+FIELDS = ('duration_seconds', 'sample_rate', 'channels', 'codec')
+
+
+def probe_audio(path):
+    """
+    Returns:
+        dict: FIELDS -> value; values that cannot be determined are None.
+    """
+    try:
+        import soundfile as sf
+        info = sf.info(path)
+        return {
+            'duration_seconds': info.frames / info.samplerate if info.samplerate else None,
+            'sample_rate': info.samplerate,
+            'channels': info.channels,
+            'codec': f"{info.format}/{info.subtype}",
+        }
+    except Exception:
+        pass
+
+    # Compressed formats libsndfile cannot open (mp3/m4a): ask ffprobe via pydub
+    try:
+        from pydub.utils import mediainfo
+        info = mediainfo(path)
+        if info:
+            return {
+                'duration_seconds': float(info['duration']) if info.get('duration') else None,
+                'sample_rate': int(info['sample_rate']) if info.get('sample_rate') else None,
+                'channels': int(info['channels']) if info.get('channels') else None,
+                'codec': info.get('codec_name'),
+            }
+    except Exception:
+        pass
+    return dict.fromkeys(FIELDS)
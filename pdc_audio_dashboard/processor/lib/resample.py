@@ -1,8 +1,5 @@
 # resample.py
 
-import librosa
-import soundfile as sf
-
 def resample_audio(input_path, output_path, target_sr=16000):
     """
     Resample audio to a target sample rate.
@@ -15,6 +12,9 @@ def resample_audio(input_path, output_path, target_sr=16000):
     Returns:
         str: Path to resampled audio file.
     """
+    import librosa
+    import soundfile as sf
+
     # Load audio with librosa
     y, sr = librosa.load(input_path, sr=None)  # sr=None preserves original rate
     # Resample
@@ -23,3 +23,24 @@ def resample_audio(input_path, output_path, target_sr=16000):
     sf.write(output_path, y_resampled, target_sr)
     print(f"Resampled audio saved to: {output_path}")
     return output_path
+
+
+def resample_array(data, sr, target_sr=16000):
+    """
+    Resample a (samples,) or (samples, channels) array to target_sr.
+
+    Returns:
+        np.ndarray: Resampled audio in the same layout as the input.
+    """
+    if sr == target_sr:
+        return data
+    import numpy as np
+    import soxr
+    # The polyphase filter librosa.resample uses by default (soxr_hq), called
+    # directly: soxr takes (samples, channels), so no transposed copies
+    out = soxr.resample(data, sr, target_sr, quality='HQ')
+    # soxr rounds the output length; librosa pads or cuts it to ceil(n * ratio)
+    n = int(np.ceil(len(data) * (float(target_sr) / sr)))
+    if len(out) < n:
+        out = np.concatenate([out, np.zeros((n - len(out),) + out.shape[1:], out.dtype)])
+    return out[:n]
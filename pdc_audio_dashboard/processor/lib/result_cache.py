@@ -0,0 +1,149 @@
+# result_cache.py
+"""
+Content-addressed cache of finished results.
+
+process_file_task is deterministic apart from the run directory it writes
+to, so its outputs (final WAV, feature arrays, spectrogram pyramid) can be
+reused whenever the same audio is processed with the same pipeline again -
+in a second experiment on a batch, or after the file was uploaded twice.
+
+Entries live in <root>/<key>/ where key = sha256(audio bytes + pipeline).
+Files are hard-linked in and out where the filesystem allows it, so a hit
+costs a few directory operations. The cache is bounded by total size;
+the least recently used entries (meta.json mtime, touched on every hit)
+are evicted first.
+"""
+import os
+import json
+import time
+import shutil
+import threading
+import hashlib
+
+# Bump when a change to the DSP code alters outputs for the same parameters
+CACHE_VERSION = 8
+
+META_FILE = 'meta.json'
+OUTPUT_FILE = 'final_output.wav'
+
+
+def file_digest(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def result_key(input_path, pipeline):
+    """Key of (input audio, normalised pipeline definition)."""
+    params = json.dumps({'version': CACHE_VERSION, 'pipeline': pipeline}, sort_keys=True)
+    return hashlib.sha256((file_digest(input_path) + params).encode()).hexdigest()
+
+
+def evict_lru(entries, max_bytes):
+    """Delete (last_used, size_bytes, path) entries, oldest first, until under max_bytes."""
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+
+
+def _link(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class ResultCache:
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def get(self, key, output_folder, base_name):
+        """
+        Restore an entry into output_folder as <base_name>_<name> files.
+
+        Returns:
+            dict or None: {'output', 'artifacts', 'pyramid', 'spectrogram_meta'}
+            shaped like a fresh run, or None on a miss.
+        """
+        entry = os.path.join(self.root, key)
+        meta_path = os.path.join(entry, META_FILE)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+
+            def restore(name):
+                dst = os.path.join(output_folder, f"{base_name}_{name}")
+                _link(os.path.join(entry, name), dst)
+                return dst
+
+            output = restore(OUTPUT_FILE)
+            artifacts = dict(meta['values'])
+            artifacts.update({name: restore(f"{name}.npy") for name in meta['arrays']})
+            pyramid = {name: restore(f"{name}.npy") for name in meta['pyramid']}
+            os.utime(meta_path)
+        except (OSError, ValueError, KeyError):
+            # Missing, half-evicted or unreadable entries are plain misses
+            return None
+        return {'output': output, 'artifacts': artifacts, 'pyramid': pyramid,
+                'spectrogram_meta': meta.get('spectrogram_meta')}
+
+    def put(self, key, output_path, artifacts, pyramid, spectrogram_meta=None):
+        """Store a finished result, then evict down to max_bytes."""
+        entry = os.path.join(self.root, key)
+        if os.path.exists(entry):
+            return
+        tmp = os.path.join(self.root, f".tmp-{os.getpid()}-{threading.get_ident()}-{key[:16]}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        arrays = {n: p for n, p in artifacts.items() if isinstance(p, str) and p.endswith('.npy')}
+        meta = {
+            'values': {n: v for n, v in artifacts.items() if n not in arrays},
+            'arrays': list(arrays),
+            'pyramid': list(pyramid),
+            'spectrogram_meta': spectrogram_meta,
+            'created': time.time(),
+        }
+        try:
+            _link(output_path, os.path.join(tmp, OUTPUT_FILE))
+            for name, path in {**arrays, **pyramid}.items():
+                _link(path, os.path.join(tmp, f"{name}.npy"))
+            with open(os.path.join(tmp, META_FILE), 'w') as f:
+                json.dump(meta, f)
+            # Atomic publish; another worker may have stored the same key meanwhile
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.evict()
+
+    def entries(self):
+        """[(last_used, size_bytes, path)] of every complete entry."""
+        out = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            meta_path = os.path.join(path, META_FILE)
+            if name.startswith('.') or not os.path.exists(meta_path):
+                continue
+            try:
+                size = sum(e.stat().st_size for e in os.scandir(path))
+                out.append((os.path.getmtime(meta_path), size, path))
+            except OSError:
+                continue
+        return out
+
+    def evict(self):
+        evict_lru(self.entries(), self.max_bytes)
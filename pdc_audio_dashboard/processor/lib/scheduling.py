@@ -0,0 +1,78 @@
+# scheduling.py
+"""
+Longest-processing-time-first (LPT) ordering of files across workers.
+
+A pool hands tasks out in submission order, so submitting the longest jobs
+first keeps one long file from starting last and leaving every other core
+idle. Job lengths come from a linear cost model
+
+    predicted_ms = overhead_ms + ms_per_msample * (duration * sample_rate * channels / 1e6)
+
+fitted on earlier results (processing_time_ms against the probed size of
+their inputs). Until there is enough history the defaults below are used.
+"""
+import heapq
+
+import numpy as np
+
+# Fixed cost per file (includes the 3 s simulated analysis in worker.py)
+DEFAULT_OVERHEAD_MS = 3500.0
+# Processing cost per million input samples (all channels)
+DEFAULT_MS_PER_MSAMPLE = 350.0
+
+MIN_HISTORY = 3
+
+
+def work_msamples(duration_seconds=None, sample_rate=None, channels=None, file_size_bytes=None):
+    """Input size in millions of samples; falls back to 16-bit PCM size when unprobed."""
+    if duration_seconds and sample_rate:
+        return duration_seconds * sample_rate * (channels or 1) / 1e6
+    if file_size_bytes:
+        return file_size_bytes / 2 / 1e6
+    return 0.0
+
+
+class CostModel:
+    def __init__(self, overhead_ms=DEFAULT_OVERHEAD_MS, ms_per_msample=DEFAULT_MS_PER_MSAMPLE, samples=0):
+        self.overhead_ms = overhead_ms
+        self.ms_per_msample = ms_per_msample
+        self.samples = samples
+
+    @classmethod
+    def fit(cls, history):
+        """
+        history: iterable of (msamples, processing_time_ms) of past files.
+        Falls back to the defaults with too little or degenerate data.
+        """
+        history = [(float(x), float(ms)) for x, ms in history if x is not None and ms is not None]
+        if len(history) < MIN_HISTORY:
+            return cls(samples=len(history))
+        x, ms = np.array(history).T
+        if np.ptp(x) == 0:
+            # One input size only: keep the default slope, learn the offset
+            return cls(max(0.0, float(np.mean(ms - DEFAULT_MS_PER_MSAMPLE * x))), samples=len(history))
+        slope, overhead = np.polyfit(x, ms, 1)
+        if slope <= 0:
+            slope = DEFAULT_MS_PER_MSAMPLE
+            overhead = float(np.mean(ms - slope * x))
+        return cls(max(0.0, float(overhead)), float(slope), samples=len(history))
+
+    def predict_ms(self, msamples):
+        return self.overhead_ms + self.ms_per_msample * msamples
+
+    def describe(self):
+        return {'overhead_ms': self.overhead_ms, 'ms_per_msample': self.ms_per_msample,
+                'history': self.samples}
+
+
+def lpt_order(jobs):
+    """jobs: [(key, predicted_ms)] -> same list, longest first."""
+    return sorted(jobs, key=lambda job: job[1], reverse=True)
+
+
+def simulate_makespan(costs, workers):
+    """Makespan of greedy list scheduling of `costs` (in order) on `workers` identical workers."""
+    loads = [0.0] * max(1, workers)
+    for cost in costs:
+        heapq.heapreplace(loads, loads[0] + cost)
+    return max(loads)
@@ -0,0 +1,896 @@
+# segmented.py
+"""
+Intra-file parallelism: one long recording split into overlapping segments.
+
+Parallel experiments otherwise split work per file, so a batch holding a
+single three-hour recording runs on one core. Here the file is cut into
+segments of about SEGMENT_SECONDS. Every segment is processed by a pool
+worker on a window with PAD_SECONDS of context on each side, and the
+results are stitched back with short raised-cosine crossfades. Workers
+read their window straight from the memory-mapped PCM (lib/pcm.py), so no
+process decodes the whole file.
+
+Cut points are placed where every stage lines up with the whole-file run:
+resamplers start on a multiple of their rate ratio (44.1 -> 16 kHz: every
+441 input samples), and logMMSE on the 60 s chunk grid its own wrapper
+uses. Inside a segment the stages are the in-memory ones. Stages that
+need whole-file statistics are reduced across segments:
+
+- trim_silence: workers sum per-millisecond energies, the parent runs the
+  silence detection once on the joined energies, and later reads map the
+  trimmed timeline back onto the original samples.
+- noise_reduction / normalize_peak: the run is split into phases at these
+  stages. Each phase reports the peak of its segments' cores, the next
+  phase scales by the maximum.
+- logMMSE's initial noise estimate (and enhance_voice's noise clip) come
+  from the start of the stream: the parent runs the phase on its first
+  HEAD_SECONDS and hands the estimate to every segment, which then adapts
+  it over its leading context like the continuous run would.
+- features: ref=np.max of the mel dB conversion uses the largest mel power
+  over all segments when the feature files are written.
+
+- vad: workers score 30 ms frames, the parent thresholds them against the
+  whole-file noise floor. Speech regions are then processed one by one
+  (logMMSE, enhance_voice, features) exactly as in the in-memory run, and
+  cuts are only placed in the gaps between regions, so no region is split.
+
+Phases hand their output to the next phase, and segments their feature rows
+to the parent, as shared-memory blocks (lib/shm.py) that the receiver maps
+without a copy. A compressed input that cannot be memory-mapped is decoded
+once into a block too, instead of every task decoding its own windows. When
+/dev/shm lacks room or the run would need more than shm_bytes, .npy files in
+a scratch directory are used instead. Both are removed at the end.
+"""
+import os
+import math
+import shutil
+import tempfile
+from fractions import Fraction
+
+import numpy as np
+
+from .pipeline import _STAGES, _run_linear_group, compile_pipeline
+
+SEGMENT_SECONDS = 120.0
+PAD_SECONDS = 10.0
+CROSSFADE_SECONDS = 0.05
+HEAD_SECONDS = 2.0
+
+# Energies of this many ms per task when deciding what trim_silence drops
+ENERGY_TASK_MS = 600000
+# Seconds of frames scored per task by the vad map step
+VAD_TASK_SECONDS = 120
+# Largest shared memory a run may use before falling back to scratch files
+SHM_MAX_BYTES = 1024 ** 3
+
+
+# ---------------------------------------------------------------------------
+# Segment steps. run() gets a window whose first sample sits at absolute
+# position `start` of the step's input and returns (output, output start).
+# ---------------------------------------------------------------------------
+
+class SegmentStep:
+    quantum = 1           # windows may only be cut at multiples of this (input samples)
+    ratio = Fraction(1)   # output samples per input sample at those cuts
+    barrier = False       # needs the peak of its whole input before it can run
+    side_output = False   # writes files, skipped by the head pass
+
+    def __init__(self, sr, channels):
+        self.sr = self.out_sr = sr
+        self.channels = self.out_channels = channels
+
+    def out_position(self, p, n):
+        """Output position of input position p (a multiple of quantum, or n, the input length)."""
+        return p
+
+    def head(self, y):
+        """Statistic taken from the start of the input, shared with every segment."""
+        return None
+
+    def run(self, y, start, job):
+        return y, start
+
+
+class _RepairClipping(SegmentStep):
+    """declip() on the window; runs starting in the core are counted in the segment's stats."""
+    def __init__(self, sr, channels, threshold=0.99):
+        super().__init__(sr, channels)
+        self.threshold = threshold
+
+    def run(self, y, start, job):
+        from .clipping import _count_runs, declip, find_clipped_runs
+        repaired, _ = declip(y, self.threshold)
+        if job['stats'] is not None:
+            stats = {'clipped_samples': 0, 'clipped_runs': 0, 'longest_run': 0}
+            if repaired is not y:
+                channels = y[:, np.newaxis] if y.ndim == 1 else y
+                for ch in range(channels.shape[1]):
+                    starts, ends = find_clipped_runs(channels[:, ch], self.threshold)
+                    own = (starts + start >= job['a']) & (starts + start < job['b'])
+                    _count_runs(stats, starts[own], ends[own])
+            job['stats']['clipping'] = stats
+        return repaired, start
+
+
+class _Linear(SegmentStep):
+    """A fused filter group; its IIR start-up transient settles inside the leading context."""
+    def __init__(self, sr, channels, group):
+        super().__init__(sr, channels)
+        self.group = group
+        if channels > 1 and any(_STAGES[name]['downmix'] for name, _ in group):
+            self.out_channels = 1
+
+    def run(self, y, start, job):
+        y, _ = _run_linear_group(y, self.sr, self.group)
+        return y, start
+
+
+def _align(y, start, quantum):
+    """Drop leading samples so the window starts on a multiple of quantum."""
+    drop = -start % quantum
+    return y[drop:], start + drop
+
+
+class _Resample(SegmentStep):
+    def __init__(self, sr, channels, target_sr=16000):
+        super().__init__(sr, channels)
+        self.out_sr = target_sr
+        self.ratio = Fraction(target_sr, sr)
+        self.quantum = self.ratio.denominator
+
+    def out_position(self, p, n):
+        return math.ceil(p * self.ratio)
+
+    def run(self, y, start, job):
+        from .resample import resample_array
+        y, start = _align(y, start, self.quantum)
+        return resample_array(y, self.sr, self.out_sr), int(start * self.ratio)
+
+
+class _LogMMSE(SegmentStep):
+    """
+    First half of noise_reduction_array. The logmmse wrapper runs 60 s chunks
+    and drops the last two frames of each, so chunk c of the input always
+    lands at c * chunk_out in the output; segments are cut on that grid.
+
+    With speech segments every region is denoised on its own, as
+    noise_reduction_array does, and everything else is silence.
+    """
+    def __init__(self, sr, channels, speech=False):
+        super().__init__(sr, channels)
+        self.speech = speech
+        self.slen = int(math.floor(0.02 * sr))
+        self.slen += self.slen % 2
+        self.hop = self.slen // 2
+        self.chunk = int(np.floor(60 * sr))
+        self.chunk_out = self._frames(self.chunk) * self.hop
+        if not speech:
+            self.quantum = self.chunk
+            self.ratio = Fraction(self.chunk_out, self.chunk)
+
+    def _frames(self, length):
+        return max(0, length // self.hop - self.slen // self.hop)
+
+    def out_position(self, p, n):
+        if self.speech:
+            return p
+        c, rest = divmod(p, self.chunk)
+        return c * self.chunk_out + self._frames(rest) * self.hop
+
+    def _prepare(self, y):
+        # The logmmse wrapper's to_float + eps, per channel
+        x = np.asarray(y, dtype=np.float32).astype(np.float64) + np.finfo(np.float64).eps
+        return x[:, np.newaxis] if x.ndim == 1 else x
+
+    def head(self, y):
+        """Initial noise power per channel, from the first 6 frames as logmmse estimates it."""
+        if self.speech:
+            return None
+        x = self._prepare(y)
+        win = np.hanning(self.slen)
+        win = win * self.hop / np.sum(win)
+        noise = []
+        for ch in range(x.shape[1]):
+            mean = np.zeros(2 * self.slen)
+            for j in range(0, self.slen * 6, self.slen):
+                mean = mean + np.absolute(np.fft.fft(win * x[j:j + self.slen, ch], 2 * self.slen, axis=0))
+            noise.append((mean / 6) ** 2)
+        return noise
+
+    def _run_regions(self, y, start, job):
+        from logmmse import logmmse
+        from .vad import speech_sample_ranges
+        data = np.asarray(y, dtype=np.float32)
+        out, end = np.zeros_like(data), start + len(data)
+        for s, e in speech_sample_ranges(job['speech'], self.sr, job['n']):
+            # Cuts fall between regions; regions cut by the window edge only feed the context
+            s, e = max(s, start), min(e, end)
+            if s < e:
+                region = logmmse(data[s - start:e - start], self.sr)
+                out[s - start:s - start + len(region)] = region
+        return out
+
+    def run(self, y, start, job):
+        from logmmse.logmmse import logmmse as _logmmse
+
+        if self.speech:
+            return self._run_regions(y, start, job), start
+
+        # Start on the frame grid of the chunk the window starts in
+        c, offset = divmod(start, self.chunk)
+        skip = -offset % self.hop
+        if offset + skip >= self.chunk - self.slen:
+            skip = self.chunk - offset  # too close to the chunk end, begin with the next one
+        x = self._prepare(y)[skip:]
+        start += skip
+        # Frame k of chunk c is output at c * chunk_out + k * hop
+        out_start = (start // self.chunk) * self.chunk_out + start % self.chunk
+
+        pieces, a = [], 0
+        while a < len(x):
+            pieces.append((a, min(len(x), a + self.chunk - (start + a) % self.chunk)))
+            a = pieces[-1][1]
+
+        outs = []
+        for ch in range(x.shape[1]):
+            params = None
+            if start > 0:
+                zeros = np.zeros(self.hop)
+                params = {'noise_mu2': job['head'][ch], 'Xk_prev': zeros, 'x_old': zeros}
+            out = []
+            for a, b in pieces:
+                if self._frames(b - a) == 0:
+                    continue
+                piece, params = _logmmse(x[a:b, ch], self.sr, 6, 0, 0.15, params)
+                out.append(piece)
+            outs.append(np.concatenate(out) if out else np.zeros(0))
+        out = np.stack(outs, axis=1).astype(np.float32)
+        return (out[:, 0] if np.ndim(y) == 1 else out), out_start
+
+
+class _PeakGate(SegmentStep):
+    """Second half of noise_reduction_array: scale by the whole-file peak, gate < 0.01."""
+    barrier = True
+
+    def run(self, y, start, job):
+        y = np.array(y, dtype=np.float32)
+        peak = np.float32(job['peak'])
+        if peak > 0:
+            y /= peak
+        y[np.abs(y) < 0.01] = 0
+        return y, start
+
+
+class _Enhance(SegmentStep):
+    """
+    enhance_voice_array on a window. noisereduce gates long inputs in chunks
+    of NR_CHUNK_SIZE samples whose result depends on where the chunks start,
+    so cuts follow that grid and every chunk is gated with the same padded
+    input as in the whole-file run. The compressor's state is rebuilt over
+    the leading context, which is close but not exact.
+
+    With speech segments each region is enhanced on its own and cuts fall
+    between regions, so only the resampling step constrains them.
+    """
+    def __init__(self, sr, channels, target_sr=16000, gain_db=6, speech=False):
+        from .audio_processor import NR_CHUNK_SIZE
+        super().__init__(sr, channels)
+        self.target_sr, self.gain_db, self.speech = target_sr, gain_db, speech
+        self.out_sr, self.out_channels = target_sr, 1
+        self.ratio = Fraction(target_sr, sr)
+        step = self.ratio.denominator
+        if speech:
+            self.quantum = step
+        else:
+            # Multiples of the resampling step that also land on the chunk grid
+            self.quantum = step * NR_CHUNK_SIZE // math.gcd(NR_CHUNK_SIZE, self.ratio.numerator)
+
+    def out_position(self, p, n):
+        return math.ceil(p * self.ratio)
+
+    def _input(self, y, start):
+        from .resample import resample_array
+        if y.ndim > 1:
+            y = y.mean(axis=1)
+        y, start = _align(y, start, self.ratio.denominator)
+        y = resample_array(y, self.sr, self.target_sr)
+        with np.errstate(under='ignore'):
+            return y.astype(np.float32), int(start * self.ratio)
+
+    def head(self, y):
+        y, _ = self._input(y, 0)
+        return y[:int(0.5 * self.target_sr)]
+
+    def _gate(self, y, start, n, noise_clip):
+        from .audio_processor import NR_CHUNK_SIZE, NR_PADDING, reduce_voice_noise
+        chunk, pad, end = NR_CHUNK_SIZE, NR_PADDING, start + len(y)
+        out = np.empty_like(y)
+        c0 = start // chunk
+        for c in range(c0, -(-end // chunk)):
+            # noisereduce reads [c * chunk - pad, (c + 1) * chunk + pad), zeros outside the signal
+            lo, hi = c * chunk - pad, (c + 1) * chunk + pad
+            if n <= chunk:
+                hi = n + pad  # short inputs are gated in one piece
+            a, b = max(lo, start if start > 0 else lo), min(hi, end if end < n else hi)
+            piece = np.zeros(b - a, np.float32)
+            s, e = max(a, start, 0), min(b, end, n)
+            piece[s - a:e - a] = y[s - start:e - start]
+            gated = reduce_voice_noise(piece, self.target_sr, noise_clip, chunk_size=None, padding=0)
+            s, e = max(c * chunk, start), min((c + 1) * chunk, end)
+            out[s - start:e - start] = gated[s - a:e - a]
+        return out
+
+    def _run_regions(self, y, start, n, noise_clip, speech):
+        from .audio_processor import compress_voice, reduce_voice_noise
+        from .vad import speech_sample_ranges
+        out, end = np.zeros_like(y), start + len(y)
+        for s, e in speech_sample_ranges(speech, self.target_sr, n):
+            s, e = max(s, start), min(e, end)
+            if s < e:
+                region = reduce_voice_noise(y[s - start:e - start], self.target_sr, noise_clip)
+                out[s - start:e - start] = compress_voice(region, self.target_sr, self.gain_db)[:e - s]
+        return out
+
+    def run(self, y, start, job):
+        from .audio_processor import compress_voice
+        y, start = self._input(y, start)
+        n = math.ceil(job['n'] * self.ratio)
+        if self.speech:
+            return self._run_regions(y, start, n, job['head'], job['speech']), start
+        y = self._gate(y, start, n, job['head'])
+        return compress_voice(y, self.target_sr, self.gain_db), start
+
+
+class _NormalizePeak(SegmentStep):
+    barrier = True
+
+    def __init__(self, sr, channels, target_dBFS=-1.0):
+        super().__init__(sr, channels)
+        self.target_dBFS = target_dBFS
+
+    def run(self, y, start, job):
+        if job['peak'] == 0:
+            return y, start
+        change_in_dBFS = self.target_dBFS - 20 * np.log10(job['peak'])
+        return y * (10 ** (change_in_dBFS / 20)), start
+
+
+class _Features(SegmentStep):
+    """
+    Frames centred inside the segment's core, computed from the window and
+    spooled as raw rows; write_features applies the whole-file dB reference.
+    With speech segments only frames around speech are transformed, each
+    from its region's samples alone, like FeatureEngine.power_spectrogram.
+    """
+    side_output = True
+
+    def __init__(self, sr, channels, sr_features=16000, n_mels=128, n_mfcc=13, hop_length=512,
+                 n_fft=2048, features=None, speech=False):
+        super().__init__(sr, channels)
+        self.speech = speech
+        from .features import DEFAULT_FEATURES, FRAME_FEATURES, FeatureEngine
+        self.engine = FeatureEngine(sr_features, n_fft=n_fft, hop_length=hop_length, n_mels=n_mels,
+                                    n_mfcc=n_mfcc, features=features or DEFAULT_FEATURES)
+        self.feature_ratio = Fraction(sr_features, sr)
+        self.quantum = self.feature_ratio.denominator
+        self.rows = [name for name in self.engine.features if name in FRAME_FEATURES]
+        if self.engine.needs_mel:
+            self.rows.append('mel_power')
+
+    def run(self, y, start, job):
+        from .resample import resample_array
+        engine, hop, half = self.engine, self.engine.hop_length, self.engine.n_fft // 2
+        mono = y.mean(axis=1) if y.ndim > 1 else y
+        mono, f_start = _align(mono, start, self.quantum)
+        mono = resample_array(mono, self.sr, engine.sr)
+        f_start = int(f_start * self.feature_ratio)
+        a, b, n = (math.ceil(p * self.feature_ratio) for p in (job['a'], job['b'], job['n']))
+
+        # Frame k is centred on sample k * hop; the file edges are zero padded
+        first = -(-a // hop)
+        last = n // hop + 1 if b == n else -(-b // hop)
+        lead = half if f_start == 0 else 0
+        tail = half if f_start + len(mono) >= n else 0
+        buf = np.concatenate([np.zeros(lead), mono[:n - f_start], np.zeros(tail)])
+        offset = f_start - lead
+        if first * hop - half < offset or (last - 1) * hop + half > offset + len(buf):
+            raise ValueError("Segment context is too short for the feature frames")
+
+        sources = None
+        if self.speech:
+            from .vad import speech_sample_ranges
+            sources = engine.frame_sources(speech_sample_ranges(job['speech'], engine.sr, n), first, last, n)
+        raw = {name: [] for name in self.rows}
+        max_power = 0.0
+        for k0 in range(first, last, 4096):
+            k = np.arange(k0, min(last, k0 + 4096))
+            idx = (k * hop - half - offset)[:, np.newaxis] + np.arange(engine.n_fft)
+            frames = buf[idx]
+            if sources is not None:
+                lo, hi = (bound[k - first, np.newaxis] for bound in sources)
+                pos = idx + offset
+                frames = np.where((pos >= lo) & (pos < hi), frames, 0.0)
+            power = engine.frame_power(frames)
+            rows = engine.frame_features(power)
+            if engine.needs_mel:
+                rows['mel_power'] = engine.mel_power(power)
+                max_power = max(max_power, float(rows['mel_power'].max(initial=0.0)))
+            for name in self.rows:
+                raw[name].append(rows[name].T.astype(np.float32))
+        refs = {}
+        for name in self.rows:
+            rows = np.concatenate(raw[name]) if raw[name] else np.zeros((0, 1), np.float32)
+            refs[name] = _put(job['scratch'], f"{job['scratch']['key']}_{name}", rows)
+        job['stats']['features'] = {'max_power': max_power, 'frames': max(0, last - first), 'rows': refs}
+        return y, start
+
+
+_SEGMENT_STAGES = {
+    'noise_reduction': lambda sr, ch, speech, **p: [_LogMMSE(sr, ch, speech), _PeakGate(sr, ch)],
+    'resample': lambda sr, ch, speech, **p: [_Resample(sr, ch, **p)],
+    'repair_clipping': lambda sr, ch, speech, **p: [_RepairClipping(sr, ch, **p)],
+    'enhance_voice': lambda sr, ch, speech, **p: [_Enhance(sr, ch, speech=speech, **p)],
+    'normalize_peak': lambda sr, ch, speech, **p: [_NormalizePeak(sr, ch, **p)],
+    'features': lambda sr, ch, speech, **p: [_Features(sr, ch, speech=speech, **p)],
+}
+
+
+def build_steps(plan, sr, channels, speech=False):
+    """
+    Segment steps of a compiled plan. speech=True builds the steps for a run
+    whose vad stage found speech segments.
+
+    Returns:
+        tuple: (trim_silence params or None, vad params or None, [SegmentStep, ...])
+
+    Raises ValueError for plans that cannot run segmented.
+    """
+    trim, vad, steps = None, None, []
+    for i, step in enumerate(plan):
+        if step[0] == 'fused':
+            new = [_Linear(sr, channels, step[1])]
+        else:
+            _, name, params = step
+            if name == 'trim_silence':
+                if i:
+                    raise ValueError("Segmented runs need trim_silence as the first stage")
+                trim = params
+                continue
+            if name == 'vad':
+                # Speech is detected on the (trimmed) input, before any other stage
+                if steps:
+                    raise ValueError("Segmented runs need vad before every stage but trim_silence")
+                vad = params
+                continue
+            if name not in _SEGMENT_STAGES:
+                raise ValueError(f"Stage '{name}' has no segmented implementation")
+            new = _SEGMENT_STAGES[name](sr, channels, speech, **params)
+        for s in new:
+            sr, channels = s.out_sr, s.out_channels
+        steps.extend(new)
+    return trim, vad, steps
+
+
+def can_segment(input_path, definition):
+    """True when the input can be read by offset and every stage of the pipeline can run segmented."""
+    from .pcm import open_pcm
+    try:
+        reader = open_pcm(input_path)
+        build_steps(compile_pipeline(definition), reader.sr, reader.channels)
+    except ValueError:
+        return False
+    return True
+
+
+def split_phases(steps):
+    """Cut the step list before every barrier step."""
+    phases = [[]]
+    for step in steps:
+        if step.barrier and phases[-1]:
+            phases.append([])
+        phases[-1].append(step)
+    return phases
+
+
+def phase_quantum(phase):
+    """Smallest cut spacing (in phase input samples) every step of the phase lines up with."""
+    quantum, ratio = 1, Fraction(1)
+    for step in phase:
+        need = Fraction(step.quantum) / ratio
+        quantum = quantum * need.numerator // math.gcd(quantum, need.numerator)
+        ratio *= step.ratio
+    return quantum
+
+
+def cut_points(n, quantum, target, regions=None):
+    """
+    Segment boundaries [0, ..., n] spaced by a multiple of quantum close to
+    target. With regions ([(start, end), ...] speech sample ranges) cuts only
+    fall in the gaps between regions, the first gap at least target after
+    the previous cut, so a long region makes a longer segment.
+    """
+    step = max(quantum, int(round(target / quantum)) * quantum)
+    if regions is None:
+        cuts = list(range(0, n, step))
+    else:
+        cuts, prev_end = [0], 0
+        for start, end in list(regions) + [(n, n)]:
+            # The multiple of quantum nearest the middle of the gap, if the gap holds one
+            cut = int(round((prev_end + start) / 2 / quantum)) * quantum
+            if prev_end < cut < start and cut - cuts[-1] >= step:
+                cuts.append(cut)
+            prev_end = end
+    if len(cuts) > 1 and n - cuts[-1] < step // 2:
+        cuts.pop()  # fold a short remainder into the last segment
+    return cuts + [n]
+
+
+# ---------------------------------------------------------------------------
+# Sources: what a phase reads its windows from
+# ---------------------------------------------------------------------------
+
+def _put(store, key, array):
+    """Hand an array to another process: a shared block of the run if it has one, else a .npy file."""
+    if store['shm']:
+        from .shm import put
+        try:
+            return put(store['shm'] + key, array)
+        except OSError:
+            pass  # /dev/shm filled up meanwhile
+    path = os.path.join(store['dir'], f"{key}.npy")
+    np.save(path, array)
+    return path
+
+
+def _load(ref):
+    if isinstance(ref, str):
+        return np.load(ref, mmap_mode='r')
+    from .shm import attach
+    return attach(ref)
+
+
+def _detach(store):
+    """Unmap the run's blocks from this process at the end of a task."""
+    if store and store['shm']:
+        from .shm import detach
+        detach(store['shm'])
+
+
+class _SharedPCM:
+    """PCMReader over the input decoded into a shared block."""
+
+    def __init__(self, descriptor, sr):
+        self.samples = _load(descriptor)
+        self.sr, self.frames = sr, len(self.samples)
+        self.channels = 1 if self.samples.ndim == 1 else self.samples.shape[1]
+
+    def read(self, start, stop):
+        start, stop = max(0, int(start)), max(0, int(stop))
+        block = self.samples[min(start, self.frames):min(stop, self.frames)]
+        if stop - start > len(block):
+            block = np.concatenate([block, np.zeros((stop - start - len(block),) + block.shape[1:], np.float32)])
+        return block
+
+
+def _open_reader(spec):
+    if spec.get('shm'):
+        return _SharedPCM(spec['shm'], spec['sr'])
+    from .pcm import open_pcm
+    return open_pcm(spec['path'])
+
+
+def _share_input(reader, store):
+    """Decode the whole input once into a shared block; returns its descriptor."""
+    from .shm import create
+    shape = (reader.frames,) if reader.channels == 1 else (reader.frames, reader.channels)
+    descriptor, samples = create(store['shm'] + 'input', shape, np.float32)
+    block = int(60 * reader.sr)
+    for a in range(0, reader.frames, block):
+        samples[a:a + block] = reader.read(a, min(reader.frames, a + block))
+    return descriptor
+
+
+class _PCMSource:
+    """The input, optionally with trim_silence's dropped ranges cut out."""
+    def __init__(self, spec):
+        self.reader = _open_reader(spec)
+        bounds = self.bounds = spec.get('bounds')
+        if bounds is None:
+            self.length = self.reader.frames
+        else:
+            self.offsets = np.concatenate(([0], np.cumsum(bounds[:, 1] - bounds[:, 0])))
+            self.length = int(self.offsets[-1])
+
+    def read(self, a, b):
+        """Frames [a, b) of the (trimmed) input; frames past its end read as silence."""
+        if self.bounds is None:
+            return self.reader.read(a, b)
+        if b > self.length:
+            y = self.read(a, self.length) if a < self.length else self.reader.read(0, 0)
+            return np.concatenate([y, np.zeros((b - max(a, self.length),) + y.shape[1:], y.dtype)])
+        # Ranges overlapping [a, b) of the trimmed timeline, mapped to original frames
+        i0 = max(0, np.searchsorted(self.offsets, a, side='right') - 1)
+        i1 = np.searchsorted(self.offsets, b, side='left')
+        starts = self.bounds[i0:i1, 0] + np.maximum(0, a - self.offsets[i0:i1])
+        ends = self.bounds[i0:i1, 0] + np.minimum(self.bounds[i0:i1, 1] - self.bounds[i0:i1, 0],
+                                                  b - self.offsets[i0:i1])
+        if not len(starts):
+            return self.reader.read(0, 0)
+        span = self.reader.read(starts[0], ends[-1])
+        idx = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)]) - starts[0]
+        return span[idx]
+
+
+class _SpoolSource:
+    """A phase output: one file per segment, crossfaded where neighbours overlap."""
+    def __init__(self, parts, length, half):
+        self.parts, self.length, self.half = parts, length, half
+
+    def _weights(self, j, lo, hi):
+        # Raised-cosine ramps over [cut - half, cut + half); neighbouring ramps sum to 1
+        pos = np.arange(lo, hi) + 0.5
+        w = np.ones(hi - lo)
+        if j > 0:
+            cut = self.parts[j][0]
+            t = np.clip((pos - (cut - self.half)) / (2 * self.half), 0, 1)
+            w *= np.sin(0.5 * np.pi * t) ** 2
+        if j < len(self.parts) - 1:
+            cut = self.parts[j + 1][0]
+            t = np.clip((pos - (cut - self.half)) / (2 * self.half), 0, 1)
+            w *= np.cos(0.5 * np.pi * t) ** 2
+        return w
+
+    def read(self, a, b):
+        out, dtype = None, None
+        for j, (_, lo, ref) in enumerate(self.parts):
+            data = _load(ref)
+            hi = lo + len(data)
+            s, e = max(a, lo), min(b, hi)
+            if s >= e:
+                continue
+            if out is None:
+                dtype = data.dtype
+                out = np.zeros((b - a,) + data.shape[1:])
+            w = self._weights(j, s, e)
+            out[s - a:e - a] += data[s - lo:e - lo] * (w if data.ndim == 1 else w[:, np.newaxis])
+        return out.astype(dtype)
+
+
+def _open_source(spec):
+    if spec['kind'] == 'pcm':
+        return _PCMSource(spec)
+    return _SpoolSource(spec['parts'], spec['length'], spec['half'])
+
+
+# ---------------------------------------------------------------------------
+# Pool tasks
+# ---------------------------------------------------------------------------
+
+def _segment_energy(source, first_ms, last_ms):
+    from .trim_silence import ms_energy
+    reader = _open_reader(source)
+    offset = int(first_ms * reader.sr / 1000.0)
+    samples = reader.read(offset, min(reader.frames, int(last_ms * reader.sr / 1000.0)))
+    return ms_energy(samples, reader.sr, first_ms, last_ms, offset=offset)
+
+
+def segment_energy(source, first_ms, last_ms):
+    """Per-millisecond energies of [first_ms, last_ms) of the input (trim_silence map step)."""
+    try:
+        return _segment_energy(source, first_ms, last_ms)
+    finally:
+        _detach(source.get('store'))
+
+
+def segment_speech_stats(source, sr, first_frame, last_frame, frame_len):
+    """Frame statistics of frames [first_frame, last_frame) of a phase source (vad map step)."""
+    from .vad import speech_frame_stats
+    try:
+        return speech_frame_stats(_open_source(source).read(first_frame * frame_len, last_frame * frame_len),
+                                  sr, frame_len)
+    finally:
+        _detach(source.get('store'))
+
+
+def _run_steps(steps, y, start, a, b, n, heads, peak, speech=None, scratch=None, stats=None):
+    """Push a window through the steps, mapping the core [a, b) and length n along."""
+    for i, step in enumerate(steps):
+        job = {'a': a, 'b': b, 'n': n, 'head': heads.get(i), 'peak': peak, 'speech': speech,
+               'scratch': scratch, 'stats': stats}
+        y, start = step.run(y, start, job)
+        a, b, n = step.out_position(a, n), step.out_position(b, n), step.out_position(n, n)
+    return y, start, a, b, n
+
+
+def run_segment(job):
+    """
+    Process one segment window of a phase (pool task).
+
+    Hands the segment's core plus half a crossfade on each side to the
+    parent ('output', see _put) and returns where the core and the output
+    start in the phase output, the peak of the core and any step statistics.
+    """
+    try:
+        return _run_segment(job)
+    finally:
+        _detach(job['scratch'])
+
+
+def _run_segment(job):
+    source = _open_source(job['source'])
+    s, e = job['window']
+    a, b = job['core']
+    stats = {}
+    y, start, a, b, n = _run_steps(job['steps'], source.read(s, e), s, a, b, job['length'],
+                                   job['heads'], job['peak'], job['speech'], job['scratch'], stats)
+    lo, hi = max(0, a - job['half']), min(n, b + job['half'])
+    if start > lo or start + len(y) < hi:
+        raise ValueError("Segment context is too short for the stages of this phase")
+    core = y[a - start:b - start]
+    output = _put(job['scratch'], job['output'], y[lo - start:hi - start])
+    # Kept as a NumPy scalar so the next phase scales in the same precision as run_pipeline
+    peak = np.max(np.abs(core)) if core.size else np.float32(0)
+    return {'a': a, 'lo': lo, 'peak': peak, 'stats': stats, 'output': output}
+
+
+# ---------------------------------------------------------------------------
+# Executor
+# ---------------------------------------------------------------------------
+
+def _trim_bounds(source, params, map_fn):
+    """Frame ranges trim_silence keeps, from per-ms energies computed in parallel."""
+    from .trim_silence import detect_nonsilent_energy
+    reader = _open_reader(source)
+    seg_len = round(1000 * (reader.frames / reader.sr))
+    starts = list(range(0, seg_len, ENERGY_TASK_MS)) or [0]
+    energy = np.concatenate(list(map_fn(segment_energy, [source] * len(starts), starts,
+                                        [min(seg_len, m + ENERGY_TASK_MS) for m in starts])))
+    ranges = detect_nonsilent_energy(energy, reader.sr, reader.frames, reader.channels,
+                                     params.get('min_silence_len', 100), params.get('silence_thresh', -40))
+    bounds = (np.asarray(ranges, dtype=np.int64).reshape(-1, 2) * reader.sr / 1000.0).astype(np.int64)
+    return bounds
+
+
+def _speech_segments(source, n, sr, params, map_fn):
+    """vad's speech segments of the source, scoring frames in parallel; None if there is no speech."""
+    from .vad import speech_segments_from_stats
+    frame_ms = 30
+    frame_len = max(1, int(sr * frame_ms / 1000))
+    n_frames = -(-n // frame_len)
+    per_task = max(1, VAD_TASK_SECONDS * 1000 // frame_ms)
+    starts = list(range(0, n_frames, per_task))
+    stats = list(map_fn(segment_speech_stats, [source] * len(starts), [sr] * len(starts), starts,
+                        [min(n_frames, f + per_task) for f in starts], [frame_len] * len(starts)))
+    energy_db = np.concatenate([e for e, _ in stats])
+    band_ratio = np.concatenate([r for _, r in stats])
+    segments = speech_segments_from_stats(energy_db, band_ratio, frame_len, sr, n, frame_ms=frame_ms,
+                                          aggressiveness=params.get('aggressiveness', 2),
+                                          padding_ms=params.get('padding_ms', 300))
+    return segments or None
+
+
+def run_pipeline_segmented(input_path, definition, output_path, output_folder, base_name,
+                           executor=None, segment_seconds=SEGMENT_SECONDS, shm_bytes=SHM_MAX_BYTES):
+    """
+    Execute a pipeline on `input_path` as parallel overlapping segments and
+    write `output_path`. `executor` is a concurrent.futures executor (the
+    shared worker pool); None runs the segments one after another in this
+    process. Up to `shm_bytes` of shared memory carry data between the
+    processes (0: scratch files only).
+
+    Returns:
+        tuple: (sr, artifacts) like run_pipeline_streaming; artifacts also
+        holds 'segments', the number of segments of the first phase.
+    """
+    from .pcm import open_pcm
+
+    reader = open_pcm(input_path)
+    # Decoded input unless it is memory-mapped, plus two phases of output, as float32
+    need = reader.frames * reader.channels * 4 * (2 if reader.memory_mapped else 3)
+    run = None
+    if shm_bytes and need <= shm_bytes:
+        from .shm import SharedRun, available
+        run = SharedRun() if available(need) else None
+    scratch = tempfile.mkdtemp(prefix=f"{base_name}_segments_", dir=output_folder)
+    try:
+        store = {'dir': scratch, 'shm': run.prefix if run else None}
+        return _run_segmented(reader, input_path, definition, output_path, output_folder, base_name,
+                              executor, segment_seconds, store)
+    finally:
+        # The body has returned, so none of its arrays still map a block
+        if run is not None:
+            run.close()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def _run_segmented(reader, input_path, definition, output_path, output_folder, base_name,
+                   executor, segment_seconds, store):
+    import soundfile as sf
+
+    map_fn = executor.map if executor is not None else map
+    plan = compile_pipeline(definition)
+    trim, vad, steps = build_steps(plan, reader.sr, reader.channels)
+    artifacts = {}
+
+    source = {'kind': 'pcm', 'path': input_path, 'bounds': None, 'sr': reader.sr, 'store': store}
+    if store['shm'] and not reader.memory_mapped:
+        source['shm'] = _share_input(reader, store)
+    if trim is not None:
+        source['bounds'] = _trim_bounds(source, trim, map_fn)
+    n = _open_source(source).length
+    if not n:
+        raise ValueError("Nothing left to process after trimming silence")
+
+    speech = None
+    if vad is not None:
+        from .vad import speech_fraction
+        speech = _speech_segments(source, n, reader.sr, vad, map_fn)
+        artifacts['speech_fraction'] = speech_fraction(speech or [], n / reader.sr)
+        if speech:
+            steps = build_steps(plan, reader.sr, reader.channels, speech=True)[2]
+
+    sr, peak, feature_parts = reader.sr, None, []
+    phases = split_phases(steps)
+    for p, phase in enumerate(phases):
+        regions = None
+        if speech:
+            from .vad import speech_sample_ranges
+            regions = speech_sample_ranges(speech, sr, n)
+        cuts = cut_points(n, phase_quantum(phase), segment_seconds * sr, regions)
+        pad = int(PAD_SECONDS * sr)
+        out_sr = phase[-1].out_sr if phase else sr
+        half = max(1, int(CROSSFADE_SECONDS * out_sr) // 2)
+
+        # Statistics taken from the start of the stream (initial noise estimates)
+        heads, y, start = {}, _open_source(source).read(0, min(n, int(HEAD_SECONDS * sr))), 0
+        for i, step in enumerate(phase):
+            if step.side_output:
+                continue
+            heads[i] = step.head(y)
+            y, start, *_ = _run_steps([step], y, start, 0, 0, n, {0: heads[i]}, peak, speech)
+
+        jobs = [{
+            'source': source, 'steps': phase, 'heads': heads, 'peak': peak, 'speech': speech,
+            'window': (max(0, cuts[j] - pad), min(n, cuts[j + 1] + pad)),
+            'core': (cuts[j], cuts[j + 1]), 'length': n, 'half': half,
+            'output': f"phase{p}_{j}",
+            'scratch': {**store, 'key': f"features{p}_{j}"},
+        } for j in range(len(cuts) - 1)]
+        if p == 0:
+            artifacts['segments'] = len(jobs)
+        results = list(map_fn(run_segment, jobs))
+
+        feature_parts += [res['stats']['features'] for res in results if 'features' in res['stats']]
+        clipping = [res['stats']['clipping'] for res in results if 'clipping' in res['stats']]
+        if clipping:
+            artifacts['clipping'] = {
+                'clipped_samples': sum(c['clipped_samples'] for c in clipping),
+                'clipped_runs': sum(c['clipped_runs'] for c in clipping),
+                'longest_run': max(c['longest_run'] for c in clipping),
+            }
+        peak = max(res['peak'] for res in results)
+        for step in phase:
+            n = step.out_position(n, n)
+        source = {'kind': 'spool', 'length': n, 'half': half, 'store': store,
+                  'parts': [(res['a'], res['lo'], res['output']) for res in results]}
+        sr = out_sr
+
+    # Stitch the last phase into the output file, a minute at a time
+    out = _open_source(source)
+    first = out.read(0, 1)
+    block = int(60 * sr)
+    with sf.SoundFile(output_path, 'w', samplerate=sr, channels=1 if first.ndim == 1 else first.shape[1],
+                      subtype='PCM_16') as f:
+        for a in range(0, n, block):
+            f.write(out.read(a, min(n, a + block)))
+
+    features = next((step for step in steps if isinstance(step, _Features)), None)
+    if features is not None:
+        from .features import write_features
+        engine = features.engine
+        artifacts['feature_frame_rate'] = engine.sr / engine.hop_length
+        chunks = ({name: _load(part['rows'][name]) for name in features.rows} for part in feature_parts)
+        write_features(engine, chunks, sum(part['frames'] for part in feature_parts),
+                       max((part['max_power'] for part in feature_parts), default=0.0),
+                       output_folder, base_name, artifacts)
+    return sr, artifacts
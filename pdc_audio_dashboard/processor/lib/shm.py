@@ -0,0 +1,155 @@
+# shm.py
+"""
+Shared-memory handoff of arrays between pool processes.
+
+Only a small descriptor crosses the process boundary,
+
+    {'shm': 'pdc_4242_9f1c03aa_phase0_3', 'shape': [5292000, 2], 'dtype': 'float32'}
+
+and the receiver maps the same pages with attach(): nothing is pickled or
+copied. Blocks belong to a SharedRun. Every block of a run is named with the
+run's prefix (pdc_<owner pid>_<token>_), and the owner (the process that
+opened the run) unlinks them all by prefix when the run ends. That includes
+blocks pool workers created for their results, so a worker dying between
+creating a block and returning its descriptor leaks nothing. If the owner
+itself is killed, the next SharedRun of any process sweeps the blocks whose
+owner pid is gone.
+
+Needs POSIX shared memory listed under /dev/shm (Linux). Elsewhere, or when
+/dev/shm is too small (Docker's default is 64 MB), available() is False and
+callers keep their file-based path.
+"""
+import os
+import secrets
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+SHM_DIR = '/dev/shm'
+_PREFIX = 'pdc_'
+
+# Blocks mapped by this process: name -> SharedMemory
+_attached = {}
+_lock = threading.Lock()
+
+
+def available(nbytes=0):
+    """True if shared memory can be listed here and has room for `nbytes` more."""
+    if not os.path.isdir(SHM_DIR):
+        return False
+    stats = os.statvfs(SHM_DIR)
+    return nbytes <= stats.f_bavail * stats.f_frsize
+
+
+def _owner_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _open(name, size=0):
+    block = shared_memory.SharedMemory(name=name, create=bool(size), size=size)
+    # Lifetimes follow the run prefix instead: the tracker of a pool worker
+    # would otherwise unlink the block when that worker exits
+    resource_tracker.unregister(f"/{block.name}", 'shared_memory')
+    return block
+
+
+def _unlink(name):
+    # shm_unlink() of a name is removing its file under /dev/shm
+    try:
+        os.remove(os.path.join(SHM_DIR, name))
+    except FileNotFoundError:
+        pass
+
+
+def sweep_stale():
+    """Unlink blocks of runs whose owner process no longer exists. Returns how many were removed."""
+    removed = 0
+    for name in os.listdir(SHM_DIR):
+        pid = name[len(_PREFIX):].split('_', 1)[0] if name.startswith(_PREFIX) else ''
+        if pid.isdigit() and not _owner_alive(int(pid)):
+            _unlink(name)
+            removed += 1
+    return removed
+
+
+def put(name, array):
+    """Copy `array` into a new block called `name`; returns its descriptor."""
+    array = np.ascontiguousarray(array)
+    block = _open(name, max(1, array.nbytes))
+    view = np.ndarray(array.shape, array.dtype, buffer=block.buf)
+    view[...] = array
+    del view
+    block.close()
+    return {'shm': name, 'shape': list(array.shape), 'dtype': array.dtype.str}
+
+
+def create(name, shape, dtype):
+    """
+    New zeroed block called `name`, kept mapped in this process.
+
+    Returns:
+        tuple: (descriptor, writable ndarray over the block)
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape)) * dtype.itemsize
+    block = _open(name, max(1, size))
+    with _lock:
+        _attached[name] = block
+    descriptor = {'shm': name, 'shape': list(shape), 'dtype': dtype.str}
+    return descriptor, np.ndarray(shape, dtype, buffer=block.buf)
+
+
+def attach(descriptor):
+    """Read-only ndarray over a block; it stays mapped until detach() of its run."""
+    name = descriptor['shm']
+    with _lock:
+        block = _attached.get(name)
+        if block is None:
+            block = _attached[name] = _open(name)
+    array = np.ndarray(descriptor['shape'], np.dtype(descriptor['dtype']), buffer=block.buf)
+    array.flags.writeable = False
+    return array
+
+
+def detach(prefix):
+    """
+    Unmap this process's blocks whose name starts with `prefix`. Blocks still
+    referenced by a live array stay mapped until the next call.
+    """
+    with _lock:
+        for name in [n for n in _attached if n.startswith(prefix)]:
+            try:
+                _attached[name].close()
+            except BufferError:
+                continue
+            del _attached[name]
+
+
+class SharedRun:
+    """
+    Owner of a group of blocks. Use as a context manager: on exit every block
+    named with `prefix` is unmapped here and unlinked, whoever created it.
+    """
+
+    def __init__(self):
+        sweep_stale()
+        self.prefix = f"{_PREFIX}{os.getpid()}_{secrets.token_hex(4)}_"
+
+    def close(self):
+        detach(self.prefix)
+        for name in os.listdir(SHM_DIR):
+            if name.startswith(self.prefix):
+                _unlink(name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
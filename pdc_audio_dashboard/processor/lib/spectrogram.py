@@ -1,21 +1,20 @@
 # spectrogram.py
 
-import librosa
-import numpy as np
+from .features import DEFAULT_FEATURES, FeatureEngine
 
-def compute_mel_spectrogram(wav_path, sr=16000, n_mels=128, hop_length=512):
+
+def compute_features(wav_path, sr=16000, features=DEFAULT_FEATURES, n_mels=128, n_mfcc=13, hop_length=512):
+    """Load the file once and derive every requested feature from one STFT."""
+    import librosa
     y, sr = librosa.load(wav_path, sr=sr)
-    S = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=n_mels, hop_length=hop_length)
-    S_db = librosa.power_to_db(S, ref=np.max)
-    return S_db
+    engine = FeatureEngine(sr, hop_length=hop_length, n_mels=n_mels, n_mfcc=n_mfcc, features=features)
+    return engine.compute(y)
+
+def compute_mel_spectrogram(wav_path, sr=16000, n_mels=128, hop_length=512):
+    return compute_features(wav_path, sr, ['mel_spectrogram'], n_mels=n_mels, hop_length=hop_length)['mel_spectrogram']
 
 def compute_mfcc(wav_path, sr=16000, n_mfcc=13, hop_length=512):
-    y, sr = librosa.load(wav_path, sr=sr)
-    mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=n_mfcc, hop_length=hop_length)
-    return mfccs
+    return compute_features(wav_path, sr, ['mfcc'], n_mfcc=n_mfcc, hop_length=hop_length)['mfcc']
 
 def compute_log_mel(wav_path, sr=16000, n_mels=128, hop_length=512):
-    y, sr = librosa.load(wav_path, sr=sr)
-    S = librosa.feature.melspectrogram(y=y, sr=sr, n_mels=n_mels, hop_length=hop_length)
-    log_S = librosa.power_to_db(S)
-    return log_S
+    return compute_features(wav_path, sr, ['log_mel'], n_mels=n_mels, hop_length=hop_length)['log_mel']
@@ -0,0 +1,156 @@
+# spectrogram_tiles.py
+"""
+Downsampled spectrogram previews for the dashboard.
+
+The worker builds a pyramid next to the full-resolution mel spectrogram:
+level k max-pools 2**k frames into one, down to TILE_FRAMES frames. A preview
+request picks the coarsest level that still has at least `width` frames in
+the requested time range, so drawing an hour-long file reads a few hundred
+columns instead of the whole float array.
+
+Only NumPy and the standard library are used (PNGs are encoded with zlib),
+so the module is cheap to import from the views.
+"""
+import os
+import json
+import zlib
+import struct
+import hashlib
+from functools import lru_cache
+
+import numpy as np
+
+TILE_FRAMES = 256
+MAX_WIDTH = 4096
+DB_RANGE = (-80.0, 0.0)  # mel_spectrogram is power_to_db(ref=np.max, top_db=80)
+
+BASE_FEATURE = 'mel_spectrogram'
+
+
+def level_name(level):
+    return BASE_FEATURE if level == 0 else f"{BASE_FEATURE}_lod{level}"
+
+
+def level_ref(ref, level):
+    """Spectrogram reference (store ref or .npy path) of a pyramid level."""
+    if level == 0:
+        return ref
+    if '#' in ref:
+        return ref.rsplit('/', 1)[0] + '/' + level_name(level)
+    return ref[:-len('.npy')] + f"_lod{level}.npy"
+
+
+def build_pyramid(S, min_frames=TILE_FRAMES):
+    """Max-pooled copies of S with 1/2, 1/4, ... of its frames."""
+    levels = []
+    current = np.asarray(S, dtype=np.float32)
+    while current.shape[1] > min_frames:
+        if current.shape[1] % 2:
+            current = np.concatenate([current, current[:, -1:]], axis=1)
+        current = current.reshape(current.shape[0], -1, 2).max(axis=2)
+        levels.append(current)
+    return levels
+
+
+def write_pyramid(mel_path, frame_rate=None, min_frames=TILE_FRAMES):
+    """
+    Save the pyramid of a mel spectrogram .npy as <name>_lod<k>.npy files.
+
+    Returns:
+        tuple: ({feature_name: path}, meta) where meta describes the base
+        array ('frames', 'n_mels', 'frame_rate', 'levels') for the API.
+    """
+    S = np.load(mel_path, mmap_mode='r')
+    paths = {}
+    levels = build_pyramid(S, min_frames)
+    for k, level in enumerate(levels, start=1):
+        path = level_ref(mel_path, k)
+        np.save(path, level)
+        paths[level_name(k)] = path
+    meta = {'frames': int(S.shape[1]), 'n_mels': int(S.shape[0]),
+            'frame_rate': frame_rate, 'levels': len(levels)}
+    return paths, meta
+
+
+def choose_level(range_frames, width, levels):
+    """Coarsest level that still keeps at least `width` frames of the range."""
+    level = 0
+    while level < levels and range_frames // 2 ** (level + 1) >= width:
+        level += 1
+    return level
+
+
+def _pool(a, size, axis):
+    """Max-pool axis of `a` down to `size` bins (no-op if already smaller)."""
+    n = a.shape[axis]
+    if n <= size:
+        return a
+    edges = np.linspace(0, n, size + 1).astype(np.int64)[:-1]
+    return np.maximum.reduceat(a, edges, axis=axis)
+
+
+def encode_png(gray):
+    """8-bit grayscale PNG of a 2-D uint8 array."""
+    height, width = gray.shape
+    raw = b''.join(b'\x00' + gray[row].tobytes() for row in range(height))
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 6))
+            + chunk(b'IEND', b''))
+
+
+def source_path(ref, root):
+    """The file whose modification time versions a spectrogram reference."""
+    if '#' in ref:
+        from .feature_store import INDEX_FILE
+        return os.path.join(root, ref.split('#', 1)[0], INDEX_FILE)
+    return os.path.join(root, ref)
+
+
+def preview_etag(ref, root, *params):
+    stamp = os.path.getmtime(source_path(ref, root))
+    key = json.dumps([ref, stamp, *params])
+    return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+
+
+@lru_cache(maxsize=256)
+def render_preview(ref, root, meta_json, start, end, width, height, output, etag):
+    """
+    Render frames for [start, end) seconds at most width x height.
+    `etag` only takes part in the cache key, so a rewritten source is
+    re-rendered instead of served stale.
+
+    Returns:
+        tuple: (body bytes, content type)
+    """
+    from .feature_store import load_feature
+
+    meta = json.loads(meta_json)
+    frame_rate = meta.get('frame_rate') or 1.0
+    f0 = max(0, int(start * frame_rate))
+    f1 = meta['frames'] if end is None else min(meta['frames'], int(np.ceil(end * frame_rate)))
+    f1 = max(f1, f0 + 1)
+
+    level = choose_level(f1 - f0, width, meta.get('levels', 0))
+    S = load_feature(level_ref(ref, level), root)
+    S = np.asarray(S[:, f0 >> level:-(-f1 >> level)], dtype=np.float32)
+    S = _pool(_pool(S, width, axis=1), height, axis=0)
+
+    if output == 'png':
+        lo, hi = DB_RANGE
+        gray = np.clip((S - lo) / (hi - lo) * 255, 0, 255).astype(np.uint8)
+        return encode_png(gray[::-1]), 'image/png'  # low frequencies at the bottom
+
+    body = {
+        'start': f0 / frame_rate,
+        'end': f1 / frame_rate,
+        'level': level,
+        'shape': list(S.shape),
+        'db_range': list(DB_RANGE),
+        'data': np.round(S, 1).tolist(),
+    }
+    return json.dumps(body).encode(), 'application/json'
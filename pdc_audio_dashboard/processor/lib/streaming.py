@@ -0,0 +1,855 @@
+# streaming.py
+"""
+Bounded-memory, block-based execution of a pipeline definition.
+
+The in-memory pipeline decodes the whole input and every stage holds a full
+copy of the signal, so worker RSS grows with recording length. Here the input
+is read in fixed-size blocks with soundfile and pushed through a chain of
+stateful block stages:
+
+- IIR filters (band/low/high-pass, hum notch, pre-emphasis) carry their
+  filter state (zi) from block to block; the zero-phase hum notch holds back
+  a few seconds for its backward pass.
+- STFT stages run on the same chunk grid as their whole-file packages:
+  logMMSE on 60 s chunks with its overlap and noise estimate carried over,
+  the voice enhancement gate on noisereduce's padded chunks. The
+  compressor carries its envelope, so streamed output matches in-memory
+  runs sample for sample.
+- Stages that need a whole-file statistic (peak scaling after noise
+  reduction, peak and loudness normalisation, the dB reference of the mel
+  spectrogram)
+  split the run in two passes: the first pass spools the stream to a float
+  file on disk while measuring, the second pass applies the result.
+- vad is such a stage too: pass 1 scores frames, pass 2 knows the speech
+  segments, and noise_reduction, enhance_voice and features then run on
+  every speech region separately with silence around them, as in memory.
+
+The final WAV and the feature .npy files are written incrementally, so peak
+memory depends on the block size, not on the input duration.
+"""
+import os
+import numpy as np
+import soundfile as sf
+
+from .pipeline import _STAGES, _build_filter_bank, compile_pipeline
+
+BLOCK_SIZE = 65536
+
+# Files at least this long are streamed automatically by process_file_task
+STREAMING_MIN_DURATION = 600.0
+
+
+def should_stream(input_path, min_duration=STREAMING_MIN_DURATION):
+    """
+    True when libsndfile can decode the input block by block and it is long
+    enough for streaming to pay off.
+    """
+    try:
+        return sf.info(input_path).duration >= min_duration
+    except RuntimeError:
+        return False
+
+
+# ---------------------------------------------------------------------------
+# Block stages. Blocks are always float (frames, channels).
+# ---------------------------------------------------------------------------
+
+class BlockStage:
+    """Stateful stage: process() may return fewer/more frames than it got."""
+    two_pass = False
+
+    def __init__(self, sr, channels):
+        self.sr = self.out_sr = sr
+        self.channels = self.out_channels = channels
+
+    def process(self, block):
+        return block
+
+    def flush(self):
+        return np.zeros((0, self.out_channels))
+
+    def close(self):
+        pass
+
+
+class TwoPassStage(BlockStage):
+    """Stage that must observe the whole stream before it can transform it."""
+    two_pass = True
+
+    def observe(self, block):
+        pass
+
+
+class _TrimSilence(BlockStage):
+    """
+    Streaming equivalent of pydub's detect_nonsilent: a millisecond is dropped
+    when any min_silence_len window covering it has RMS <= silence_thresh.
+    Output lags the input by min_silence_len.
+    """
+    def __init__(self, sr, channels, min_silence_len=100, silence_thresh=-40):
+        super().__init__(sr, channels)
+        self.msl = int(min_silence_len)
+        self.silence_thresh = silence_thresh
+        self._buf = np.zeros((0, channels))
+        self._buf_ms = 0                 # ms index of the first buffered sample
+        self._energy = np.zeros(0)       # per-ms energy from self._e_ms onwards
+        self._count = np.zeros(0)
+        self._e_ms = 0
+        self._known_ms = 0               # ms units with complete energy
+
+    def _bound(self, ms):
+        # Same ms -> frame mapping as AudioSegment slicing
+        return int(ms * self.sr / 1000.0)
+
+    def _bounds(self, first, last):
+        return (np.arange(first, last + 1) * self.sr / 1000.0).astype(np.int64)
+
+    def _add_energy(self, final):
+        start_abs = self._bound(self._buf_ms)
+        end_abs = start_abs + len(self._buf)
+        first = self._known_ms
+        last = max(first, int(end_abs * 1000 // self.sr))
+        while self._bound(last + 1) <= end_abs:
+            last += 1
+        while last > first and self._bound(last) > end_abs:
+            last -= 1
+        if final:
+            # The signal is round(duration in ms) long, as an AudioSegment; a partial
+            # last millisecond is dropped or padded with silence
+            last = max(last, round(1000 * (end_abs / self.sr)))
+        if last == first:
+            return
+        edges = self._bounds(first, last) - start_abs
+        sq = (self._buf[edges[0]:edges[-1]] ** 2).sum(axis=1)
+        csum = np.concatenate([[0.0], np.cumsum(sq)])
+        rel = np.minimum(edges, len(self._buf)) - edges[0]
+        self._energy = np.concatenate([self._energy, np.diff(csum[rel])])
+        self._count = np.concatenate([self._count, np.diff(edges) * self.channels])
+        self._known_ms = last
+
+    def _decide(self, final):
+        self._add_energy(final)
+        msl = self.msl
+        last_start = self._known_ms - msl  # last window start we can evaluate
+        if final:
+            decide_to = self._known_ms
+        else:
+            decide_to = max(self._buf_ms, last_start + 1)
+        if decide_to <= self._buf_ms:
+            return np.zeros((0, self.channels))
+
+        # Window silence flags for starts in [w0, last_start]
+        w0 = max(0, self._buf_ms - msl + 1)
+        silent_ms = np.zeros(decide_to - self._buf_ms, dtype=bool)
+        if last_start >= w0:
+            off = w0 - self._e_ms
+            e = np.concatenate([[0.0], np.cumsum(self._energy[off:])])
+            c = np.concatenate([[0.0], np.cumsum(self._count[off:])])
+            n_win = last_start - w0 + 1
+            win_e = e[msl:msl + n_win] - e[:n_win]
+            win_c = np.maximum(c[msl:msl + n_win] - c[:n_win], 1)
+            from .trim_silence import pcm_rms_threshold
+            rms, thresh = pcm_rms_threshold(np.sqrt(win_e / win_c), self.silence_thresh)
+            flags = rms <= thresh
+            # ms m is silent if any window starting in [m - msl + 1, m] is silent
+            cover = np.zeros(n_win + msl, dtype=int)
+            np.add.at(cover, np.flatnonzero(flags), 1)
+            np.add.at(cover, np.flatnonzero(flags) + msl, -1)
+            covered = np.cumsum(cover)[:n_win + msl - 1] > 0
+            lo = self._buf_ms - w0
+            seg = covered[lo:lo + len(silent_ms)]
+            silent_ms[:len(seg)] = seg
+
+        start_abs = self._bound(self._buf_ms)
+        edges = self._bounds(self._buf_ms, decide_to) - start_abs
+        if edges[-1] > len(self._buf):
+            self._buf = np.concatenate([self._buf, np.zeros((edges[-1] - len(self._buf), self.channels))])
+        keep = np.repeat(~silent_ms, np.diff(edges))
+        out = self._buf[:edges[-1]][keep]
+
+        self._buf = self._buf[edges[-1]:]
+        self._buf_ms = decide_to
+        # Keep energies still needed by windows that cover undecided ms
+        drop = max(0, (self._buf_ms - msl + 1) - self._e_ms)
+        self._energy, self._count = self._energy[drop:], self._count[drop:]
+        self._e_ms += drop
+        return out
+
+    def process(self, block):
+        self._buf = np.concatenate([self._buf, block])
+        return self._decide(final=False)
+
+    def flush(self):
+        return self._decide(final=True)
+
+
+class _LogMMSE(BlockStage):
+    """
+    logMMSE on the logmmse package's 60 s chunk grid, with the noise estimate
+    and overlap carried from chunk to chunk. Each chunk drops its incomplete
+    last frames as the package does, so the output is as long as the
+    in-memory stage's. Output lags the input by up to one chunk.
+    """
+    def __init__(self, sr, channels):
+        super().__init__(sr, channels)
+        from logmmse.logmmse import logmmse as _logmmse
+        self._logmmse = _logmmse
+        self._params = [None] * channels
+        self._pending = []
+        self._pending_len = 0
+        self._chunk = int(np.floor(60 * sr))
+        slen = int(np.floor(0.02 * sr))
+        slen += slen % 2
+        self._slen, self._hop = slen, slen // 2
+
+    def _run(self, chunk):
+        if len(chunk) // self._hop - self._slen // self._hop <= 0:
+            # Too short for a single frame
+            return np.zeros((0, self.channels))
+        outs = []
+        for ch in range(self.channels):
+            out, self._params[ch] = self._logmmse(chunk[:, ch], self.sr, 6, 0, 0.15, self._params[ch])
+            outs.append(out)
+        return np.stack(outs, axis=1)
+
+    def process(self, block):
+        self._pending.append(block + np.finfo(np.float64).eps)
+        self._pending_len += len(block)
+        if self._pending_len < self._chunk:
+            return np.zeros((0, self.channels))
+        buf = np.concatenate(self._pending)
+        full = len(buf) // self._chunk * self._chunk
+        outs = [self._run(buf[a:a + self._chunk]) for a in range(0, full, self._chunk)]
+        self._pending = [buf[full:]]
+        self._pending_len = len(buf) - full
+        return np.concatenate(outs)
+
+    def flush(self):
+        if not self._pending_len:
+            return np.zeros((0, self.channels))
+        tail = np.concatenate(self._pending)
+        self._pending, self._pending_len = [], 0
+        return self._run(tail)
+
+
+class _PeakGate(TwoPassStage):
+    """Second half of noise_reduction_array: scale by the global peak, gate < 0.01."""
+    def __init__(self, sr, channels):
+        super().__init__(sr, channels)
+        self.peak = 0.0
+
+    def observe(self, block):
+        if block.size:
+            self.peak = max(self.peak, float(np.max(np.abs(block))))
+
+    def process(self, block):
+        if self.peak > 0:
+            block = block / self.peak
+        block[np.abs(block) < 0.01] = 0
+        return block
+
+
+class _Resample(BlockStage):
+    def __init__(self, sr, channels, target_sr=16000):
+        super().__init__(sr, channels)
+        self.out_sr = target_sr
+        self._stream = None
+        self._frames_in = self._frames_out = 0
+        if sr != target_sr:
+            import soxr
+            self._stream = soxr.ResampleStream(sr, target_sr, channels, dtype='float32', quality='HQ')
+
+    def process(self, block):
+        if self._stream is None:
+            return block
+        self._frames_in += len(block)
+        out = self._stream.resample_chunk(block.astype(np.float32)).reshape(-1, self.channels)
+        self._frames_out += len(out)
+        return out
+
+    def flush(self):
+        if self._stream is None:
+            return np.zeros((0, self.channels))
+        tail = self._stream.resample_chunk(np.zeros((0, self.channels), dtype=np.float32), last=True)
+        tail = tail.reshape(-1, self.channels)
+        # Padded to resample_array's ceil(n * ratio) samples
+        n = int(np.ceil(self._frames_in * (float(self.out_sr) / self.sr)))
+        missing = n - self._frames_out - len(tail)
+        if missing > 0:
+            tail = np.concatenate([tail, np.zeros((missing, self.channels), tail.dtype)])
+        return tail[:max(0, n - self._frames_out)]
+
+
+class _RepairClipping(BlockStage):
+    """
+    declip() on a buffer of the last CONTEXT emitted samples plus new input.
+    A run still open at the end of the buffer, or without CONTEXT samples
+    after it, is held back with its context until more input arrives, so
+    every run is repaired exactly as in the whole-file stage.
+    """
+    def __init__(self, sr, channels, artifacts, threshold=0.99):
+        super().__init__(sr, channels)
+        from .clipping import CONTEXT
+        self.context = CONTEXT
+        self.threshold = threshold
+        self.stats = artifacts.setdefault('clipping', {'clipped_samples': 0, 'clipped_runs': 0, 'longest_run': 0})
+        self._buf = np.zeros((0, channels))
+        self._lead = 0  # already emitted context frames at the head of _buf
+
+    def _run(self, final):
+        from .clipping import clipping_stats, declip
+        buf, lead = self._buf, self._lead
+        cut = len(buf)
+        if not final:
+            clipped = np.flatnonzero(np.any(np.abs(buf[lead:]) >= self.threshold, axis=1)) + lead
+            if len(clipped) and clipped[-1] >= len(buf) - self.context:
+                # Start of the trailing clipped stretch (on any channel)
+                gaps = np.flatnonzero(np.diff(clipped) > 1)
+                cut = clipped[gaps[-1] + 1] if len(gaps) else clipped[0]
+        out = declip(buf, self.threshold)[0][lead:cut]
+        stats = clipping_stats(buf[lead:cut], self.threshold)
+        for key in ('clipped_samples', 'clipped_runs'):
+            self.stats[key] += stats[key]
+        self.stats['longest_run'] = max(self.stats['longest_run'], stats['longest_run'])
+        start = max(0, cut - self.context)
+        self._buf, self._lead = buf[start:], cut - start
+        return out
+
+    def process(self, block):
+        self._buf = np.concatenate([self._buf, block])
+        return self._run(final=False)
+
+    def flush(self):
+        return self._run(final=True)
+
+
+class _FilterCascade(BlockStage):
+    """A fused run of linear stages with its SOS state carried between blocks."""
+    def __init__(self, sr, channels, group):
+        super().__init__(sr, channels)
+        self.downmix = channels > 1 and any(_STAGES[name]['downmix'] for name, _ in group)
+        if self.downmix:
+            self.out_channels = 1
+        self.bank = _build_filter_bank(sr, group)
+
+    def process(self, block):
+        if self.downmix:
+            block = block.mean(axis=1, keepdims=True)
+        return self.bank.process_block(block)
+
+    def flush(self):
+        tail = self.bank.flush()
+        return np.zeros((0, self.out_channels)) if tail is None else tail
+
+
+class _Downmix(BlockStage):
+    def __init__(self, sr, channels):
+        super().__init__(sr, channels)
+        self.out_channels = 1
+
+    def process(self, block):
+        return block.mean(axis=1, keepdims=True)
+
+
+class _VoiceGate(BlockStage):
+    """
+    enhance_voice's noisereduce gate on noisereduce's own grid: chunk c is
+    gated with NR_PADDING samples of context on both sides, zeros outside the
+    signal, so each chunk is gated as in the whole-file call. The noise clip
+    defaults to the first 0.5 s, as in the whole-file stage. Output lags the
+    input by up to a chunk plus its padding.
+    """
+    def __init__(self, sr, channels, noise_clip=None):
+        super().__init__(sr, channels)
+        from .audio_processor import NR_CHUNK_SIZE, NR_PADDING
+        self.chunk, self.pad = NR_CHUNK_SIZE, NR_PADDING
+        self._buf = np.zeros(0, np.float32)
+        self._buf_start = 0   # stream position of _buf[0]
+        self._next = 0        # next chunk to gate
+        self._received = 0
+        self._noise_clip = noise_clip
+
+    def _gate(self, c, n=None):
+        """Gate chunk c; n is the signal length once the stream has ended."""
+        from .audio_processor import reduce_voice_noise
+        lo, hi = c * self.chunk - self.pad, (c + 1) * self.chunk + self.pad
+        if n is not None and n <= self.chunk:
+            hi = n + self.pad  # short inputs are gated in one piece
+        piece = np.zeros(hi - lo, np.float32)
+        a, b = max(lo, self._buf_start), min(hi, self._received)
+        piece[a - lo:b - lo] = self._buf[a - self._buf_start:b - self._buf_start]
+        gated = reduce_voice_noise(piece, self.sr, self._noise_clip, chunk_size=None, padding=0)
+        end = (c + 1) * self.chunk if n is None else min((c + 1) * self.chunk, n)
+        out = gated[self.pad:self.pad + end - c * self.chunk]
+        # Keep the context the next chunk reads
+        keep = (c + 1) * self.chunk - self.pad
+        if keep > self._buf_start:
+            self._buf = self._buf[keep - self._buf_start:]
+            self._buf_start = keep
+        self._next = c + 1
+        return out
+
+    def process(self, block):
+        with np.errstate(under='ignore'):
+            self._buf = np.concatenate([self._buf, block[:, 0].astype(np.float32)])
+        self._received += len(block)
+        outs = []
+        while self._received >= (self._next + 1) * self.chunk + self.pad:
+            if self._noise_clip is None:
+                self._noise_clip = self._buf[:int(0.5 * self.sr)].copy()
+            outs.append(self._gate(self._next))
+        return np.concatenate(outs)[:, np.newaxis] if outs else np.zeros((0, 1))
+
+    def flush(self):
+        n = self._received
+        if self._noise_clip is None:
+            self._noise_clip = self._buf[:int(0.5 * self.sr)].copy()
+        outs = [self._gate(c, n) for c in range(self._next, -(-n // self.chunk))]
+        return np.concatenate(outs)[:, np.newaxis] if outs else np.zeros((0, 1))
+
+
+class _Compress(BlockStage):
+    """enhance_voice's compressor (compress_voice) with its state carried across blocks."""
+    def __init__(self, sr, channels, gain_db=6):
+        super().__init__(sr, channels)
+        from .dynamics import Compressor
+        self.compressor = Compressor(sr, threshold=-20.0, ratio=3.0, attack=5.0, release=50.0,
+                                     gain_db=gain_db, ceiling_dBFS=0.0)
+
+    def process(self, block):
+        return self.compressor.process(block)
+
+
+def _enhance_voice_stage(sr, channels, ctx, target_sr=16000, gain_db=6):
+    # enhance_voice_array's order: downmix, resample, gate, compress. The noise
+    # clip is the first 0.5 s of the whole stream, also for speech regions.
+    stages = []
+    if channels > 1:
+        stages.append(_Downmix(sr, channels))
+    if sr != target_sr:
+        stages.append(_Resample(sr, 1, target_sr))
+
+    def enhance(head):
+        with np.errstate(under='ignore'):
+            noise_clip = head[:, 0].astype(np.float32)
+        return [_VoiceGate(target_sr, 1, noise_clip), _Compress(target_sr, 1, gain_db)]
+    stages.append(_SpeechRegions(target_sr, 1, ctx, enhance, head=int(0.5 * target_sr)))
+    return stages
+
+
+class _Vad(TwoPassStage):
+    """
+    vad in two passes: pass 1 scores the 30 ms frames as they stream by
+    (frames are independent, see speech_frame_stats), pass 2 thresholds them
+    against the whole-file noise floor and publishes ctx['speech_segments']
+    for the stages after it. The signal passes through untouched.
+    """
+    def __init__(self, sr, channels, ctx, aggressiveness=2, padding_ms=300):
+        super().__init__(sr, channels)
+        self.ctx, self.aggressiveness, self.padding_ms = ctx, aggressiveness, padding_ms
+        self.frame_len = max(1, int(sr * 30 / 1000))
+        self.frames = 0
+        self._rest = np.zeros((0, channels))
+        self._stats = []
+        self._segments = None
+
+    def observe(self, block):
+        from .vad import speech_frame_stats
+        self.frames += len(block)
+        buf = np.concatenate([self._rest, block])
+        full = len(buf) // self.frame_len * self.frame_len
+        if full:
+            self._stats.append(speech_frame_stats(buf[:full], self.sr, self.frame_len))
+        self._rest = buf[full:]
+
+    def segments(self):
+        from .vad import speech_fraction, speech_frame_stats, speech_segments_from_stats
+        if self._segments is None:
+            if len(self._rest):
+                # The last frame is zero padded, as in detect_speech_array
+                self._stats.append(speech_frame_stats(self._rest, self.sr, self.frame_len))
+            self._segments = []
+            if self.frames:
+                energy_db = np.concatenate([e for e, _ in self._stats])
+                band_ratio = np.concatenate([b for _, b in self._stats])
+                self._segments = speech_segments_from_stats(energy_db, band_ratio, self.frame_len, self.sr,
+                                                            self.frames, aggressiveness=self.aggressiveness,
+                                                            padding_ms=self.padding_ms)
+            self.ctx['artifacts']['speech_fraction'] = speech_fraction(self._segments, self.frames / self.sr)
+            # As in the in-memory stage: no detected speech means process everything
+            self.ctx['speech_segments'] = self._segments or None
+        return self._segments
+
+    def process(self, block):
+        self.segments()
+        return block
+
+    def close(self):
+        self.segments()
+
+
+class _SpeechRegions(BlockStage):
+    """
+    Runs a fresh chain of stages from make_chain(head) over every vad speech
+    region on its own and outputs silence around them, as the in-memory
+    stages do with ctx['speech_segments']: each region's output is cut or
+    zero padded to the region's length. Without speech segments the chain
+    runs over the whole stream. The first `head` frames of the stream are
+    collected before anything is processed and passed to make_chain.
+    """
+    def __init__(self, sr, channels, ctx, make_chain, head=0):
+        super().__init__(sr, channels)
+        self.ctx, self.make_chain, self.head = ctx, make_chain, head
+        self._head = np.zeros((0, channels))
+        self._started = False
+        self._ranges = None
+        self._pos = 0        # stream position of the next input frame
+        self._region = 0     # index of the next or current range
+        self._chain = None   # chain of the current range (or of the whole stream)
+        self._emitted = 0    # output frames of the current range so far
+
+    def _start(self):
+        from .vad import speech_sample_ranges
+        self._started = True
+        segments = self.ctx.get('speech_segments')
+        # Ends are cut to the stream length once it is known (flush)
+        self._ranges = speech_sample_ranges(segments, self.sr, np.iinfo(np.int64).max) if segments else None
+        if self._ranges is None:
+            self._chain = self.make_chain(self._head)
+
+    def _run(self, block):
+        out = []
+        _push(self._chain, block, out.append)
+        return out
+
+    def _region_output(self, pieces, length):
+        # Output of the current range, cut to its length
+        out = []
+        for piece in pieces:
+            piece = piece[:max(0, length - self._emitted)]
+            self._emitted += len(piece)
+            out.append(piece)
+        return out
+
+    def _end_region(self, length):
+        pieces = []
+        _flush(self._chain, pieces.append)
+        for stage in self._chain:
+            stage.close()
+        out = self._region_output(pieces, length)
+        out.append(np.zeros((length - self._emitted, self.out_channels)))
+        self._chain = None
+        self._region += 1
+        return out
+
+    def _feed(self, block):
+        if self._ranges is None:
+            return self._run(block)
+        out, i = [], 0
+        while i < len(block):
+            pos = self._pos + i
+            if self._chain is None:
+                start = self._ranges[self._region][0] if self._region < len(self._ranges) else None
+                if start is None or pos < start:
+                    take = len(block) - i if start is None else min(len(block) - i, start - pos)
+                    out.append(np.zeros((take, self.out_channels)))
+                    i += take
+                    continue
+                self._chain, self._emitted = self.make_chain(self._head), 0
+            start, end = self._ranges[self._region]
+            take = min(len(block) - i, end - pos)
+            out += self._region_output(self._run(block[i:i + take]), end - start)
+            i += take
+            if self._pos + i == end:
+                out += self._end_region(end - start)
+        self._pos += len(block)
+        return out
+
+    def _concat(self, pieces):
+        pieces = [p for p in pieces if len(p)]
+        return np.concatenate(pieces) if pieces else np.zeros((0, self.out_channels))
+
+    def process(self, block):
+        if not self._started:
+            self._head = np.concatenate([self._head, block])
+            if len(self._head) < self.head:
+                return np.zeros((0, self.out_channels))
+            block, self._head = self._head, self._head[:self.head]
+            self._start()
+        return self._concat(self._feed(block))
+
+    def flush(self):
+        out = []
+        if not self._started:
+            self._start()
+            out += self._feed(self._head)
+        if self._ranges is None:
+            _flush(self._chain, out.append)
+        elif self._chain is not None:
+            start = self._ranges[self._region][0]
+            out += self._end_region(self._pos - start)
+        return self._concat(out)
+
+
+class _NormalizePeak(TwoPassStage):
+    def __init__(self, sr, channels, target_dBFS=-1.0):
+        super().__init__(sr, channels)
+        self.target_dBFS = target_dBFS
+        self.peak = 0.0
+
+    def observe(self, block):
+        if block.size:
+            self.peak = max(self.peak, float(np.max(np.abs(block))))
+
+    def process(self, block):
+        if self.peak == 0:
+            return block
+        return block * 10 ** ((self.target_dBFS - 20 * np.log10(self.peak)) / 20)
+
+
+class _NormalizeLufs(TwoPassStage):
+    """Pass 1 meters the K-weighted stream (lib/loudness.py), pass 2 applies the gain."""
+    def __init__(self, sr, channels, artifacts, target_lufs=-23.0):
+        super().__init__(sr, channels)
+        from .loudness import LoudnessMeter
+        self.meter = LoudnessMeter(sr, channels)
+        self.artifacts, self.target_lufs = artifacts, target_lufs
+        self._gain = None
+
+    def observe(self, block):
+        self.meter.add(block)
+
+    def gain_db(self):
+        from .loudness import loudness_gain
+        if self._gain is None:
+            self._gain = loudness_gain(self.meter.integrated_loudness(), self.target_lufs)
+        return self._gain
+
+    def process(self, block):
+        return block * 10 ** (self.gain_db() / 20)
+
+    def close(self):
+        from .loudness import loudness_stats
+        self.artifacts.update(loudness_stats(self.meter, self.gain_db()))
+
+
+class _Features(BlockStage):
+    """
+    Streaming feature extraction with the same FeatureEngine as the in-memory
+    stage (centred frames, zero padding, top_db=80). Mel power frames and
+    per-frame features are appended to scratch files; close() makes a second
+    pass to apply the whole-file dB references and write the .npy outputs.
+    With vad speech segments only frames around speech are transformed, each
+    from its region's samples alone; frames are then held back until the
+    samples they read are a whole hop from the end of the input so far, where
+    the region bounds no longer depend on the stream length.
+    """
+
+    def __init__(self, sr, channels, ctx, sr_features=16000, n_mels=128, n_mfcc=13, hop_length=512,
+                 n_fft=2048, features=None):
+        super().__init__(sr, channels)
+        from .features import DEFAULT_FEATURES, FRAME_FEATURES, FeatureEngine
+        self.ctx = ctx
+        self.folder, self.base_name, self.artifacts = ctx['output_folder'], ctx['base_name'], ctx['artifacts']
+        self.artifacts['feature_frame_rate'] = sr_features / hop_length
+        self.engine = FeatureEngine(sr_features, n_fft=n_fft, hop_length=hop_length, n_mels=n_mels,
+                                    n_mfcc=n_mfcc, features=features or DEFAULT_FEATURES)
+        self.n_fft, self.hop = n_fft, hop_length
+        self._resampler = _Resample(sr, 1, sr_features) if sr != sr_features else None
+        self._buf = np.zeros(self.n_fft // 2)  # centre=True zero padding
+        self._n_frames = 0
+        self._received = 0   # samples at sr_features pushed so far
+        self._speech = None  # (starts, ends) of the speech regions at sr_features
+        # Raw per-frame rows spooled to disk: mel power plus any frame features
+        self._rows = {name: 1 for name in self.engine.features if name in FRAME_FEATURES}
+        if self.engine.needs_mel:
+            self._rows['mel_power'] = n_mels
+        self._scratch_paths = {name: os.path.join(self.folder, f"{self.base_name}_{name}.tmp") for name in self._rows}
+        self._scratch = {name: open(path, 'wb') for name, path in self._scratch_paths.items()}
+        self._max_power = 0.0
+
+    def _speech_ranges(self):
+        from .vad import speech_sample_ranges
+        if self._speech is None:
+            segments = self.ctx.get('speech_segments')
+            ranges = speech_sample_ranges(segments, self.engine.sr, np.iinfo(np.int64).max) if segments else []
+            self._speech = tuple(np.array([r[i] for r in ranges], np.int64) for i in (0, 1))
+        return self._speech
+
+    def _frames(self, final=False):
+        n = 1 + (len(self._buf) - self.n_fft) // self.hop if len(self._buf) >= self.n_fft else 0
+        starts, ends = self._speech_ranges()
+        half, first = self.n_fft // 2, self._n_frames
+        if len(starts) and not final:
+            whole = self._received // self.hop * self.hop
+            n = min(n, (whole - self.n_fft + half) // self.hop + 1 - first)
+        if n <= 0:
+            return
+        idx = np.arange(self.n_fft)[np.newaxis, :] + self.hop * np.arange(n)[:, np.newaxis]
+        frames = self._buf[idx]
+        if len(starts):
+            # Regions that can reach frames [first, first + n), cut to the input so far
+            length, last = self._received, first + n
+            i0 = np.searchsorted(ends, (first - 1) * self.hop, side='right')
+            i1 = np.searchsorted(starts, last * self.hop)
+            regions = [(a, min(b, length)) for a, b in zip(starts[i0:i1], ends[i0:i1]) if a < length]
+            lo, hi = self.engine.frame_sources(regions, first, last, length)
+            pos = idx + first * self.hop - half
+            frames = np.where((pos >= lo[:, np.newaxis]) & (pos < hi[:, np.newaxis]), frames, 0.0)
+        power = self.engine.frame_power(frames)
+        raw = self.engine.frame_features(power)
+        if self.engine.needs_mel:
+            raw['mel_power'] = self.engine.mel_power(power)
+            self._max_power = max(self._max_power, float(raw['mel_power'].max()))
+        for name, rows in raw.items():
+            # (frames, rows) on disk, so every block is one contiguous append
+            self._scratch[name].write(rows.T.astype(np.float32).tobytes())
+        self._n_frames += n
+        self._buf = self._buf[n * self.hop:]
+
+    def _push(self, mono):
+        if self._resampler is not None:
+            mono = self._resampler.process(mono[:, np.newaxis])[:, 0]
+        self._buf = np.concatenate([self._buf, mono])
+        self._received += len(mono)
+        self._frames()
+
+    def process(self, block):
+        self._push(block.mean(axis=1))
+        return block
+
+    def flush(self):
+        if self._resampler is not None:
+            tail = self._resampler.flush()[:, 0]
+            self._buf = np.concatenate([self._buf, tail])
+            self._received += len(tail)
+        self._buf = np.concatenate([self._buf, np.zeros(self.n_fft // 2)])
+        self._frames(final=True)
+        return np.zeros((0, self.out_channels))
+
+    def close(self):
+        from .features import write_features
+
+        for f in self._scratch.values():
+            f.close()
+        n_frames, step = self._n_frames, 4096
+        raw = {}
+        if n_frames:
+            raw = {name: np.memmap(path, dtype=np.float32, mode='r', shape=(n_frames, self._rows[name]))
+                   for name, path in self._scratch_paths.items()}
+        chunks = ({name: rows[a:a + step] for name, rows in raw.items()} for a in range(0, n_frames, step))
+        write_features(self.engine, chunks, n_frames, self._max_power,
+                       self.folder, self.base_name, self.artifacts)
+        del raw
+        for path in self._scratch_paths.values():
+            os.remove(path)
+
+
+# ---------------------------------------------------------------------------
+# Executor
+# ---------------------------------------------------------------------------
+
+_STREAM_STAGES = {
+    'vad': lambda sr, ch, ctx, **p: [_Vad(sr, ch, ctx, **p)],
+    'trim_silence': lambda sr, ch, ctx, **p: [_TrimSilence(sr, ch, **p)],
+    'noise_reduction': lambda sr, ch, ctx, **p: [_SpeechRegions(sr, ch, ctx, lambda head: [_LogMMSE(sr, ch)]),
+                                                 _PeakGate(sr, ch)],
+    'resample': lambda sr, ch, ctx, **p: [_Resample(sr, ch, **p)],
+    'repair_clipping': lambda sr, ch, ctx, **p: [_RepairClipping(sr, ch, ctx['artifacts'], **p)],
+    'enhance_voice': lambda sr, ch, ctx, **p: _enhance_voice_stage(sr, ch, ctx, **p),
+    'normalize_peak': lambda sr, ch, ctx, **p: [_NormalizePeak(sr, ch, **p)],
+    'normalize_lufs': lambda sr, ch, ctx, **p: [_NormalizeLufs(sr, ch, ctx['artifacts'], **p)],
+    'features': lambda sr, ch, ctx, **p: [_Features(sr, ch, ctx, **p)],
+}
+
+
+def can_stream(definition):
+    """True when every stage of the pipeline has a block implementation."""
+    return all(step[0] == 'fused' or step[1] in _STREAM_STAGES for step in compile_pipeline(definition))
+
+
+def _build_stages(plan, sr, channels, ctx):
+    stages = []
+    for step in plan:
+        if step[0] == 'fused':
+            new = [_FilterCascade(sr, channels, step[1])]
+        else:
+            _, name, params = step
+            if name not in _STREAM_STAGES:
+                raise ValueError(f"Stage '{name}' has no streaming implementation")
+            new = _STREAM_STAGES[name](sr, channels, ctx, **params)
+        for s in new:
+            sr, channels = s.out_sr, s.out_channels
+        stages.extend(new)
+    return stages, sr, channels
+
+
+def _push(chain, block, sink, start=0):
+    """Push one block through chain[start:] into sink(block)."""
+    for stage in chain[start:]:
+        if not len(block):
+            return
+        block = stage.process(block)
+    if len(block):
+        sink(block)
+
+
+def _flush(chain, sink):
+    # Flush stage by stage so each tail still goes through the rest of the chain
+    for i, stage in enumerate(chain):
+        _push(chain, stage.flush(), sink, i + 1)
+
+
+def _run_chain(source, chain, sink):
+    """Push every block from source through chain into sink(block)."""
+    for block in source:
+        _push(chain, block, sink)
+    _flush(chain, sink)
+
+
+def run_pipeline_streaming(input_path, definition, output_path, output_folder, base_name,
+                           block_size=BLOCK_SIZE):
+    """
+    Execute a pipeline on `input_path` block by block and write `output_path`.
+
+    Returns:
+        tuple: (sr, artifacts), as run_pipeline does for the in-memory path.
+    """
+    info = sf.info(input_path)
+    ctx = {'output_folder': output_folder, 'base_name': base_name, 'artifacts': {}}
+    plan = compile_pipeline(definition)
+    stages, out_sr, out_channels = _build_stages(plan, info.samplerate, info.channels, ctx)
+
+    spools = []
+    source = sf.blocks(input_path, blocksize=block_size, always_2d=True)
+    chain = []
+    try:
+        for stage in stages:
+            if not stage.two_pass:
+                chain.append(stage)
+                continue
+            # Pass 1: run everything so far, measure, and spool to disk
+            spool_path = os.path.join(output_folder, f"{base_name}_spool_{len(spools)}.w64")
+            spools.append(spool_path)
+            with sf.SoundFile(spool_path, 'w', samplerate=stage.sr, channels=stage.channels,
+                              format='W64', subtype='DOUBLE') as spool:
+                def sink(block, spool=spool, stage=stage):
+                    stage.observe(block)
+                    spool.write(block)
+                _run_chain(source, chain, sink)
+            # Pass 2 starts from the spool with the now-informed stage
+            source = sf.blocks(spool_path, blocksize=block_size, always_2d=True)
+            chain = [stage]
+
+        with sf.SoundFile(output_path, 'w', samplerate=out_sr, channels=out_channels,
+                          subtype='PCM_16') as out:
+            _run_chain(source, chain, out.write)
+
+        for stage in stages:
+            stage.close()
+    finally:
+        for path in spools:
+            if os.path.exists(path):
+                os.remove(path)
+
+    return out_sr, ctx['artifacts']
@@ -1,15 +1,164 @@
-from pydub import AudioSegment
-from pydub.silence import detect_nonsilent
-
-def trim_silence(audio: AudioSegment, min_silence_len=100, silence_thresh=-40):
-    nonsilent_ranges = detect_nonsilent(
-        audio,
-        min_silence_len=min_silence_len,
-        silence_thresh=silence_thresh
-    )
+import numpy as np
+
+
+# Float audio is measured in 16-bit PCM units: pydub compares the truncated
+# integer RMS (audioop.rms) of the AudioSegment the file decodes to
+PCM_FULL_SCALE = 2 ** 15
+
+
+def pcm_rms_threshold(rms, silence_thresh, max_amplitude=1.0, integer=False):
+    """(RMS truncated to integer sample units, silence threshold in the same units)."""
+    scale = 1 if integer else PCM_FULL_SCALE / max_amplitude
+    return np.floor(rms * scale), (10 ** (silence_thresh / 20)) * max_amplitude * scale
+
+
+def detect_nonsilent_array(samples, sr, min_silence_len=100, silence_thresh=-40, max_amplitude=1.0):
+    """
+    Vectorized drop-in for pydub.silence.detect_nonsilent (seek_step=1).
+
+    Every min_silence_len window (stepped by 1 ms) whose RMS over all channels
+    is <= silence_thresh dBFS counts as silent; overlapping/touching silent
+    windows are merged and the complement is returned.
+
+    Args:
+        samples (np.ndarray): (frames,) or (frames, channels). RMS is
+            truncated to integer units like pydub's; float audio is measured
+            in 16-bit units (see PCM_FULL_SCALE).
+        sr (int): Sample rate in Hz.
+        max_amplitude (float): Full-scale value of `samples` (1.0 for float
+            audio, AudioSegment.max_possible_amplitude for PCM).
+
+    Returns:
+        list: [[start_ms, end_ms], ...] of non-silent ranges.
+    """
+    samples = np.asarray(samples)
+    n_frames = len(samples)
+    channels = 1 if samples.ndim == 1 else samples.shape[1]
+    seg_len = round(1000 * (n_frames / sr))
+
+    # you can't have a silent portion of a sound that is longer than the sound
+    if seg_len < min_silence_len:
+        return [[0, seg_len]]
+
+    sq = samples.astype(np.float64) ** 2
+    if sq.ndim > 1:
+        sq = sq.sum(axis=1)
+    csum = np.concatenate(([0.0], np.cumsum(sq)))
+
+    # RMS of every window [i, i + min_silence_len) ms, i = 0 .. seg_len - min_silence_len.
+    # AudioSegment pads slices past the end with silence, so count those frames too.
+    starts = np.arange(seg_len - min_silence_len + 1)
+    lo = (starts * sr / 1000.0).astype(np.int64)
+    hi = ((starts + min_silence_len) * sr / 1000.0).astype(np.int64)
+    energy = csum[np.minimum(hi, n_frames)] - csum[np.minimum(lo, n_frames)]
+    rms = np.sqrt(energy / np.maximum((hi - lo) * channels, 1))
+
+    rms, thresh = pcm_rms_threshold(rms, silence_thresh, max_amplitude, np.issubdtype(samples.dtype, np.integer))
+    return _nonsilent_from_rms(rms, thresh, seg_len, min_silence_len)
+
+
+def ms_energy(samples, sr, first_ms, last_ms, offset=0):
+    """
+    Sum of squares over all channels of every millisecond in
+    [first_ms, last_ms), with the same ms -> frame mapping as
+    detect_nonsilent_array. `samples` starts at frame `offset`; frames past
+    its end count as silence.
+    """
+    samples = np.asarray(samples)
+    sq = samples.astype(np.float64) ** 2
+    if sq.ndim > 1:
+        sq = sq.sum(axis=1)
+    csum = np.concatenate(([0.0], np.cumsum(sq)))
+    bounds = (np.arange(first_ms, last_ms + 1) * sr / 1000.0).astype(np.int64) - offset
+    return np.diff(csum[np.clip(bounds, 0, len(sq))])
 
-    trimmed_audio = AudioSegment.empty()
-    for start, end in nonsilent_ranges:
-        trimmed_audio += audio[start:end]
 
-    return trimmed_audio
+def detect_nonsilent_energy(energy, sr, n_frames, channels, min_silence_len=100, silence_thresh=-40):
+    """
+    detect_nonsilent_array from per-millisecond energies (see ms_energy) of
+    float audio, so the energies can be computed piecewise, e.g. one
+    segment of a long file per worker.
+    """
+    seg_len = round(1000 * (n_frames / sr))
+    if seg_len < min_silence_len:
+        return [[0, seg_len]]
+
+    e = np.concatenate(([0.0], np.cumsum(np.asarray(energy, dtype=np.float64)[:seg_len])))
+    e = np.concatenate((e, np.full(seg_len + 1 - len(e), e[-1])))
+    starts = np.arange(seg_len - min_silence_len + 1)
+    lo = (starts * sr / 1000.0).astype(np.int64)
+    hi = ((starts + min_silence_len) * sr / 1000.0).astype(np.int64)
+    window = e[starts + min_silence_len] - e[starts]
+    rms, thresh = pcm_rms_threshold(np.sqrt(window / np.maximum((hi - lo) * channels, 1)), silence_thresh)
+    return _nonsilent_from_rms(rms, thresh, seg_len, min_silence_len)
+
+
+def _nonsilent_from_rms(rms, thresh, seg_len, min_silence_len):
+    """Merge the silent windows (rms <= thresh) and return the complement."""
+    silence_starts = np.flatnonzero(rms <= thresh)
+
+    if not len(silence_starts):
+        return [[0, seg_len]]
+
+    # Merge windows into ranges: a new range starts after a gap > min_silence_len
+    breaks = np.flatnonzero(np.diff(silence_starts) > min_silence_len)
+    range_starts = silence_starts[np.concatenate(([0], breaks + 1))]
+    range_ends = silence_starts[np.concatenate((breaks, [len(silence_starts) - 1]))] + min_silence_len
+
+    if range_starts[0] == 0 and range_ends[0] == seg_len:
+        return []
+
+    # Complement, with the same edge handling as detect_nonsilent
+    nonsilent = np.stack([np.concatenate(([0], range_ends)),
+                          np.concatenate((range_starts, [seg_len]))], axis=1)
+    if range_ends[-1] == seg_len:
+        nonsilent = nonsilent[:-1]
+    if len(nonsilent) and nonsilent[0, 0] == 0 and nonsilent[0, 1] == 0:
+        nonsilent = nonsilent[1:]
+    return nonsilent.tolist()
+
+
+def gather_ranges(samples, sr, ranges):
+    """
+    Concatenate the [start_ms, end_ms] ranges of `samples` with one fancy
+    index instead of repeated appends. Slices running past the end are padded
+    with silence, as AudioSegment slicing does.
+    """
+    if not ranges:
+        return samples[:0]
+    bounds = (np.asarray(ranges, dtype=np.int64) * sr / 1000.0).astype(np.int64)
+    lengths = bounds[:, 1] - bounds[:, 0]
+    offsets = np.repeat(bounds[:, 0] - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+    idx = np.arange(lengths.sum()) + offsets
+
+    overflow = int(idx.max(initial=-1)) + 1 - len(samples)
+    if overflow > 0:
+        pad = np.zeros((overflow,) + samples.shape[1:], dtype=samples.dtype)
+        samples = np.concatenate([samples, pad])
+    return samples[idx]
+
+
+def trim_silence_array(data, sr, min_silence_len=100, silence_thresh=-40, max_amplitude=1.0,
+                       return_ranges=False):
+    """
+    Drop silent stretches from an array. With return_ranges=True the
+    non-silent [start_ms, end_ms] ranges are returned as well.
+    """
+    ranges = detect_nonsilent_array(data, sr, min_silence_len, silence_thresh, max_amplitude)
+    trimmed = gather_ranges(data, sr, ranges)
+    if return_ranges:
+        return trimmed, ranges
+    return trimmed
+
+
+def trim_silence(audio, min_silence_len=100, silence_thresh=-40):
+    """Trim an AudioSegment; same result as pydub's detect_nonsilent + concatenation."""
+    samples = np.array(audio.get_array_of_samples())
+    if audio.channels > 1:
+        samples = samples.reshape(-1, audio.channels)
+
+    trimmed = trim_silence_array(
+        samples, audio.frame_rate, min_silence_len, silence_thresh,
+        max_amplitude=audio.max_possible_amplitude
+    )
+    return audio._spawn(trimmed.tobytes())
@@ -1,8 +1,8 @@
 # vad.py
-import webrtcvad
+import io
 import wave
 import contextlib
-from pydub import AudioSegment
+import numpy as np
 
 def vad_trim(input_path, output_path, aggressiveness=2):
     """
@@ -13,15 +13,20 @@ def vad_trim(input_path, output_path, aggressiveness=2):
         output_path (str): Path to save VAD-trimmed audio
         aggressiveness (int): 0-3, higher = more aggressive trimming
     """
-    # Ensure input is WAV 16kHz mono
+    import webrtcvad
+    from pydub import AudioSegment
+
+    # Convert to WAV 16kHz mono in memory (the input file is left untouched)
     audio = AudioSegment.from_file(input_path)
     audio = audio.set_frame_rate(16000).set_channels(1).set_sample_width(2)
-    audio.export(input_path, format="wav")
+    wav_buffer = io.BytesIO()
+    audio.export(wav_buffer, format="wav")
+    wav_buffer.seek(0)
 
     vad = webrtcvad.Vad(aggressiveness)
 
     frames = []
-    with contextlib.closing(wave.open(input_path, 'rb')) as wf:
+    with contextlib.closing(wave.open(wav_buffer, 'rb')) as wf:
         sample_rate = wf.getframerate()
         n_channels = wf.getnchannels()
         sample_width = wf.getsampwidth()
@@ -47,3 +52,96 @@ def vad_trim(input_path, output_path, aggressiveness=2):
 
     print(f"VAD-trimmed audio saved to: {output_path}")
     return output_path
+
+
+# Per-aggressiveness (dB above the noise floor, min speech-band energy ratio).
+# Speech in a noisy room can sit only 5-7 dB above the floor, while frames of
+# stationary noise stay within about 3 dB of it.
+_VAD_THRESHOLDS = {0: (3.0, 0.35), 1: (4.0, 0.45), 2: (5.0, 0.5), 3: (6.0, 0.6)}
+
+
+def detect_speech_array(y, sr, aggressiveness=2, frame_ms=30, padding_ms=300, min_speech_ms=90):
+    """
+    Vectorized energy/spectral VAD over an in-memory signal.
+
+    All frames are scored at once: a frame is speech when its energy is
+    clearly above the recording's noise floor (10th percentile of frame
+    energies) and most of it sits in the 300-3400 Hz speech band. Speech runs
+    shorter than min_speech_ms are dropped, the rest are widened by
+    padding_ms on each side and merged.
+
+    Args:
+        y (np.ndarray): (samples,) or (samples, channels) float audio.
+        sr (int): Sample rate.
+        aggressiveness (int): 0-3, higher = more aggressive trimming (as webrtcvad).
+
+    Returns:
+        list: [[start_s, end_s], ...] speech segments in seconds.
+    """
+    frame_len = max(1, int(sr * frame_ms / 1000))
+    if len(y) == 0:
+        return []
+    energy_db, band_ratio = speech_frame_stats(y, sr, frame_len)
+    return speech_segments_from_stats(energy_db, band_ratio, frame_len, sr, len(y), aggressiveness=aggressiveness,
+                                      frame_ms=frame_ms, padding_ms=padding_ms, min_speech_ms=min_speech_ms)
+
+
+def speech_frame_stats(y, sr, frame_len):
+    """
+    Energy (dB) and 300-3400 Hz band ratio of consecutive frame_len frames;
+    the last frame is zero padded. Frames are independent, so a long signal
+    can be scored piece by piece on frame boundaries.
+    """
+    if y.ndim > 1:
+        y = y.mean(axis=1)
+    n_frames = int(np.ceil(len(y) / frame_len))
+    frames = np.zeros(n_frames * frame_len)
+    frames[:len(y)] = y
+    frames = frames.reshape(n_frames, frame_len)
+
+    power = np.abs(np.fft.rfft(frames * np.hanning(frame_len), axis=1)) ** 2
+    freqs = np.fft.rfftfreq(frame_len, 1.0 / sr)
+    total = power.sum(axis=1) + 1e-12
+    band_ratio = power[:, (freqs >= 300) & (freqs <= 3400)].sum(axis=1) / total
+
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-12)
+    return energy_db, band_ratio
+
+
+def speech_segments_from_stats(energy_db, band_ratio, frame_len, sr, length, aggressiveness=2, frame_ms=30,
+                               padding_ms=300, min_speech_ms=90):
+    """Speech segments in seconds from the frame statistics of a whole signal of `length` samples."""
+    n_frames = len(energy_db)
+    noise_floor = np.percentile(energy_db, 10)
+    margin, min_ratio = _VAD_THRESHOLDS[int(np.clip(aggressiveness, 0, 3))]
+    speech = (energy_db > noise_floor + margin) & (energy_db > -60.0) & (band_ratio >= min_ratio)
+
+    # Opening (erode + dilate) removes blips, then dilate once more for padding
+    min_frames = max(1, int(np.ceil(min_speech_ms / frame_ms)))
+    pad_frames = int(np.ceil(padding_ms / frame_ms))
+    kernel = np.ones(min_frames)
+    eroded = np.convolve(speech, kernel, mode='full')[min_frames - 1:] >= min_frames
+    opened = np.convolve(eroded, kernel, mode='full')[:n_frames] > 0
+    padded = np.convolve(opened, np.ones(2 * pad_frames + 1), mode='same') > 0
+
+    edges = np.diff(np.concatenate(([0], padded.astype(np.int8), [0])))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    duration = length / sr
+    return [[float(s * frame_len / sr), float(min(e * frame_len / sr, duration))] for s, e in zip(starts, ends)]
+
+
+def speech_sample_ranges(segments, sr, length):
+    """Convert [[start_s, end_s], ...] to clipped [(start, end), ...] sample ranges."""
+    ranges = []
+    for start_s, end_s in segments:
+        start, end = int(start_s * sr), min(int(round(end_s * sr)), length)
+        if end > start:
+            ranges.append((start, end))
+    return ranges
+
+
+def speech_fraction(segments, duration):
+    """Share of the signal covered by speech segments (0..1)."""
+    if duration <= 0:
+        return 0.0
+    return min(1.0, sum(e - s for s, e in segments) / duration)
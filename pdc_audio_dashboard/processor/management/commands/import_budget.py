@@ -0,0 +1,68 @@
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Imported by every worker before (and on) its first task; these count against the budget
+BUDGETED = ['processor.worker', 'processor.lib.audio_processor']
+
+# Reported for reference: what individual stages pull in when they first run
+REPORTED = ['processor.lib.pipeline', 'pydub', 'soundfile', 'scipy.signal', 'logmmse',
+            'noisereduce', 'librosa.core.audio', 'soxr']
+
+PROBE = """
+import sys, time, json
+t = time.perf_counter()
+__import__(sys.argv[1])
+print(json.dumps({"ms": (time.perf_counter() - t) * 1000, "modules": len(sys.modules)}))
+"""
+
+
+class Command(BaseCommand):
+    help = "Measure cold import times of the worker entry point and fail when they exceed the budget."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget-ms', type=float,
+                            default=getattr(settings, 'PROCESSOR_IMPORT_BUDGET_MS', 250),
+                            help='Maximum cold import time of each budgeted module')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Fresh interpreters per module; the median is reported')
+        parser.add_argument('--module', action='append', default=[],
+                            help='Extra module to report (repeatable)')
+
+    def _measure(self, module, repeat):
+        runs = []
+        for _ in range(repeat):
+            # A new interpreter per run, so nothing is already in sys.modules
+            proc = subprocess.run(
+                [sys.executable, '-c', PROBE, module],
+                cwd=str(settings.BASE_DIR), capture_output=True, text=True
+            )
+            if proc.returncode != 0:
+                raise CommandError(f"Importing {module} failed:\n{proc.stderr.strip()}")
+            runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        return statistics.median(r['ms'] for r in runs), runs[-1]['modules']
+
+    def handle(self, *args, **options):
+        budget = options['budget_ms']
+        over = []
+
+        self.stdout.write(f"{'module':40} {'cold ms':>9} {'modules':>8}")
+        for module in BUDGETED + REPORTED + options['module']:
+            ms, count = self._measure(module, options['repeat'])
+            budgeted = module in BUDGETED
+            flag = ''
+            if budgeted and ms > budget:
+                over.append(module)
+                flag = '  OVER BUDGET'
+            elif budgeted:
+                flag = '  ok'
+            self.stdout.write(f"{module:40} {ms:9.1f} {count:8d}{flag}")
+
+        if over:
+            raise CommandError(f"Cold import over the {budget:.0f} ms budget: {', '.join(over)}")
+        self.stdout.write(self.style.SUCCESS(f"Worker entry point imports within {budget:.0f} ms"))
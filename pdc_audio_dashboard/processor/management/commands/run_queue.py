@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from processor.jobs import Dispatcher, acquire_dispatcher_lock
+
+
+class Command(BaseCommand):
+    help = ("Run the experiment queue dispatcher in the foreground. Use it with "
+            "PROCESSOR_QUEUE_DISPATCHER = False so the web server only enqueues.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-seconds', type=float, default=None,
+                            help='Seconds between queue polls (default PROCESSOR_QUEUE_POLL_SECONDS)')
+
+    def handle(self, *args, **options):
+        if not acquire_dispatcher_lock():
+            raise CommandError("Another process is already running the dispatcher "
+                               "(see PROCESSOR_QUEUE_LOCK_FILE)")
+        dispatcher = Dispatcher(options['poll_seconds'])
+        self.stdout.write("Experiment queue dispatcher running, Ctrl+C to stop")
+        try:
+            dispatcher.run_forever()
+        except KeyboardInterrupt:
+            dispatcher.stop()
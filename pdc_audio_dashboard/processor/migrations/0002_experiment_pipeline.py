@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 12:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processor', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingexperiment',
+            name='pipeline',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
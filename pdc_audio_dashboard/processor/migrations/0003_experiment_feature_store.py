@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 12:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processor', '0002_experiment_pipeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingexperiment',
+            name='feature_store',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
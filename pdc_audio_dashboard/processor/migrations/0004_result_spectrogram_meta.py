@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 12:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processor', '0003_experiment_feature_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processedresult',
+            name='spectrogram_meta',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
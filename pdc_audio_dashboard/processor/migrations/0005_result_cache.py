@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processor', '0004_result_spectrogram_meta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processedresult',
+            name='cache_hit',
+            field=models.BooleanField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processingexperiment',
+            name='use_cache',
+            field=models.BooleanField(default=True),
+        ),
+    ]
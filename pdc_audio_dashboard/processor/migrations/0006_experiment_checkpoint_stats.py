@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 12:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processor', '0005_result_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingexperiment',
+            name='checkpoint_stats',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 12:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processor', '0006_experiment_checkpoint_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingexperiment',
+            name='warmup_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
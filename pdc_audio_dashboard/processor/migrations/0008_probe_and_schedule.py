@@ -0,0 +1,48 @@
+# Generated by Django 6.0 on 2026-10-18 12:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processor', '0007_experiment_warmup_seconds'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='audiofile',
+            name='channels',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='audiofile',
+            name='codec',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='audiofile',
+            name='duration_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='audiofile',
+            name='sample_rate',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processedresult',
+            name='predicted_time_ms',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processingexperiment',
+            name='cost_model',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processingexperiment',
+            name='expected_makespan_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
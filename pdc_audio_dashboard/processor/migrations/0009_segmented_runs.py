@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processor', '0008_probe_and_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processedresult',
+            name='segments',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processingexperiment',
+            name='segmented',
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 13:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processor', '0009_segmented_runs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingexperiment',
+            name='threads',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='processingexperiment',
+            name='mode',
+            field=models.CharField(choices=[('SERIAL', 'Serial'), ('PARALLEL', 'Parallel'), ('THREADED', 'Threaded'), ('HYBRID', 'Hybrid')], max_length=10),
+        ),
+    ]
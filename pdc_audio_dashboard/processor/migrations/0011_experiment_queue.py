@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-18 13:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processor', '0010_execution_modes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='processingexperiment',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('QUEUED', 'Queued'), ('PROCESSING', 'Processing'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed'), ('CANCELLED', 'Cancelled')], default='PENDING', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='ExperimentJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('QUEUED', 'Queued'), ('RUNNING', 'Running'), ('DONE', 'Done'), ('CANCELLED', 'Cancelled')], default='QUEUED', max_length=10)),
+                ('cores', models.IntegerField(default=1)),
+                ('queued_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('cancel_requested', models.BooleanField(default=False)),
+                ('experiment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='job', to='processor.processingexperiment')),
+            ],
+        ),
+    ]
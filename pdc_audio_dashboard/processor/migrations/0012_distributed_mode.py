@@ -0,0 +1,55 @@
+# Generated by Django 6.0 on 2026-10-18 13:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processor', '0011_experiment_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkerNode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('host', models.CharField(blank=True, default='', max_length=255)),
+                ('slots', models.IntegerField(default=1)),
+                ('registered_at', models.DateTimeField(auto_now_add=True)),
+                ('last_heartbeat', models.DateTimeField(blank=True, null=True)),
+                ('tasks_completed', models.IntegerField(default=0)),
+                ('tasks_failed', models.IntegerField(default=0)),
+                ('tasks_lost', models.IntegerField(default=0)),
+                ('busy_seconds', models.FloatField(default=0.0)),
+                ('audio_seconds', models.FloatField(default=0.0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='processingexperiment',
+            name='mode',
+            field=models.CharField(choices=[('SERIAL', 'Serial'), ('PARALLEL', 'Parallel'), ('THREADED', 'Threaded'), ('HYBRID', 'Hybrid'), ('DISTRIBUTED', 'Distributed')], max_length=12),
+        ),
+        migrations.CreateModel(
+            name='DistributedTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('priority', models.IntegerField(default=0)),
+                ('state', models.CharField(choices=[('PENDING', 'Pending'), ('ASSIGNED', 'Assigned'), ('DONE', 'Done'), ('FAILED', 'Failed'), ('CANCELLED', 'Cancelled')], default='PENDING', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('assigned_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('experiment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tasks', to='processor.processingexperiment')),
+                ('original_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='processor.audiofile')),
+                ('node', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tasks', to='processor.workernode')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='processedresult',
+            name='node',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='results', to='processor.workernode'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 13:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processor', '0012_distributed_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingexperiment',
+            name='rate_plan',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processingexperiment',
+            name='rate_planning',
+            field=models.BooleanField(default=True),
+        ),
+    ]
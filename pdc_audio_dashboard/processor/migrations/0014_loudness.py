@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 14:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('processor', '0013_rate_planning'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processedresult',
+            name='integrated_loudness',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='processedresult',
+            name='true_peak',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -16,6 +16,12 @@ class AudioFile(models.Model):
     original_name = models.CharField(max_length=255)
     file_size_bytes = models.IntegerField(default=0)
 
+    # Probed from the header at upload (see processor/lib/probe.py)
+    duration_seconds = models.FloatField(null=True, blank=True)
+    sample_rate = models.IntegerField(null=True, blank=True)
+    channels = models.IntegerField(null=True, blank=True)
+    codec = models.CharField(max_length=64, null=True, blank=True)
+
     def save(self, *args, **kwargs):
         if self.file:
             self.file_size_bytes = self.file.size
@@ -25,11 +31,15 @@ class AudioFile(models.Model):
 
 class ProcessingExperiment(models.Model):
     """Tracks a specific execution run (Serial vs Parallel)."""
-    MODE_CHOICES = [('SERIAL', 'Serial'), ('PARALLEL', 'Parallel')]
-    STATUS_CHOICES = [('PENDING', 'Pending'), ('PROCESSING', 'Processing'), ('COMPLETED', 'Completed'), ('FAILED', 'Failed')]
+    # THREADED: a thread pool in the Django process; HYBRID: threads inside each pool process;
+    # DISTRIBUTED: worker agents on other hosts (processor/distributed.py)
+    MODE_CHOICES = [('SERIAL', 'Serial'), ('PARALLEL', 'Parallel'), ('THREADED', 'Threaded'), ('HYBRID', 'Hybrid'),
+                    ('DISTRIBUTED', 'Distributed')]
+    STATUS_CHOICES = [('PENDING', 'Pending'), ('QUEUED', 'Queued'), ('PROCESSING', 'Processing'),
+                      ('COMPLETED', 'Completed'), ('FAILED', 'Failed'), ('CANCELLED', 'Cancelled')]
 
     batch = models.ForeignKey(AudioBatch, on_delete=models.CASCADE)
-    mode = models.CharField(max_length=10, choices=MODE_CHOICES)
+    mode = models.CharField(max_length=12, choices=MODE_CHOICES)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
     
     # Metrics
@@ -37,6 +47,32 @@ class ProcessingExperiment(models.Model):
     end_time = models.DateTimeField(null=True, blank=True)
     duration_seconds = models.FloatField(null=True, blank=True)
     cpu_cores_used = models.IntegerField(default=1)
+    # Threads per process of THREADED / HYBRID runs (null: settings default)
+    threads = models.IntegerField(null=True, blank=True)
+    # Pool start / DSP warm-up paid by this run, kept out of duration_seconds
+    warmup_seconds = models.FloatField(null=True, blank=True)
+    # Makespan the LPT schedule predicted (compare with duration_seconds)
+    expected_makespan_seconds = models.FloatField(null=True, blank=True)
+    # Cost model coefficients the schedule was built with
+    cost_model = models.JSONField(null=True, blank=True)
+
+    # Stage list the experiment ran (see processor/lib/pipeline.py)
+    pipeline = models.JSONField(null=True, blank=True)
+
+    # Reuse results of identical (audio, pipeline) runs, see processor/lib/result_cache.py
+    use_cache = models.BooleanField(default=True)
+    # Per-stage checkpoint hits/misses of the run, see processor/lib/checkpoints.py
+    checkpoint_stats = models.JSONField(null=True, blank=True)
+    # Split long files into segments across the pool in PARALLEL mode (processor/lib/segmented.py)
+    segmented = models.BooleanField(default=True)
+    # Downmix and resample ahead of noise reduction (processor/lib/pipeline.py plan_rates)
+    rate_planning = models.BooleanField(default=True)
+    # {'pipeline': stages actually run, 'moves': [...]} when plan_rates reordered the pipeline
+    rate_plan = models.JSONField(null=True, blank=True)
+
+    # Options and location of the experiment's feature container
+    # (see processor/lib/feature_store.py); null keeps per-file .npy files
+    feature_store = models.JSONField(null=True, blank=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -48,4 +84,65 @@ class ProcessedResult(models.Model):
     
     # Paths to generated features (stored as JSON or separate fields)
     spectrogram_path = models.CharField(max_length=500, null=True, blank=True)
-    processing_time_ms = models.FloatField(help_text="Time taken for this specific file")
\ No newline at end of file
+    # Size, frame rate and pyramid depth of the spectrogram (see lib/spectrogram_tiles.py)
+    spectrogram_meta = models.JSONField(null=True, blank=True)
+    processing_time_ms = models.FloatField(help_text="Time taken for this specific file")
+    predicted_time_ms = models.FloatField(null=True, blank=True)
+    # True if restored from the result cache, False if computed, null if the cache was off
+    cache_hit = models.BooleanField(null=True, blank=True)
+    # Number of segments the file was split into across the pool, null if processed whole
+    segments = models.IntegerField(null=True, blank=True)
+    # Worker agent that processed the file in a DISTRIBUTED run
+    node = models.ForeignKey('WorkerNode', related_name='results', null=True, blank=True, on_delete=models.SET_NULL)
+    # Integrated loudness (LUFS) and true peak (dBTP) of the output, set by the normalize_lufs stage
+    integrated_loudness = models.FloatField(null=True, blank=True)
+    true_peak = models.FloatField(null=True, blank=True)
+
+class ExperimentJob(models.Model):
+    """Queue entry of an experiment (see processor/jobs.py)."""
+    STATE_CHOICES = [('QUEUED', 'Queued'), ('RUNNING', 'Running'), ('DONE', 'Done'), ('CANCELLED', 'Cancelled')]
+
+    experiment = models.OneToOneField(ProcessingExperiment, related_name='job', on_delete=models.CASCADE)
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default='QUEUED')
+    # Cores reserved from the global budget (PROCESSOR_CORE_BUDGET) while running
+    cores = models.IntegerField(default=1)
+    queued_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Refreshed by the dispatcher running the job; a stale one means it died mid-run
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    cancel_requested = models.BooleanField(default=False)
+
+class WorkerNode(models.Model):
+    """A worker agent registered for DISTRIBUTED runs, with its throughput counters."""
+    name = models.CharField(max_length=255, unique=True)
+    host = models.CharField(max_length=255, blank=True, default='')
+    # Files the agent processes at once
+    slots = models.IntegerField(default=1)
+    registered_at = models.DateTimeField(auto_now_add=True)
+    last_heartbeat = models.DateTimeField(null=True, blank=True)
+    tasks_completed = models.IntegerField(default=0)
+    tasks_failed = models.IntegerField(default=0)
+    # Tasks taken back from the node after it stopped heartbeating
+    tasks_lost = models.IntegerField(default=0)
+    # Sum of processing time and of input audio length over completed tasks
+    busy_seconds = models.FloatField(default=0.0)
+    audio_seconds = models.FloatField(default=0.0)
+
+class DistributedTask(models.Model):
+    """One file of a DISTRIBUTED experiment, pulled by a worker agent."""
+    STATE_CHOICES = [('PENDING', 'Pending'), ('ASSIGNED', 'Assigned'), ('DONE', 'Done'),
+                     ('FAILED', 'Failed'), ('CANCELLED', 'Cancelled')]
+
+    experiment = models.ForeignKey(ProcessingExperiment, related_name='tasks', on_delete=models.CASCADE)
+    original_file = models.ForeignKey(AudioFile, on_delete=models.CASCADE)
+    # Position in the experiment's longest-first order; lower is handed out first
+    priority = models.IntegerField(default=0)
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default='PENDING')
+    node = models.ForeignKey(WorkerNode, related_name='tasks', null=True, blank=True, on_delete=models.SET_NULL)
+    attempts = models.IntegerField(default=0)
+    assigned_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # process_file_task's result dict as posted by the agent
+    result = models.JSONField(null=True, blank=True)
@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import atexit
+import threading
+import concurrent.futures
+
+from django.conf import settings
+
+from .worker import init_pool_worker, warm_up, worker_info
+
+
+class WorkerPool:
+    """
+    Long-lived, pre-warmed process pool shared by every PARALLEL experiment.
+
+    Each worker imports the DSP stack and runs a short warm-up clip in its
+    initializer (see worker.warm_up), so experiments no longer pay process
+    spawn, imports and numba JIT inside their measured duration.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.executor = None
+        self.warmup_seconds = None
+        self.worker_warmup = {}
+        self._lock = threading.Lock()
+
+    def _start(self):
+        start = time.perf_counter()
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_workers, initializer=init_pool_worker
+        )
+        # Workers spawn on demand, so one probe per slot brings them all up
+        probes = [self.executor.submit(worker_info) for _ in range(self.max_workers)]
+        self.worker_warmup = dict(f.result() for f in probes)
+        self.warmup_seconds = time.perf_counter() - start
+        print(f"Worker pool ready: {len(self.worker_warmup)} processes warmed in {self.warmup_seconds:.2f}s")
+
+    def acquire(self):
+        """
+        Return the executor, starting it on first use and restarting it if
+        a worker died. Blocks while another thread is warming the pool.
+        """
+        with self._lock:
+            if self.executor is not None and not getattr(self.executor, '_broken', False):
+                return self.executor
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+            self._start()
+            return self.executor
+
+    def shutdown(self):
+        with self._lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True, cancel_futures=True)
+                self.executor = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_local_warmup = None
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = getattr(settings, 'PROCESSOR_POOL_WORKERS', None) or os.cpu_count() or 4
+            _pool = WorkerPool(workers)
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def warm_local():
+    """Warm the Django process itself (used by SERIAL runs); seconds spent, 0 after the first call."""
+    global _local_warmup
+    with _pool_lock:
+        if _local_warmup is not None:
+            return 0.0
+        _local_warmup = warm_up()
+        return _local_warmup
+
+
+# Executables of the WSGI / ASGI servers that may host the app
+SERVER_COMMANDS = {'gunicorn', 'uvicorn', 'daphne', 'hypercorn', 'waitress-serve', 'uwsgi'}
+
+
+def _is_serving():
+    # manage.py commands other than runserver (migrate, shell, ...) and scripts calling
+    # django.setup() never need the pool; with the autoreloader only the child
+    # process (RUN_MAIN) serves requests
+    if os.path.basename(sys.argv[0]) == 'manage.py':
+        return (len(sys.argv) > 1 and sys.argv[1] == 'runserver'
+                and (os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv))
+    return os.path.basename(sys.argv[0]) in SERVER_COMMANDS or 'uwsgi' in sys.modules
+
+
+def prewarm_in_background():
+    """Start and warm the shared pool without blocking Django startup."""
+    if not getattr(settings, 'PROCESSOR_POOL_PREWARM', False) or not _is_serving():
+        return
+    threading.Thread(target=lambda: get_pool().acquire(), daemon=True).start()
+
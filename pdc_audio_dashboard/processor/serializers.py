@@ -1,10 +1,11 @@
 from rest_framework import serializers
-from .models import AudioBatch, AudioFile, ProcessingExperiment, ProcessedResult
+from .models import AudioBatch, AudioFile, ExperimentJob, ProcessingExperiment, ProcessedResult, WorkerNode
 
 class AudioFileSerializer(serializers.ModelSerializer):
     class Meta:
         model = AudioFile
-        fields = ['id', 'file', 'original_name', 'file_size_bytes']
+        fields = ['id', 'file', 'original_name', 'file_size_bytes',
+                  'duration_seconds', 'sample_rate', 'channels', 'codec']
 
 class AudioBatchSerializer(serializers.ModelSerializer):
     files = AudioFileSerializer(many=True, read_only=True)
@@ -18,10 +19,49 @@ class ProcessedResultSerializer(serializers.ModelSerializer):
     original_file_url = serializers.FileField(source='original_file.file', use_url=True, read_only=True) 
     class Meta:
         model = ProcessedResult
-        fields = ['id', 'processed_file', 'original_file_url', 'spectrogram_path', 'processing_time_ms']
+        fields = ['id', 'processed_file', 'original_file_url', 'spectrogram_path', 'spectrogram_meta', 'processing_time_ms', 'predicted_time_ms', 'cache_hit', 'segments', 'node', 'integrated_loudness', 'true_peak']
 
 class ExperimentSerializer(serializers.ModelSerializer):
     results = ProcessedResultSerializer(many=True, read_only=True)
+    makespan = serializers.SerializerMethodField()
+    queue = serializers.SerializerMethodField()
+    nodes = serializers.SerializerMethodField()
+
+    def get_nodes(self, obj):
+        """Files, processing time and audio length per worker node of a DISTRIBUTED run."""
+        if obj.mode != 'DISTRIBUTED':
+            return None
+        from .distributed import experiment_nodes
+        return experiment_nodes(obj)
+
+    def get_queue(self, obj):
+        """Queue state, cores, attempts, wait time and (while queued) position / depth."""
+        from .jobs import job_info
+        try:
+            return job_info(obj.job)
+        except ExperimentJob.DoesNotExist:
+            return None
+
+    def get_makespan(self, obj):
+        """Expected (LPT schedule) vs. actual wall time of the run."""
+        if obj.expected_makespan_seconds is None or obj.duration_seconds is None:
+            return None
+        return {
+            'expected_seconds': obj.expected_makespan_seconds,
+            'actual_seconds': obj.duration_seconds,
+            'ratio': obj.duration_seconds / obj.expected_makespan_seconds if obj.expected_makespan_seconds else None,
+        }
     class Meta:
         model = ProcessingExperiment
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+class WorkerNodeSerializer(serializers.ModelSerializer):
+    stats = serializers.SerializerMethodField()
+
+    def get_stats(self, obj):
+        """Liveness, assigned tasks, realtime factor and seconds per file."""
+        from .distributed import node_stats
+        return node_stats(obj)
+    class Meta:
+        model = WorkerNode
+        fields = '__all__'
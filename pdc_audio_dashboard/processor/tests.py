@@ -1,3 +1,888 @@
-from django.test import TestCase
+import os
+import tempfile
 
-# Create your tests here.
+import numpy as np
+import soundfile as sf
+from django.test import SimpleTestCase, TestCase
+
+LIB_DIR = os.path.join(os.path.dirname(__file__), 'lib')
+SPEECH_CLIP = os.path.join(LIB_DIR, 'audiopath.wav')
+
+
+def _noise(seconds, sr, channels=1, level=0.1, seed=0):
+    rng = np.random.default_rng(seed)
+    return level * rng.standard_normal((int(seconds * sr), channels))
+
+
+class StreamingParityTests(SimpleTestCase):
+    """The block-wise runner (lib/streaming.py) against run_pipeline."""
+
+    def test_default_pipeline_matches_in_memory(self):
+        from .lib.decode import decode
+        from .lib.pipeline import DEFAULT_PIPELINE, run_pipeline
+        from .lib.streaming import run_pipeline_streaming
+
+        # Broadband noise with silent gaps: trim_silence has work to do and vad
+        # finds no speech. Longer than one 60 s logMMSE chunk and ending on a
+        # partial millisecond.
+        sr = 22050
+        gap = np.zeros((sr, 2))
+        y = np.concatenate([gap, _noise(30, sr, 2), gap, _noise(31, sr, 2, seed=1)[:-7]])
+        definition = [step for step in DEFAULT_PIPELINE if step['stage'] != 'features']
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'in.wav')
+            sf.write(path, y, sr, subtype='PCM_16')
+            samples, sr = decode(path)
+            expected, out_sr, artifacts = run_pipeline(samples, sr, definition, tmp, 'memory')
+            self.assertEqual(artifacts['speech_fraction'], 0.0)
+
+            streamed_path = os.path.join(tmp, 'streamed.wav')
+            for block_size in (65536, 10000):
+                streamed_sr, _ = run_pipeline_streaming(path, definition, streamed_path, tmp, 'stream',
+                                                        block_size=block_size)
+                streamed, _ = sf.read(streamed_path)
+                self.assertEqual(streamed_sr, out_sr)
+                self.assertEqual(len(streamed), len(expected))
+                # The streamed output is written as 16-bit PCM
+                np.testing.assert_allclose(streamed, expected, atol=2 / 32768)
+
+    def test_speech_under_default_pipeline_matches_in_memory(self):
+        from .lib.decode import decode
+        from .lib.pipeline import DEFAULT_PIPELINE, run_pipeline
+        from .lib.streaming import run_pipeline_streaming
+
+        # The speech clip three times with quiet room noise between, so vad finds
+        # several regions and mutes the rest
+        speech, sr = sf.read(SPEECH_CLIP)
+        gaps = [0.01 * _noise(seconds, sr, 2, level=1, seed=seconds) for seconds in (1, 2, 1)]
+        y = np.concatenate([speech, gaps[0], speech, gaps[1], speech, gaps[2]])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'in.wav')
+            sf.write(path, y, sr, subtype='PCM_16')
+            samples, sr = decode(path)
+            expected, out_sr, artifacts = run_pipeline(samples, sr, DEFAULT_PIPELINE, tmp, 'memory')
+            self.assertGreater(artifacts['speech_fraction'], 0.5)
+            self.assertLess(artifacts['speech_fraction'], 0.9)
+            expected_features = {name: np.load(artifacts[name]) for name in ('mel_spectrogram', 'mfcc')}
+
+            streamed_path = os.path.join(tmp, 'streamed.wav')
+            for block_size in (65536, 10000):
+                streamed_sr, streamed_artifacts = run_pipeline_streaming(path, DEFAULT_PIPELINE, streamed_path, tmp,
+                                                                         'stream', block_size=block_size)
+                streamed, _ = sf.read(streamed_path)
+                self.assertEqual(streamed_sr, out_sr)
+                self.assertEqual(streamed_artifacts['speech_fraction'], artifacts['speech_fraction'])
+                self.assertEqual(len(streamed), len(expected))
+                # Muted outside speech, like the in-memory run
+                self.assertGreater(np.mean(streamed == 0), 0.1)
+                np.testing.assert_allclose(streamed, expected, atol=2 / 32768)
+                for name, value in expected_features.items():
+                    np.testing.assert_allclose(np.load(streamed_artifacts[name]), value, atol=1e-2, err_msg=name)
+
+
+class TrimSilenceTests(SimpleTestCase):
+
+    def _ramp(self, sr, seed):
+        # Noise whose window RMS crosses -40 dBFS (327.68 in 16-bit units) slowly
+        rng = np.random.default_rng(seed)
+        env = np.concatenate([np.linspace(300, 360, 2 * sr), np.full(sr // 2, 2000), np.linspace(360, 300, 2 * sr)])
+        return np.clip(np.round(env * rng.standard_normal(len(env))), -32768, 32767).astype(np.int16)
+
+    def test_matches_pydub_detect_nonsilent(self):
+        from pydub import AudioSegment
+        from pydub.silence import detect_nonsilent
+        from .lib.trim_silence import detect_nonsilent_array, detect_nonsilent_energy, ms_energy
+
+        sr = 16000
+        for seed in range(4):
+            pcm = self._ramp(sr, seed)
+            audio = AudioSegment(pcm.tobytes(), frame_rate=sr, sample_width=2, channels=1)
+            expected = [list(r) for r in detect_nonsilent(audio, 100, -40)]
+            floats = pcm.astype(np.float32) / 32768
+
+            self.assertEqual(detect_nonsilent_array(pcm, sr, 100, -40, audio.max_possible_amplitude), expected)
+            self.assertEqual(detect_nonsilent_array(floats, sr, 100, -40), expected)
+            n_ms = round(1000 * len(pcm) / sr)
+            energy = ms_energy(floats, sr, 0, n_ms)
+            self.assertEqual(detect_nonsilent_energy(energy, sr, len(pcm), 1, 100, -40), expected)
+
+
+class VadTests(SimpleTestCase):
+
+    def test_detects_speech_in_a_noisy_recording(self):
+        from .lib.decode import decode
+        from .lib.vad import detect_speech_array, speech_fraction
+
+        # Speech from about 0.8 s to 2.7 s, 5-7 dB above a loud room noise
+        y, sr = decode(SPEECH_CLIP)
+        segments = detect_speech_array(y, sr)
+        self.assertTrue(any(start <= 1.0 and end >= 2.5 for start, end in segments), segments)
+        self.assertGreater(speech_fraction(segments, len(y) / sr), 0.5)
+
+    def test_finds_no_speech_in_noise(self):
+        from .lib.vad import detect_speech_array
+        self.assertEqual(detect_speech_array(_noise(5, 16000)[:, 0], 16000), [])
+
+
+class FilterTests(SimpleTestCase):
+    GROUP = [('bandpass', {'low_cut': 80, 'high_cut': 3500}),
+             ('hum_removal', {'hum_freq': 50.0, 'Q': 30.0, 'harmonics': 3})]
+
+    def test_fused_hum_removal_matches_unfused_filtfilt(self):
+        from scipy.signal import filtfilt, iirnotch, sosfilt
+        from .lib.filter_bank import design_sos
+        from .lib.pipeline import _run_linear_group
+
+        sr = 16000
+        t = np.arange(4 * sr) / sr
+        y = _noise(4, sr)[:, 0] + 0.1 * np.sin(2 * np.pi * 50 * t)
+        fused, _ = _run_linear_group(y, sr, self.GROUP)
+        # The unfused chain: causal bandpass, then remove_hum's filtfilt per notch
+        expected = sosfilt(design_sos('band', (80, 3500), 5, sr), y)
+        for k in (1, 2, 3):
+            expected = filtfilt(*iirnotch(50.0 * k / (sr / 2), 30.0), expected)
+        # Only sosfiltfilt's edge padding differs from per-notch filtfilt
+        inner = slice(sr // 2, -sr // 2)
+        np.testing.assert_allclose(fused[inner], expected[inner], atol=1e-3 * np.abs(expected).max())
+
+    def test_blocks_match_whole_signal(self):
+        from .lib.pipeline import _build_filter_bank
+
+        sr = 16000
+        y = _noise(20, sr, channels=2)
+        expected = _build_filter_bank(sr, self.GROUP).apply(y)
+        for block_size in (777, 65536):
+            bank = _build_filter_bank(sr, self.GROUP)
+            blocks = [bank.process_block(y[i:i + block_size]) for i in range(0, len(y), block_size)]
+            streamed = np.concatenate(blocks + [bank.flush()])
+            np.testing.assert_allclose(streamed, expected, atol=1e-10)
+
+
+class ResampleTests(SimpleTestCase):
+
+    def test_matches_librosa_bit_for_bit(self):
+        import librosa
+        from .lib.resample import resample_array
+
+        # Lengths whose ratio rounds down, up and exactly
+        for n in (1000, 1001, 44100):
+            y = _noise(n / 44100, 44100, 2, seed=n).astype(np.float32)
+            expected = librosa.resample(y.T, orig_sr=44100, target_sr=16000).T
+            np.testing.assert_array_equal(resample_array(y, 44100, 16000), expected)
+            np.testing.assert_array_equal(resample_array(y[:, 0], 44100, 16000), expected[:, 0])
+
+
+class FeatureTests(SimpleTestCase):
+
+    def test_matches_librosa(self):
+        import librosa
+        from .lib.features import AVAILABLE_FEATURES, FeatureEngine
+
+        sr = 16000
+        y = _noise(3, sr)[:, 0].astype(np.float32)
+        out = FeatureEngine(sr, n_fft=2048, hop_length=512, n_mels=128, n_mfcc=13,
+                            features=AVAILABLE_FEATURES).compute(y)
+        mel = librosa.feature.melspectrogram(y=y, sr=sr, n_fft=2048, hop_length=512, n_mels=128)
+        magnitude = np.abs(librosa.stft(y, n_fft=2048, hop_length=512))
+        expected = {
+            'mel_spectrogram': librosa.power_to_db(mel, ref=np.max),
+            'log_mel': librosa.power_to_db(mel),
+            'mfcc': librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13, n_fft=2048, hop_length=512, n_mels=128),
+            'spectral_centroid': librosa.feature.spectral_centroid(S=magnitude, sr=sr),
+            'spectral_rolloff': librosa.feature.spectral_rolloff(S=magnitude, sr=sr),
+            'spectral_flatness': librosa.feature.spectral_flatness(S=magnitude),
+            'rms': librosa.feature.rms(S=magnitude, frame_length=2048),
+        }
+        for name, value in expected.items():
+            self.assertEqual(out[name].shape, value.shape, name)
+            np.testing.assert_allclose(out[name], value, rtol=1e-4, atol=1e-4, err_msg=name)
+
+
+class EnhancementTests(SimpleTestCase):
+
+    def test_matches_logmmse_and_noisereduce(self):
+        import logmmse
+        from .lib.audio_processor import reduce_voice_noise
+        from .lib.decode import decode
+        from .lib.enhancement import enhance
+        from .lib.resample import resample_array
+
+        y, sr = decode(SPEECH_CLIP)
+        sr, y = 16000, resample_array(y.mean(axis=1), sr, 16000).astype(np.float32)
+        with np.errstate(all='ignore'):
+            expected = logmmse.logmmse(y, sr)
+            out = enhance(y, sr, gate=False)
+        self.assertEqual(out.shape, expected.shape)
+        np.testing.assert_allclose(out, expected, atol=1e-6)
+
+        expected = reduce_voice_noise(y, sr, y[:sr // 2])
+        out = enhance(y, sr, logmmse=False, framing='gate', noise='smoothed')
+        self.assertEqual(out.shape, expected.shape)
+        np.testing.assert_allclose(out, expected, atol=1e-6)
+
+
+class DynamicsTests(SimpleTestCase):
+
+    def test_compressor_does_not_depend_on_the_block_size(self):
+        from unittest import mock
+        from .lib import dynamics
+
+        sr = 16000
+        y = np.clip(_noise(10, sr, 2, level=0.3) * np.linspace(0.1, 2, 10 * sr)[:, np.newaxis], -1, 1)
+        params = {'threshold': -20.0, 'ratio': 4.0, 'attack': 5.0, 'release': 50.0, 'gain_db': 3.0,
+                  'ceiling_dBFS': -1.0}
+        expected = dynamics.compress(y, sr, **params)
+        self.assertLessEqual(np.max(np.abs(expected)), 10 ** (-1 / 20) + 1e-6)
+
+        with mock.patch.object(dynamics, 'BLOCK', 1000):
+            np.testing.assert_allclose(dynamics.compress(y, sr, **params), expected, atol=1e-6)
+
+        compressor = dynamics.Compressor(sr, **params)
+        edges = [0, 1, 80, 4097, 50000, 50001, len(y)]
+        streamed = np.concatenate([compressor.process(y[a:b]) for a, b in zip(edges, edges[1:])])
+        np.testing.assert_allclose(streamed, expected, atol=1e-6)
+
+
+class ClippingTests(SimpleTestCase):
+
+    def test_streamed_declip_matches_whole_file(self):
+        from .lib.clipping import declip
+        from .lib.streaming import _RepairClipping
+
+        sr = 16000
+        y = np.clip(4 * _noise(5, sr, 2, level=0.3), -1, 1)
+        expected, expected_stats = declip(y, 0.99)
+        self.assertGreater(expected_stats['clipped_runs'], 0)
+
+        for block_size in (1, 7, 1000, 65536):
+            artifacts = {}
+            stage = _RepairClipping(sr, 2, artifacts, 0.99)
+            pieces = [stage.process(y[i:i + block_size]) for i in range(0, len(y), block_size)]
+            streamed = np.concatenate(pieces + [stage.flush()])
+            np.testing.assert_array_equal(streamed, expected, err_msg=f"block size {block_size}")
+            self.assertEqual(artifacts['clipping'], expected_stats)
+
+
+class LoudnessTests(SimpleTestCase):
+
+    def test_matches_pyloudnorm(self):
+        import pyloudnorm
+        from .lib.decode import decode
+        from .lib.loudness import LoudnessMeter
+
+        y, sr = decode(SPEECH_CLIP)
+        y = y.astype(np.float64)
+        expected = pyloudnorm.Meter(sr).integrated_loudness(y)
+
+        whole = LoudnessMeter(sr, y.shape[1])
+        whole.add(y)
+        self.assertAlmostEqual(whole.integrated_loudness(), expected, places=6)
+        for block_size in (1000, 4410, 65536):
+            meter = LoudnessMeter(sr, y.shape[1])
+            for i in range(0, len(y), block_size):
+                meter.add(y[i:i + block_size])
+            self.assertAlmostEqual(meter.integrated_loudness(), expected, places=6)
+            self.assertAlmostEqual(meter.true_peak(), whole.true_peak(), places=9)
+
+
+class SegmentedTests(SimpleTestCase):
+
+    def test_clipping_artifact_matches_run_pipeline(self):
+        from .lib.decode import decode
+        from .lib.pipeline import run_pipeline
+        from .lib.segmented import run_pipeline_segmented
+
+        sr = 16000
+        y = np.clip(4 * _noise(20, sr, 2, level=0.3), -1, 1)
+        definition = [{'stage': 'repair_clipping', 'params': {'threshold': 0.99}}]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'in.wav')
+            sf.write(path, y, sr, subtype='PCM_16')
+            samples, sr = decode(path)
+            _, _, expected = run_pipeline(samples, sr, definition, tmp, 'memory')
+            _, artifacts = run_pipeline_segmented(path, definition, os.path.join(tmp, 'out.wav'), tmp, 'segments',
+                                                  segment_seconds=5)
+        self.assertGreater(artifacts['segments'], 1)
+        self.assertGreater(expected['clipping']['clipped_runs'], 0)
+        self.assertEqual(artifacts['clipping'], expected['clipping'])
+
+
+class StartExperimentTests(TestCase):
+
+    def test_boolean_options_parse_form_and_json_values(self):
+        from .models import AudioBatch, ProcessingExperiment
+        batch = AudioBatch.objects.create()
+
+        response = self.client.post('/api/experiments/start/',
+                                    {'batch_id': batch.id, 'use_cache': 'false', 'segmented': '0'})
+        self.assertEqual(response.status_code, 200)
+        experiment = ProcessingExperiment.objects.get(pk=response.json()['id'])
+        self.assertEqual((experiment.use_cache, experiment.segmented, experiment.rate_planning), (False, False, True))
+
+        response = self.client.post('/api/experiments/start/', {'batch_id': batch.id, 'rate_planning': False},
+                                    content_type='application/json')
+        experiment = ProcessingExperiment.objects.get(pk=response.json()['id'])
+        self.assertEqual((experiment.use_cache, experiment.rate_planning), (True, False))
+
+        response = self.client.post('/api/experiments/start/', {'batch_id': batch.id, 'use_cache': 'maybe'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_threads_only_apply_to_threaded_and_hybrid_runs(self):
+        from .models import AudioBatch
+        batch = AudioBatch.objects.create()
+        for mode in ('SERIAL', 'PARALLEL', 'DISTRIBUTED'):
+            response = self.client.post('/api/experiments/start/', {'batch_id': batch.id, 'mode': mode, 'threads': 2},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 400, mode)
+        for mode in ('THREADED', 'HYBRID'):
+            response = self.client.post('/api/experiments/start/', {'batch_id': batch.id, 'mode': mode, 'threads': 2},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 200, mode)
+            self.assertEqual(response.json()['threads'], 2)
+
+
+class ThreadedRunTests(TestCase):
+
+    def test_threaded_and_hybrid_runs_process_every_file(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import override_settings
+        from .models import AudioBatch, ProcessingExperiment
+        from .utils import ExperimentRunner
+
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            with open(SPEECH_CLIP, 'rb') as f:
+                audio = f.read()
+            response = self.client.post('/api/batches/upload/', {
+                'files': [SimpleUploadedFile(f'{i}.wav', audio, 'audio/wav') for i in range(3)]})
+            batch = AudioBatch.objects.get(pk=response.json()['id'])
+            pipeline = [{'stage': 'resample', 'params': {'target_sr': 16000}}, {'stage': 'features', 'params': {}}]
+
+            for mode in ('THREADED', 'HYBRID'):
+                experiment = ProcessingExperiment.objects.create(batch=batch, mode=mode, threads=2, pipeline=pipeline,
+                                                                 use_cache=False)
+                ExperimentRunner(experiment).run()
+                experiment.refresh_from_db()
+                self.assertEqual(experiment.status, 'COMPLETED', mode)
+                self.assertEqual(experiment.threads, 2)
+                self.assertEqual(experiment.results.count(), 3, mode)
+                for result in experiment.results.all():
+                    y, sr = sf.read(result.processed_file.path)
+                    self.assertEqual(sr, 16000)
+                    self.assertTrue(result.spectrogram_path)
+
+
+class DistributedTests(TestCase):
+    """Two agents on the agent protocol (processor/distributed.py) through the API."""
+
+    def setUp(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import override_settings
+        from .models import AudioBatch, AudioFile, DistributedTask, ProcessingExperiment
+
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name, PROCESSOR_AGENT_TOKEN='s3cret')
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        batch = AudioBatch.objects.create()
+        experiment = ProcessingExperiment.objects.create(batch=batch, mode='DISTRIBUTED', feature_store=False)
+        self.tasks = [
+            DistributedTask.objects.create(experiment=experiment, priority=i, original_file=AudioFile.objects.create(
+                batch=batch, file=SimpleUploadedFile(f'{i}.wav', b'RIFF'), original_name=f'{i}.wav'))
+            for i in range(2)
+        ]
+
+    def _call(self, method, path, data=None, token='s3cret', content_type='application/json'):
+        headers = {'HTTP_X_AGENT_TOKEN': token} if token is not None else {}
+        return getattr(self.client, method)(f'/api/agents/{path}', data, content_type=content_type, **headers)
+
+    def _upload(self, node, task, path):
+        return self._call('put', f"{node}/tasks/{task['id']}/files/?path={path}", b'wav',
+                          content_type='application/octet-stream')
+
+    def _register(self, name):
+        response = self._call('post', 'register/', {'name': name, 'slots': 1})
+        self.assertEqual(response.status_code, 201)
+        return response.json()['id']
+
+    def _finish(self, node, task):
+        # Upload the output under the task's directory, then post the result
+        relative_dir = f"{task['output_dir']}/{task['file_id']}"
+        processed = f'{relative_dir}/out.wav'
+        self.assertEqual(self._upload(node, task, processed).status_code, 200)
+        return self._call('post', f"{node}/tasks/{task['id']}/result/",
+                          {'success': True, 'processed_path': processed, 'relative_dir': relative_dir,
+                           'arrays': {}, 'duration': 1.5})
+
+    def test_agents_claim_complete_and_take_over_lost_tasks(self):
+        from django.utils import timezone
+        from .distributed import reclaim_lost
+        from .models import DistributedTask, WorkerNode
+
+        a, b = self._register('host-a'), self._register('host-b')
+        task_a = self._call('post', f'{a}/claim/', {'count': 1}).json()['tasks'][0]
+        task_b = self._call('post', f'{b}/claim/', {'count': 1}).json()['tasks'][0]
+        self.assertEqual([task_a['id'], task_b['id']], [t.pk for t in self.tasks])
+        self.assertEqual(self._call('post', f'{a}/heartbeat/').status_code, 200)
+
+        self.assertEqual(self._finish(a, task_a).status_code, 200)
+        self.assertEqual(DistributedTask.objects.get(pk=task_a['id']).state, 'DONE')
+        self.assertEqual(WorkerNode.objects.get(pk=a).tasks_completed, 1)
+
+        # b misses its heartbeats: its task goes back to the queue and a picks it up
+        WorkerNode.objects.filter(pk=b).update(last_heartbeat=timezone.now() - timezone.timedelta(hours=1))
+        self.assertEqual(reclaim_lost(), 1)
+        self.assertEqual(WorkerNode.objects.get(pk=b).tasks_lost, 1)
+        retry = self._call('post', f'{a}/claim/', {'count': 2}).json()['tasks']
+        self.assertEqual([t['id'] for t in retry], [task_b['id']])
+        self.assertNotEqual(retry[0]['output_dir'], task_b['output_dir'])
+
+        # The old attempt can no longer upload or report
+        self.assertEqual(self._upload(b, task_b, f"{task_b['output_dir']}/x.wav").status_code, 409)
+        self.assertEqual(self._call('post', f"{b}/tasks/{task_b['id']}/result/", {'success': False}).status_code, 409)
+        self.assertEqual(self._finish(a, retry[0]).status_code, 200)
+        self.assertEqual(DistributedTask.objects.get(pk=task_b['id']).node_id, a)
+
+    def test_rejects_bad_tokens_and_paths_outside_the_task_directory(self):
+        from django.test import override_settings
+
+        self.assertEqual(self._call('post', 'register/', {'name': 'x'}, token=None).status_code, 403)
+        self.assertEqual(self._call('post', 'register/', {'name': 'x'}, token='guess').status_code, 403)
+        with override_settings(PROCESSOR_AGENT_TOKEN=None):
+            self.assertEqual(self._call('post', 'register/', {'name': 'x'}).status_code, 403)
+        self.assertEqual(self._call('get', '', token=None).status_code, 200)
+
+        node = self._register('host-a')
+        task = self._call('post', f'{node}/claim/', {'count': 1}).json()['tasks'][0]
+        other = f"processed/task_{self.tasks[1].pk}_0/x.wav"
+        for path in ('../escape.wav', f"{task['output_dir']}/../../escape.wav", other, '/etc/x.wav',
+                     f"{task['output_dir']}"):
+            self.assertEqual(self._upload(node, task, path).status_code, 400, path)
+        response = self._call('post', f"{node}/tasks/{task['id']}/result/",
+                              {'success': True, 'processed_path': other, 'relative_dir': 'processed', 'arrays': {}})
+        self.assertEqual(response.status_code, 400)
+
+
+class QueueTests(TestCase):
+    """Admission, fairness, cancellation and recovery of the experiment queue (processor/jobs.py)."""
+
+    def setUp(self):
+        from django.test import override_settings
+        from .models import AudioBatch
+
+        settings = override_settings(PROCESSOR_CORE_BUDGET=4, PROCESSOR_QUEUE_STALE_SECONDS=60,
+                                     PROCESSOR_QUEUE_MAX_ATTEMPTS=2)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.batches = [AudioBatch.objects.create() for _ in range(2)]
+
+    def _job(self, batch, cores=1, **fields):
+        from .models import ExperimentJob, ProcessingExperiment
+        experiment = ProcessingExperiment.objects.create(batch=batch, mode='PARALLEL', status='QUEUED')
+        return ExperimentJob.objects.create(experiment=experiment, cores=cores, **fields)
+
+    def _admit_all(self):
+        from .jobs import claim_next
+        admitted = []
+        while (job := claim_next()) is not None:
+            admitted.append(job)
+        return admitted
+
+    def test_admission_never_exceeds_the_core_budget(self):
+        from unittest import mock
+        from collections import Counter
+        from . import jobs
+        from .models import ExperimentJob
+
+        for cores in (3, 2, 1, 4):
+            self._job(self.batches[0], cores)
+        # The 2-core job does not fit next to the 3-core one and holds back the jobs behind it
+        self.assertEqual([job.cores for job in self._admit_all()], [3])
+        ExperimentJob.objects.filter(state='RUNNING').update(state='DONE')
+        self.assertEqual([job.cores for job in self._admit_all()], [2, 1])
+
+        # Another dispatcher admits a job between this one's choice and its UPDATE
+        ExperimentJob.objects.filter(state='RUNNING').update(state='DONE')
+        def racing_claim():
+            self._job(self.batches[1], 2, state='RUNNING')
+            return Counter()
+        with mock.patch.object(jobs, '_running_per_batch', side_effect=racing_claim):
+            self.assertIsNone(jobs.claim_next())
+        used = sum(ExperimentJob.objects.filter(state='RUNNING').values_list('cores', flat=True))
+        self.assertLessEqual(used, jobs.core_budget())
+
+    def test_interleaves_batches(self):
+        from .jobs import admission_order, job_info
+
+        first, second = self.batches
+        jobs = [self._job(first) for _ in range(3)] + [self._job(second) for _ in range(2)]
+        expected = [jobs[0], jobs[3], jobs[1], jobs[4], jobs[2]]
+        self.assertEqual([job.pk for job in admission_order()], [job.pk for job in expected])
+        self.assertEqual(job_info(jobs[3])['position'], 2)
+        self.assertEqual([job.pk for job in self._admit_all()], [job.pk for job in expected[:4]])
+
+    def test_cancel_and_requeue_stale(self):
+        from django.utils import timezone
+        from .jobs import cancel, requeue_stale
+        from .models import ExperimentJob
+
+        queued = self._job(self.batches[0])
+        self.assertTrue(cancel(queued.experiment))
+        self.assertEqual(ExperimentJob.objects.get(pk=queued.pk).state, 'CANCELLED')
+        self.assertFalse(cancel(queued.experiment))
+
+        running = self._job(self.batches[0], state='RUNNING', heartbeat_at=timezone.now(), attempts=1)
+        self.assertTrue(cancel(running.experiment))
+        self.assertTrue(ExperimentJob.objects.get(pk=running.pk).cancel_requested)
+
+        # Dispatchers that died: one job goes back to the queue, one is out of attempts
+        old = timezone.now() - timezone.timedelta(minutes=5)
+        stale = self._job(self.batches[1], state='RUNNING', heartbeat_at=old, attempts=1)
+        spent = self._job(self.batches[1], state='RUNNING', heartbeat_at=old, attempts=2)
+        live = self._job(self.batches[1], state='RUNNING', heartbeat_at=timezone.now(), attempts=1)
+        requeue_stale()
+        states = {job.pk: (job.state, job.experiment.status)
+                  for job in ExperimentJob.objects.select_related('experiment')}
+        self.assertEqual(states[stale.pk], ('QUEUED', 'QUEUED'))
+        self.assertEqual(states[spent.pk], ('DONE', 'FAILED'))
+        self.assertEqual(states[live.pk][0], 'RUNNING')
+
+    def test_a_second_dispatcher_is_refused(self):
+        import subprocess
+        import sys
+        from unittest import mock
+        from django.core.management import CommandError, call_command
+        from django.test import override_settings
+        from . import jobs
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'run_queue.lock')
+            # Another process holds the lock
+            holder = subprocess.Popen(
+                [sys.executable, '-c', 'import fcntl, sys; f = open(sys.argv[1], "a+"); '
+                 'fcntl.flock(f, fcntl.LOCK_EX); print("locked", flush=True); sys.stdin.read()', path],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+            try:
+                self.assertEqual(holder.stdout.readline().strip(), 'locked')
+                with override_settings(PROCESSOR_QUEUE_LOCK_FILE=path), mock.patch.object(jobs, '_lock_file', None):
+                    self.assertFalse(jobs.acquire_dispatcher_lock())
+                    with self.assertRaises(CommandError):
+                        call_command('run_queue')
+            finally:
+                holder.stdin.close()
+                holder.wait()
+            with override_settings(PROCESSOR_QUEUE_LOCK_FILE=path), mock.patch.object(jobs, '_lock_file', None):
+                self.assertTrue(jobs.acquire_dispatcher_lock())
+                jobs._lock_file.close()
+
+
+class FeatureStoreTests(SimpleTestCase):
+
+    def test_shards_merge_into_a_readable_store(self):
+        import threading
+        from .lib.feature_store import FeatureStore, FeatureStoreWriter, feature_ref, load_feature, merge_shards
+
+        rng = np.random.default_rng(0)
+        arrays = {1: rng.standard_normal((128, 300)).astype(np.float32),
+                  2: rng.standard_normal((13, 2500)).astype(np.float32),
+                  3: rng.standard_normal(700).astype(np.float32)}
+        with tempfile.TemporaryDirectory() as root:
+            store = os.path.join(root, 'features', 'experiment_1')
+
+            def write(file_ids, **options):
+                # One shard per thread, as in THREADED runs
+                writer = FeatureStoreWriter(store, **options)
+                for file_id in file_ids:
+                    path = os.path.join(root, f'{file_id}.npy')
+                    np.save(path, arrays[file_id])
+                    writer.append(file_id, {'feature': path})
+            thread = threading.Thread(target=write, args=([2],), kwargs={'compression': 'zlib', 'chunk_frames': 256})
+            thread.start()
+            thread.join()
+            write([1])
+            merge_shards(store)
+            # A later merge appends to the existing container
+            write([3], dtype='float16', compression='zlib', chunk_frames=100)
+            merge_shards(store)
+
+            self.assertEqual(sorted(os.listdir(store)), ['features.bin', 'index.json'])
+            self.assertEqual(sorted(FeatureStore(store).file_ids()), ['1', '2', '3'])
+            ref = lambda file_id: feature_ref('features/experiment_1', file_id, 'feature')
+            np.testing.assert_array_equal(FeatureStore(store).memmap(1, 'feature'), arrays[1])
+            np.testing.assert_array_equal(load_feature(ref(1), root), arrays[1])
+            np.testing.assert_array_equal(load_feature(ref(2), root), arrays[2])
+            np.testing.assert_array_equal(FeatureStore(store).load(2, 'feature', 200, 1100), arrays[2][:, 200:1100])
+            np.testing.assert_array_equal(load_feature(ref(3), root), arrays[3][np.newaxis].astype(np.float16))
+            with self.assertRaises(ValueError):
+                FeatureStore(store).memmap(2, 'feature')
+
+
+class ExperimentRunnerTests(TestCase):
+
+    def test_failed_run_still_merges_the_feature_store(self):
+        from unittest import mock
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import override_settings
+        from . import utils
+        from .lib.feature_store import FeatureStore, FeatureStoreWriter
+        from .models import AudioBatch, AudioFile, ProcessingExperiment
+
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            batch = AudioBatch.objects.create()
+            for i in range(2):
+                AudioFile.objects.create(batch=batch, file=SimpleUploadedFile(f'{i}.wav', b'RIFF'),
+                                         original_name=f'{i}.wav')
+            experiment = ProcessingExperiment.objects.create(batch=batch, mode='SERIAL', use_cache=False,
+                                                             feature_store={'dtype': 'float32', 'compression': None,
+                                                                            'chunk_frames': 1024})
+
+            def process_file_task(input_path, output_root, file_id, pipeline, feature_store, *args):
+                # The first file stores its features, the second one brings the run down
+                if process_file_task.calls:
+                    raise RuntimeError('disk full')
+                process_file_task.calls += 1
+                path = os.path.join(media, 'mel.npy')
+                np.save(path, np.ones((2, 3), np.float32))
+                FeatureStoreWriter(os.path.join(output_root, feature_store['path'])).append(file_id, {'mel': path})
+                return {'success': True, 'original_id': file_id}
+            process_file_task.calls = 0
+
+            with mock.patch.object(utils, 'process_file_task', process_file_task), \
+                    mock.patch.object(utils, 'warm_local'):
+                utils.ExperimentRunner(experiment).run()
+
+            experiment.refresh_from_db()
+            self.assertEqual(experiment.status, 'FAILED')
+            store = os.path.join(media, experiment.feature_store['path'])
+            self.assertEqual(sorted(os.listdir(store)), ['features.bin', 'index.json'])
+            self.assertEqual(len(FeatureStore(store).file_ids()), 1)
+
+
+class SpectrogramPreviewTests(TestCase):
+
+    def setUp(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import override_settings
+        from .lib.spectrogram_tiles import write_pyramid
+        from .models import AudioBatch, AudioFile, ProcessedResult, ProcessingExperiment
+
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings = override_settings(MEDIA_ROOT=media.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        # 100 s at 10 frames per second, so the pyramid has two levels
+        mel = np.linspace(-80, 0, 16 * 1000, dtype=np.float32).reshape(16, 1000)
+        np.save(os.path.join(media.name, 'mel.npy'), mel)
+        _, meta = write_pyramid(os.path.join(media.name, 'mel.npy'), frame_rate=10.0)
+        batch = AudioBatch.objects.create()
+        audio = AudioFile.objects.create(batch=batch, file=SimpleUploadedFile('a.wav', b'RIFF'), original_name='a.wav')
+        experiment = ProcessingExperiment.objects.create(batch=batch, mode='SERIAL')
+        result = ProcessedResult.objects.create(experiment=experiment, original_file=audio, processing_time_ms=1.0,
+                                                spectrogram_path='mel.npy', spectrogram_meta=meta)
+        self.url = f'/api/experiments/{experiment.id}/results/{result.id}/spectrogram/'
+
+    def test_json_and_png_previews(self):
+        response = self.client.get(self.url, {'start': 10, 'end': 40, 'width': 100, 'height': 8})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body['start'], body['end'], body['level']), (10.0, 40.0, 1))
+        self.assertEqual(body['shape'], [8, 100])
+
+        response = self.client.get(self.url, {'output': 'png', 'width': 64, 'height': 16})
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response.content[:8], b'\x89PNG\r\n\x1a\n')
+        # IHDR holds the width and height
+        self.assertEqual(response.content[16:24], (64).to_bytes(4, 'big') + (16).to_bytes(4, 'big'))
+
+    def test_etag_answers_304_until_the_source_changes(self):
+        response = self.client.get(self.url, {'width': 64})
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.url, {'width': 64}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(self.url, {'width': 32}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        from django.conf import settings
+        path = os.path.join(settings.MEDIA_ROOT, 'mel.npy')
+        os.utime(path, (os.path.getmtime(path) + 10,) * 2)
+        response = self.client.get(self.url, {'width': 64}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_start_past_the_end_is_rejected(self):
+        for start in (100, 250):
+            response = self.client.get(self.url, {'start': start, 'output': 'png'})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'start': 99.9}).json()['shape'][1], 1)
+
+
+class ResultCacheTests(SimpleTestCase):
+
+    def test_hit_miss_and_key(self):
+        from .lib.result_cache import ResultCache, result_key
+
+        with tempfile.TemporaryDirectory() as tmp:
+            audio = os.path.join(tmp, 'in.wav')
+            sf.write(audio, _noise(1, 16000), 16000)
+            pipeline = [{'stage': 'highpass', 'params': {'low_cut': 80}}]
+            key = result_key(audio, pipeline)
+            self.assertEqual(result_key(audio, pipeline), key)
+            self.assertNotEqual(result_key(audio, [{'stage': 'highpass', 'params': {'low_cut': 100}}]), key)
+
+            output, mel = os.path.join(tmp, 'out.wav'), os.path.join(tmp, 'mel.npy')
+            sf.write(output, _noise(1, 16000, seed=1), 16000)
+            np.save(mel, np.ones((4, 5), np.float32))
+            cache = ResultCache(os.path.join(tmp, 'cache'), max_bytes=1 << 30)
+            restored = os.path.join(tmp, 'restored')
+            os.makedirs(restored)
+            self.assertIsNone(cache.get(key, restored, 'x'))
+
+            cache.put(key, output, {'speech_fraction': 0.5, 'mel_spectrogram': mel}, {}, {'frames': 5})
+            hit = cache.get(key, restored, 'x')
+            self.assertEqual(hit['artifacts']['speech_fraction'], 0.5)
+            self.assertEqual(hit['spectrogram_meta'], {'frames': 5})
+            np.testing.assert_array_equal(np.load(hit['artifacts']['mel_spectrogram']), np.load(mel))
+            np.testing.assert_array_equal(sf.read(hit['output'])[0], sf.read(output)[0])
+
+            # Different input audio is a different entry
+            sf.write(audio, _noise(1, 16000, seed=2), 16000)
+            self.assertIsNone(cache.get(result_key(audio, pipeline), restored, 'y'))
+
+
+class CheckpointTests(SimpleTestCase):
+
+    def test_resume_skips_completed_stages(self):
+        import functools
+        from unittest import mock
+        from .lib.checkpoints import CheckpointStore
+        from .lib.pipeline import _STAGES, run_pipeline
+
+        y = _noise(2, 22050, 2).astype(np.float32)
+
+        def definition(target_dBFS):
+            return [{'stage': 'resample', 'params': {'target_sr': 16000}},
+                    {'stage': 'highpass', 'params': {'low_cut': 100}},
+                    {'stage': 'normalize_peak', 'params': {'target_dBFS': target_dBFS}}]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = CheckpointStore(os.path.join(tmp, 'checkpoints'), max_bytes=1 << 30)
+            _, _, artifacts = run_pipeline(y, 22050, definition(-1.0), tmp, 'x', checkpoints=store)
+            self.assertEqual(set(artifacts['checkpoint_stats'].values()), {'miss'})
+
+            # Only the changed last stage runs again
+            calls = []
+
+            @functools.wraps(_STAGES['resample']['fn'])
+            def resample(*args, **kwargs):
+                calls.append(args)
+                return resample.__wrapped__(*args, **kwargs)
+
+            with mock.patch.dict(_STAGES['resample'], fn=resample):
+                out, sr, artifacts = run_pipeline(y, 22050, definition(-3.0), tmp, 'x', checkpoints=store)
+            self.assertEqual(calls, [])
+            self.assertEqual(artifacts['checkpoint_stats'],
+                             {'resample': 'hit', '[highpass]': 'hit', 'normalize_peak': 'miss'})
+            expected, expected_sr, _ = run_pipeline(y, 22050, definition(-3.0), tmp, 'x')
+            self.assertEqual(sr, expected_sr)
+            np.testing.assert_array_equal(out, expected)
+
+
+class SchedulingTests(SimpleTestCase):
+
+    def test_lpt_order_and_makespan(self):
+        from .lib.scheduling import lpt_order, simulate_makespan
+
+        jobs = [('a', 2.0), ('b', 3.0), ('c', 7.0), ('d', 5.0), ('e', 4.0)]
+        self.assertEqual([key for key, _ in lpt_order(jobs)], ['c', 'd', 'e', 'b', 'a'])
+        # Two workers in submission order: 2 | 3, 2+7 | 3, 9 | 3+5, 9 | 8+4 -> 12
+        self.assertEqual(simulate_makespan([cost for _, cost in jobs], 2), 12.0)
+        # Longest first: 7 | 5, 7 | 5+4, 7+3 | 9, 10 | 9+2 -> 11
+        self.assertEqual(simulate_makespan([cost for _, cost in lpt_order(jobs)], 2), 11.0)
+        self.assertEqual(simulate_makespan([4.0, 1.0], 0), 5.0)
+
+    def test_cost_model_recovers_a_linear_history(self):
+        from .lib.scheduling import DEFAULT_MS_PER_MSAMPLE, CostModel, work_msamples
+
+        self.assertEqual(work_msamples(10, 16000, 2), 0.32)
+        self.assertEqual(work_msamples(file_size_bytes=2_000_000), 1.0)
+        model = CostModel.fit([(x, 1000 + 200 * x) for x in (1.0, 2.0, 4.0)])
+        self.assertAlmostEqual(model.overhead_ms, 1000)
+        self.assertAlmostEqual(model.ms_per_msample, 200)
+        self.assertEqual(CostModel.fit([(1.0, 500.0)]).ms_per_msample, DEFAULT_MS_PER_MSAMPLE)
+
+
+class SharedMemoryTests(SimpleTestCase):
+
+    def setUp(self):
+        from .lib import shm
+        if not shm.available():
+            self.skipTest('no POSIX shared memory here')
+
+    def test_segmented_run_unlinks_its_blocks(self):
+        from unittest import mock
+        from .lib import shm
+        from .lib.segmented import run_pipeline_segmented
+
+        names = []
+        open_block = shm._open
+
+        def record(name, size=0):
+            names.append(name)
+            return open_block(name, size)
+
+        definition = [{'stage': 'highpass', 'params': {'low_cut': 80}}]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'in.flac')
+            sf.write(path, _noise(12, 16000, 2), 16000)
+            with mock.patch.object(shm, '_open', record):
+                run_pipeline_segmented(path, definition, os.path.join(tmp, 'out.wav'), tmp, 'x', segment_seconds=5)
+        self.assertTrue(names)
+        self.assertEqual([name for name in names if os.path.exists(os.path.join(shm.SHM_DIR, name))], [])
+
+    def test_sweep_unlinks_blocks_of_dead_owners(self):
+        import subprocess
+        import sys
+        from .lib import shm
+
+        dead = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                              capture_output=True, text=True, check=True)
+        orphan = f"{shm._PREFIX}{int(dead.stdout)}_deadbeef_0"
+        descriptor = shm.put(orphan, np.arange(10.0))
+        self.addCleanup(shm._unlink, orphan)
+        with shm.SharedRun() as run:
+            live = shm.put(run.prefix + '0', np.arange(10.0))
+            self.assertFalse(os.path.exists(os.path.join(shm.SHM_DIR, descriptor['shm'])))
+            np.testing.assert_array_equal(shm.attach(live), np.arange(10.0))
+        self.assertFalse(os.path.exists(os.path.join(shm.SHM_DIR, live['shm'])))
+
+
+class PCMCacheTests(SimpleTestCase):
+
+    def test_entry_reused_until_the_source_changes(self):
+        from unittest import mock
+        from .lib import decode as decode_module
+        from .lib.decode import PCMCache, decode
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'in.flac')
+            sf.write(path, _noise(1, 16000, 2), 16000)
+            cache = PCMCache(os.path.join(tmp, 'pcm'), max_bytes=1 << 30)
+            key = cache.key(path)
+            samples, sr = decode(path, cache)
+            self.assertIsNotNone(cache.get(key))
+
+            with mock.patch.object(decode_module, 'decode_file', side_effect=AssertionError('decoded again')):
+                cached, cached_sr = decode(path, cache)
+            self.assertEqual(cached_sr, sr)
+            np.testing.assert_array_equal(cached, samples)
+
+            # New content under the same name gets a new key and is decoded again
+            sf.write(path, _noise(1, 16000, 2, seed=1), 16000)
+            self.assertNotEqual(cache.key(path), key)
+            changed, _ = decode(path, cache)
+            self.assertFalse(np.array_equal(changed, samples))
+            self.assertEqual(len(cache.entries()), 2)
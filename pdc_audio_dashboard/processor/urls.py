@@ -1,10 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import BatchViewSet, ExperimentViewSet
+from .views import AgentViewSet, BatchViewSet, ExperimentViewSet
 
 router = DefaultRouter()
 router.register(r'batches', BatchViewSet, basename='batch')
 router.register(r'experiments', ExperimentViewSet, basename='experiment')
+router.register(r'agents', AgentViewSet, basename='agent')
 
 urlpatterns = [
     path('', include(router.urls)),
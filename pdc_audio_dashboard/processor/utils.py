@@ -5,19 +5,122 @@ import concurrent.futures
 from django.conf import settings
 from django.utils import timezone
 from .models import ProcessedResult
-from .worker import process_file_task  # Import from the clean file
+from .worker import process_file_group, process_file_task  # Import from the clean file
+from .pool import get_pool, warm_local
+from .lib.feature_store import merge_shards
+from .lib.checkpoints import merge_stats
+from .lib.scheduling import CostModel, lpt_order, simulate_makespan, work_msamples
+from .lib.pipeline import DEFAULT_PIPELINE, plan_rates
+from .lib.segmented import can_segment
+
+# Seconds between cancellation checks while waiting for results
+CANCEL_POLL_SECONDS = 1.0
+
+
+def mode_concurrency(mode, threads=None):
+    """(processes, threads per process) an experiment mode runs files on."""
+    if mode == 'PARALLEL':
+        return get_pool().max_workers, 1
+    if mode == 'THREADED':
+        return 1, threads or getattr(settings, 'PROCESSOR_THREADS', None) or os.cpu_count() or 4
+    if mode == 'HYBRID':
+        return get_pool().max_workers, threads or getattr(settings, 'PROCESSOR_HYBRID_THREADS', 2)
+    if mode == 'DISTRIBUTED':
+        from .distributed import live_slots
+        return live_slots() or 1, 1
+    return 1, 1
+
 
 class ExperimentRunner:
     """Orchestrates the Serial vs Parallel execution."""
 
-    def __init__(self, experiment_obj):
+    def __init__(self, experiment_obj, should_cancel=None):
         self.experiment = experiment_obj
         self.batch = experiment_obj.batch
-        self.files = self.batch.files.all()
+        self.files = list(self.batch.files.all())
+        # Polled between files; once it returns True no further file is started
+        self.should_cancel = should_cancel
+        self.cancelled = False
+        self.pipeline = self.experiment.pipeline or DEFAULT_PIPELINE
+
+    def _check_cancel(self):
+        if not self.cancelled and self.should_cancel is not None and self.should_cancel():
+            print(f"Experiment {self.experiment.id}: cancelled, finishing files in flight")
+            self.cancelled = True
+        return self.cancelled
+
+    def _collect(self, futures, add):
+        """
+        Hand each future's result to add() as it finishes. If the experiment
+        is cancelled meanwhile, futures that have not started are dropped.
+        """
+        pending = set(futures)
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, timeout=CANCEL_POLL_SECONDS, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                if future.cancelled():
+                    continue
+                try:
+                    add(future.result())
+                except Exception as exc:
+                    print(f"Worker generated an exception: {exc}")
+            if pending and self._check_cancel():
+                for future in pending:
+                    future.cancel()
+
+    def _predict_costs(self):
+        """{file_id: predicted ms} from a cost model fitted on earlier computed (non-cached) results."""
+        # Segmented results report wall time over several workers, not the file's cost
+        history = (
+            ProcessedResult.objects
+            .exclude(cache_hit=True)
+            .filter(segments__isnull=True)
+            .filter(original_file__duration_seconds__isnull=False)
+            .order_by('-id')
+            .values_list('original_file__duration_seconds', 'original_file__sample_rate',
+                         'original_file__channels', 'processing_time_ms')[:500]
+        )
+        model = CostModel.fit((work_msamples(d, sr, ch), ms) for d, sr, ch, ms in history)
+        self.experiment.cost_model = model.describe()
+        return {
+            f.id: model.predict_ms(work_msamples(f.duration_seconds, f.sample_rate, f.channels, f.file_size_bytes))
+            for f in self.files
+        }
+
+    def _segmented_files(self, predicted, workers):
+        """
+        Ids of files to split across the pool: long enough, and predicted to
+        take more than an even share of the whole batch, so one core would
+        still be busy with them after the rest of the batch is done.
+        """
+        if self.experiment.mode != 'PARALLEL' or not self.experiment.segmented or workers < 2:
+            return set()
+        min_seconds = getattr(settings, 'PROCESSOR_SEGMENT_MIN_SECONDS', 600)
+        share = sum(predicted.values()) / workers
+        return {
+            f.id for f in self.files
+            if (f.duration_seconds or 0) >= min_seconds and predicted[f.id] > share
+            and can_segment(f.file.path, self.pipeline)
+        }
+
+    def _plan_rates(self):
+        """Reorder the pipeline with plan_rates and record what moved on the experiment."""
+        self.experiment.rate_plan = None
+        if not self.experiment.rate_planning:
+            return
+        pipeline, moves = plan_rates(self.pipeline)
+        if moves:
+            self.pipeline = pipeline
+            self.experiment.rate_plan = {'pipeline': pipeline, 'moves': moves}
+            print(f"Experiment {self.experiment.id}: " + ', '.join(
+                f"{m['stage']} moved ahead of {m['ahead_of']}" for m in moves))
 
     def run(self):
         self.experiment.status = 'PROCESSING'
         self.experiment.start_time = timezone.now()
+        self._plan_rates()
         
         # Capture CPU usage baseline
         psutil.cpu_percent(interval=None) 
@@ -27,61 +130,154 @@ class ExperimentRunner:
         # Prepare arguments (Must be simple types: strings, ints)
         # We do NOT pass model instances to the worker
         tasks = []
-        for audio_file in self.files:
+        pipeline = self.pipeline  # Plain list of dicts, safe to pickle
+        feature_store = self.experiment.feature_store
+        if feature_store:
+            feature_store = {**feature_store, 'path': f"features/experiment_{self.experiment.id}"}
+            self.experiment.feature_store = feature_store
+            self.experiment.save(update_fields=['feature_store'])
+        result_cache, checkpoints, pcm_cache = None, None, None
+        if self.experiment.use_cache:
+            result_cache = {
+                'path': os.path.join(str(settings.MEDIA_ROOT), 'cache', 'results'),
+                'max_bytes': getattr(settings, 'PROCESSOR_RESULT_CACHE_BYTES', 2 * 1024 ** 3),
+            }
+            checkpoints = {
+                'path': os.path.join(str(settings.MEDIA_ROOT), 'cache', 'checkpoints'),
+                'max_bytes': getattr(settings, 'PROCESSOR_CHECKPOINT_CACHE_BYTES', 4 * 1024 ** 3),
+            }
+            pcm_cache = {
+                'path': os.path.join(str(settings.MEDIA_ROOT), 'cache', 'pcm'),
+                'max_bytes': getattr(settings, 'PROCESSOR_PCM_CACHE_BYTES', 4 * 1024 ** 3),
+            }
+        # Longest predicted job first, so no long file is left to start last
+        predicted = self._predict_costs()
+        processes, threads = mode_concurrency(self.experiment.mode, self.experiment.threads)
+        workers = processes * threads
+        if self.experiment.mode in ('THREADED', 'HYBRID'):
+            self.experiment.threads = threads
+        order = lpt_order([(f, predicted[f.id]) for f in self.files])
+        segmented = self._segmented_files(predicted, workers)
+        costs = []
+        for f, ms in order:
+            costs += [ms / workers] * workers if f.id in segmented else [ms]
+        self.experiment.expected_makespan_seconds = simulate_makespan(costs, workers) / 1000
+        self.experiment.save(update_fields=['expected_makespan_seconds', 'cost_model', 'threads'])
+
+        for audio_file, _ in order:
             input_path = audio_file.file.path
             output_root = str(settings.MEDIA_ROOT) # Pass as string
             file_id = audio_file.id
-            tasks.append((input_path, output_root, file_id))
+            tasks.append((input_path, output_root, file_id, pipeline, feature_store, result_cache, checkpoints,
+                          pcm_cache))
 
         results = []
+
+        # Warm-up (pool spawn, imports, JIT) is measured apart from processing
+        warmup_start = time.perf_counter()
+        try:
+            if self.experiment.mode in ('PARALLEL', 'HYBRID'):
+                pool = get_pool()
+                executor = pool.acquire()
+            elif self.experiment.mode != 'DISTRIBUTED':
+                # Worker agents warm their own pools
+                warm_local()
+        except Exception as e:
+            print(f"Worker pool failed to start: {e}")
+            self.experiment.status = 'FAILED'
+            self.experiment.save()
+            return
+        self.experiment.warmup_seconds = time.perf_counter() - warmup_start
+
         start_perf = time.perf_counter()
 
         try:
             if self.experiment.mode == 'SERIAL':
                 self.experiment.cpu_cores_used = 1
                 for task_args in tasks:
+                    if self._check_cancel():
+                        break
                     # Unpack arguments manually for direct call
                     res = process_file_task(*task_args)
                     results.append(res)
                     
             elif self.experiment.mode == 'PARALLEL':
-                # Determine max workers
-                core_count = os.cpu_count() or 4
-                self.experiment.cpu_cores_used = core_count
-                
-                # Use ProcessPoolExecutor for robust Windows handling
-                with concurrent.futures.ProcessPoolExecutor(max_workers=core_count) as executor:
-                    # Submit all tasks
+                # The shared pool outlives the experiment, so no `with` block here
+                self.experiment.cpu_cores_used = pool.max_workers
+
+                # Submit all tasks. Segmented files are orchestrated from a thread
+                # here and push their segments into the same pool.
+                segment_options = {
+                    'executor': executor,
+                    'segment_seconds': getattr(settings, 'PROCESSOR_SEGMENT_SECONDS', 120),
+                    'shm_bytes': getattr(settings, 'PROCESSOR_SHM_MAX_BYTES', 1024 ** 3),
+                }
+                with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(segmented))) as segment_runner:
+                    future_to_file = {}
+                    for t in tasks:
+                        if t[2] in segmented:
+                            future = segment_runner.submit(process_file_task, *t, segmented=segment_options)
+                        else:
+                            future = executor.submit(process_file_task, *t)
+                        future_to_file[future] = t
+
+                    # Collect results as they finish
+                    self._collect(future_to_file, results.append)
+
+            elif self.experiment.mode == 'THREADED':
+                # NumPy/SciPy/soxr/soundfile release the GIL, so threads overlap
+                # without spawning, pickling or importing anything again
+                self.experiment.cpu_cores_used = threads
+                with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as thread_pool:
                     future_to_file = {
-                        executor.submit(process_file_task, t[0], t[1], t[2]): t 
+                        thread_pool.submit(process_file_task, *t): t
                         for t in tasks
                     }
-                    
-                    # Collect results as they finish
-                    for future in concurrent.futures.as_completed(future_to_file):
-                        try:
-                            data = future.result()
-                            results.append(data)
-                        except Exception as exc:
-                            print(f"Worker generated an exception: {exc}")
+                    self._collect(future_to_file, results.append)
+
+            elif self.experiment.mode == 'HYBRID':
+                # Each pool task is a group of `threads` files run on threads of
+                # one process. Consecutive files of the LPT order have similar
+                # costs, so a group's threads finish close together.
+                self.experiment.cpu_cores_used = pool.max_workers * threads
+                groups = [tasks[i:i + threads] for i in range(0, len(tasks), threads)]
+                future_to_group = {
+                    executor.submit(process_file_group, group, threads): group
+                    for group in groups
+                }
+                self._collect(future_to_group, results.extend)
+
+            elif self.experiment.mode == 'DISTRIBUTED':
+                # Worker agents pull the files in LPT order; this thread only waits
+                from .distributed import run_tasks
+                self.experiment.cpu_cores_used = workers
+                results.extend(run_tasks(self.experiment, [t[2] for t in tasks], self._check_cancel))
 
         except Exception as e:
             print(f"Critical Experiment Error: {e}")
             self.experiment.status = 'FAILED'
             self.experiment.save()
             return
+        finally:
+            # Workers appended to per-process shards; join them into one container,
+            # also after a failure, so no shard is left behind
+            if feature_store:
+                merge_shards(os.path.join(str(settings.MEDIA_ROOT), feature_store['path']))
 
         end_perf = time.perf_counter()
 
         # Save Metrics
         self.experiment.end_time = timezone.now()
         self.experiment.duration_seconds = end_perf - start_perf
-        self.experiment.status = 'COMPLETED'
+        self.experiment.status = 'CANCELLED' if self.cancelled else 'COMPLETED'
         self.experiment.save()
 
         # Save Results to DB (This happens in the Main Django Process, so Models are safe here)
         print(f"Saving {len(results)} results to DB...")
+        checkpoint_stats = {}
         for res in results:
+            if res.get('checkpoint_stats'):
+                merge_stats(checkpoint_stats, res['checkpoint_stats'])
             if res['success']:
                 # The worker returns the absolute path. We need relative for Django FileField.
                 # However, our worker also returns 'relative_dir'.
@@ -96,9 +292,20 @@ class ExperimentRunner:
                     original_file_id=res['original_id'],
                     processed_file=relative_file_path,
                     spectrogram_path=res.get('spectrogram_path'),
+                    spectrogram_meta=res.get('spectrogram_meta'),
+                    cache_hit=res.get('cache_hit'),
+                    segments=res.get('segments'),
+                    integrated_loudness=res.get('integrated_loudness'),
+                    true_peak=res.get('true_peak'),
+                    node_id=res.get('node'),
+                    predicted_time_ms=predicted.get(res['original_id']),
                     processing_time_ms=res['duration'] * 1000
                 )
             else:
                 print(f"Skipping failed result for file {res['original_id']}")
 
+        if checkpoint_stats:
+            self.experiment.checkpoint_stats = checkpoint_stats
+            self.experiment.save(update_fields=['checkpoint_stats'])
+
         return self.experiment  
\ No newline at end of file
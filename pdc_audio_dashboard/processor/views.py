@@ -1,10 +1,28 @@
-import threading
-from rest_framework import viewsets, status
+import hmac
+import json
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from rest_framework import permissions, serializers, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import AudioBatch, AudioFile, ProcessingExperiment
-from .serializers import AudioBatchSerializer, ExperimentSerializer
-from .utils import ExperimentRunner
+from .models import AudioBatch, AudioFile, ProcessingExperiment, ProcessedResult, WorkerNode
+from .serializers import AudioBatchSerializer, ExperimentSerializer, WorkerNodeSerializer
+from . import distributed, jobs
+from .lib.pipeline import DEFAULT_PIPELINE, validate_pipeline
+from .lib.feature_store import validate_store_options
+from .lib.probe import FIELDS as PROBE_FIELDS, probe_audio
+from .lib.spectrogram_tiles import MAX_WIDTH, preview_etag, render_preview
+
+
+def _flag(data, name, default=True):
+    """Boolean option of a request body; JSON booleans and form strings ("false", "0", ...) alike."""
+    value = data.get(name)
+    if value is None:
+        return default
+    try:
+        return serializers.BooleanField().to_internal_value(value)
+    except serializers.ValidationError:
+        raise ValueError(f"'{name}' must be a boolean")
 
 class BatchViewSet(viewsets.ModelViewSet):
     queryset = AudioBatch.objects.all()
@@ -28,6 +46,12 @@ class BatchViewSet(viewsets.ModelViewSet):
         ]
         AudioFile.objects.bulk_create(audio_objects)
 
+        # Header probe (duration, rate, channels, codec) for the scheduler
+        for audio in audio_objects:
+            for field, value in probe_audio(audio.file.path).items():
+                setattr(audio, field, value)
+        AudioFile.objects.bulk_update(audio_objects, list(PROBE_FIELDS))
+
         return Response(AudioBatchSerializer(batch).data, status=status.HTTP_201_CREATED)
 
 class ExperimentViewSet(viewsets.ReadOnlyModelViewSet):
@@ -40,10 +64,43 @@ class ExperimentViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=False, methods=['POST'])
     def start(self, request):
         """
-        Payload: { "batch_id": 1, "mode": "PARALLEL" }
+        Payload: { "batch_id": 1, "mode": "PARALLEL", "pipeline": [...], "feature_store": {...} }
+        "pipeline" is optional; see processor/lib/pipeline.py for the format.
+        "feature_store" is optional: true (default), false for per-file .npy
+        files, or {"dtype": "float16", "compression": "zlib", "chunk_frames": 1024}.
+        "use_cache" is optional (default true); false disables the result cache
+        and stage checkpoints so every file is reprocessed, e.g. for benchmarking.
+        "segmented" is optional (default true); in PARALLEL mode long files that
+        would outlast the rest of the batch are split across the pool.
+        "rate_planning" is optional (default true); the mono downmix and the
+        resample then run ahead of noise_reduction, which changes the output
+        slightly (see plan_rates in processor/lib/pipeline.py). The stages
+        actually run are reported in the experiment's "rate_plan".
+        "mode" is SERIAL, PARALLEL (process pool), THREADED (thread pool) or
+        HYBRID (pool processes x threads) or DISTRIBUTED (worker agents, see
+        processor/agent.py); "threads" optionally sets the thread count of
+        THREADED runs / threads per process of HYBRID runs.
         """
         batch_id = request.data.get('batch_id')
         mode = request.data.get('mode', 'SERIAL')
+        if mode not in dict(ProcessingExperiment.MODE_CHOICES):
+            return Response({'error': f"Unknown mode '{mode}'"}, status=status.HTTP_400_BAD_REQUEST)
+        if mode == 'DISTRIBUTED' and not distributed.agent_token():
+            return Response({'error': "DISTRIBUTED mode needs PROCESSOR_AGENT_TOKEN to be set"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        threads = request.data.get('threads')
+        if threads is not None and mode not in ('THREADED', 'HYBRID'):
+            return Response({'error': "'threads' only applies to THREADED and HYBRID runs"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if threads is not None and (not isinstance(threads, int) or isinstance(threads, bool) or threads < 1):
+            return Response({'error': "'threads' must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            pipeline = validate_pipeline(request.data.get('pipeline') or DEFAULT_PIPELINE)
+            feature_store = validate_store_options(request.data.get('feature_store', True))
+            flags = {name: _flag(request.data, name) for name in ('use_cache', 'segmented', 'rate_planning')}
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
             batch = AudioBatch.objects.get(id=batch_id)
@@ -53,15 +110,164 @@ class ExperimentViewSet(viewsets.ReadOnlyModelViewSet):
         experiment = ProcessingExperiment.objects.create(
             batch=batch,
             mode=mode,
-            status='PENDING'
+            status='PENDING',
+            pipeline=pipeline,
+            feature_store=feature_store,
+            threads=threads,
+            **flags
         )
 
-        # Run processing in a separate thread to avoid blocking the HTTP response
-        thread = threading.Thread(target=self._run_background, args=(experiment,))
-        thread.start()
+        # The dispatcher starts it once its cores fit in the global budget
+        jobs.enqueue(experiment)
 
         return Response(ExperimentSerializer(experiment).data)
 
-    def _run_background(self, experiment):
-        runner = ExperimentRunner(experiment)
-        runner.run()
\ No newline at end of file
+    @action(detail=True, methods=['POST'])
+    def cancel(self, request, pk=None):
+        """Cancel a queued experiment, or stop a running one after the files in flight."""
+        experiment = self.get_object()
+        if not jobs.cancel(experiment):
+            return Response({'error': 'Experiment is not queued or running'}, status=status.HTTP_409_CONFLICT)
+        experiment.refresh_from_db()
+        return Response(ExperimentSerializer(experiment).data)
+
+    @action(detail=False, methods=['GET'])
+    def queue(self, request):
+        """Core budget, cores in use, running jobs, queue depth and the oldest job's wait."""
+        return Response(jobs.queue_stats())
+
+    @action(detail=True, methods=['GET'], url_path=r'results/(?P<result_id>[0-9]+)/spectrogram')
+    def spectrogram(self, request, pk=None, result_id=None):
+        """
+        Downsampled mel spectrogram of one result, served from the pyramid
+        the worker built.
+
+        Query: ?start=0&end=30 (seconds, optional), &width=512&height=128
+        (upper bounds in frames/mel bands), &output=json|png
+        """
+        experiment = self.get_object()
+        try:
+            result = experiment.results.get(id=result_id)
+        except ProcessedResult.DoesNotExist:
+            return Response({'error': 'Result not found'}, status=404)
+        meta = result.spectrogram_meta
+        if not result.spectrogram_path or not meta:
+            return Response({'error': 'No spectrogram for this result'}, status=404)
+
+        try:
+            start = max(0.0, float(request.query_params.get('start', 0)))
+            end = request.query_params.get('end')
+            end = float(end) if end is not None else None
+            width = min(MAX_WIDTH, max(1, int(request.query_params.get('width', 512))))
+            height = min(meta['n_mels'], max(1, int(request.query_params.get('height', meta['n_mels']))))
+        except ValueError:
+            return Response({'error': 'start/end must be numbers, width/height integers'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        duration = meta['frames'] / (meta.get('frame_rate') or 1.0)
+        if start >= duration:
+            return Response({'error': f'start must be below the duration ({duration:.2f} s)'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        output = request.query_params.get('output', 'json')
+        if output not in ('json', 'png'):
+            return Response({'error': "output must be 'json' or 'png'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        ref, root = result.spectrogram_path, str(settings.MEDIA_ROOT)
+        try:
+            etag = preview_etag(ref, root, start, end, width, height, output)
+            if request.headers.get('If-None-Match') == etag:
+                response = HttpResponse(status=304)
+            else:
+                body, content_type = render_preview(ref, root, json.dumps(meta, sort_keys=True),
+                                                    start, end, width, height, output, etag)
+                response = HttpResponse(body, content_type=content_type)
+        except (OSError, KeyError):
+            return Response({'error': 'Spectrogram data is missing'}, status=404)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=3600'
+        return response
+
+class AgentTokenPermission(permissions.BasePermission):
+    """
+    Agent calls must carry PROCESSOR_AGENT_TOKEN as X-Agent-Token; with no
+    token configured the protocol is refused. Listing nodes stays open.
+    """
+    message = "Agent calls need X-Agent-Token matching PROCESSOR_AGENT_TOKEN, which must be set"
+
+    def has_permission(self, request, view):
+        if view.action in ('list', 'retrieve'):
+            return True
+        token = distributed.agent_token()
+        return bool(token) and hmac.compare_digest(request.headers.get('X-Agent-Token', ''), token)
+
+class AgentViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Worker agents of DISTRIBUTED runs (processor/distributed.py). GET lists
+    the nodes with their throughput; the other actions are the agent protocol.
+    """
+    queryset = WorkerNode.objects.all()
+    serializer_class = WorkerNodeSerializer
+    permission_classes = [AgentTokenPermission]
+
+    def _task(self, pk, task_id):
+        node = self.get_object()
+        return node, distributed.assigned_task(node, task_id)
+
+    @action(detail=False, methods=['POST'])
+    def register(self, request):
+        """Payload: { "name": "host-1", "slots": 4 }. Returns the node id and heartbeat interval."""
+        name = request.data.get('name')
+        slots = request.data.get('slots', 1)
+        if not name or not isinstance(slots, int) or isinstance(slots, bool) or slots < 1:
+            return Response({'error': "'name' and a positive integer 'slots' are required"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        node = distributed.register(str(name), request.META.get('REMOTE_ADDR', ''), slots)
+        return Response({'id': node.id, 'heartbeat_seconds': distributed.heartbeat_seconds()},
+                        status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['POST'])
+    def heartbeat(self, request, pk=None):
+        distributed.heartbeat(self.get_object())
+        return Response({'ok': True})
+
+    @action(detail=True, methods=['POST'])
+    def claim(self, request, pk=None):
+        """Payload: { "count": 2 }. Assigns up to that many pending files to the node."""
+        count = request.data.get('count', 1)
+        if not isinstance(count, int) or isinstance(count, bool) or count < 1:
+            return Response({'error': "'count' must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
+        tasks = distributed.claim(self.get_object(), count)
+        return Response({'tasks': [distributed.task_payload(t) for t in tasks]})
+
+    @action(detail=True, methods=['GET'], url_path=r'tasks/(?P<task_id>[0-9]+)/input')
+    def task_input(self, request, pk=None, task_id=None):
+        """The input audio of an assigned task."""
+        node, task = self._task(pk, task_id)
+        if task is None:
+            return Response({'error': 'Task is not assigned to this node'}, status=status.HTTP_409_CONFLICT)
+        return FileResponse(task.original_file.file.open('rb'), as_attachment=True,
+                            filename=task.original_file.original_name)
+
+    @action(detail=True, methods=['PUT'], url_path=r'tasks/(?P<task_id>[0-9]+)/files')
+    def task_file(self, request, pk=None, task_id=None):
+        """Raw body: one output file, stored at ?path= (relative to the media root, under the task's output_dir)."""
+        node, task = self._task(pk, task_id)
+        if task is None:
+            return Response({'error': 'Task is not assigned to this node'}, status=status.HTTP_409_CONFLICT)
+        try:
+            distributed.store_file(request.query_params.get('path', ''), request.stream, task)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'ok': True})
+
+    @action(detail=True, methods=['POST'], url_path=r'tasks/(?P<task_id>[0-9]+)/result')
+    def task_result(self, request, pk=None, task_id=None):
+        """Payload: process_file_task's result dict, after its files were uploaded."""
+        node, task = self._task(pk, task_id)
+        if task is None:
+            return Response({'error': 'Task is not assigned to this node'}, status=status.HTTP_409_CONFLICT)
+        try:
+            if not distributed.complete(node, task, dict(request.data)):
+                return Response({'error': 'Task is not assigned to this node'}, status=status.HTTP_409_CONFLICT)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'ok': True})
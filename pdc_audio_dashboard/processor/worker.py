@@ -21,51 +21,218 @@ def simulate_heavy_computation(duration=2):
     while time.time() < end_time:
         _ = np.dot(np.random.rand(500, 500), np.random.rand(500, 500))
 
-def process_file_task(input_path, output_root, original_file_id):
+# Seconds this process spent in warm_up(), set by the pool initializer
+_WARMUP_SECONDS = None
+
+
+def warm_up():
+    """
+    Import the DSP stack and push one second of synthetic stereo audio
+    through the default chain, so imports, numba JIT compilation and
+    filter/mel caches are paid before the first real file.
+
+    Returns:
+        float: Seconds spent.
+    """
+    import shutil
+    import tempfile
+    from .lib.pipeline import DEFAULT_PIPELINE, run_pipeline
+
+    start = time.perf_counter()
+    sr = 44100
+    y = (np.random.RandomState(0).randn(sr, 2) * 0.1).astype(np.float32)
+    tmp = tempfile.mkdtemp(prefix='warmup_')
+    try:
+        run_pipeline(y, sr, DEFAULT_PIPELINE, tmp, 'warmup')
+    except Exception as e:
+        # A failed warm-up only means the first real task pays the cost
+        print(f"Worker warm-up failed: {e}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return time.perf_counter() - start
+
+
+def init_pool_worker():
+    """ProcessPoolExecutor initializer: warm the worker once at spawn."""
+    global _WARMUP_SECONDS
+    _WARMUP_SECONDS = warm_up()
+
+
+def worker_info():
+    """(pid, warm-up seconds) of the pool process that runs this task."""
+    return os.getpid(), _WARMUP_SECONDS
+
+
+def process_file_group(tasks, threads):
+    """
+    Run several process_file_task argument tuples on `threads` threads of
+    this pool process (HYBRID mode). Results come back in task order.
+    """
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(lambda args: process_file_task(*args), tasks))
+
+
+def feature_arrays(artifacts, pyramid):
+    """{feature name: .npy path} of the features and spectrogram levels a run wrote."""
+    arrays = {
+        name: path for name, path in artifacts.items()
+        if isinstance(path, str) and path.endswith('.npy')
+    }
+    arrays.update(pyramid)
+    return arrays
+
+
+def store_features(output_root, feature_store, original_file_id, arrays):
+    """
+    Move a file's .npy features into the experiment's feature store.
+
+    Returns:
+        tuple: (has_spectrogram, spectrogram reference for ProcessedResult)
+    """
+    from .lib.feature_store import FeatureStoreWriter, feature_ref
+    options = {k: v for k, v in feature_store.items() if k != 'path'}
+    writer = FeatureStoreWriter(os.path.join(output_root, feature_store['path']), **options)
+    stored = writer.append(original_file_id, arrays)
+    return 'mel_spectrogram' in stored, feature_ref(feature_store['path'], original_file_id, 'mel_spectrogram')
+
+
+def process_file_task(input_path, output_root, original_file_id, pipeline=None, feature_store=None,
+                      result_cache=None, checkpoints=None, pcm_cache=None, streaming=None, segmented=None,
+                      run_dir=None):
     """
     Worker function that creates a visible CPU load.
+
+    `pipeline` is the experiment's stage list; None runs the default chain.
+    `feature_store` is the experiment's store options plus its 'path'
+    (relative to output_root); features are appended there instead of being
+    left as per-file .npy files.
+    `result_cache` is {'path', 'max_bytes'} of the result cache; a hit
+    restores the outputs of an earlier identical run instead of processing.
+    `checkpoints` is {'path', 'max_bytes'} of the stage checkpoint store used
+    on a miss, so only stages downstream of a changed parameter rerun.
+    `pcm_cache` is {'path', 'max_bytes'} of the decoded-PCM cache, so
+    compressed inputs are decoded once across experiments (lib/decode.py).
+    `streaming` forces block-based processing on/off; None streams long
+    recordings (>= STREAMING_MIN_DURATION) automatically.
+    `segmented` is {'executor', 'segment_seconds', 'shm_bytes'}: the file is
+    cut into overlapping segments run on that executor (lib/segmented.py). The
+    runner only passes it from its own process, for files that would
+    otherwise outlast the rest of the batch on one core.
+    `run_dir` overrides the output directory (relative to output_root); agents
+    get theirs from the coordinator.
     """
     try:
         # Import here so we don't load these if the worker crashes early
         from .lib.audio_processor import AudioProcessor as CoreAudioProcessor
+        from .lib.streaming import can_stream, should_stream
         
         start_time = time.time()
         
         # 1. Setup Paths
         base_name = os.path.splitext(os.path.basename(input_path))[0]
-        relative_path = os.path.join("processed", f"run_{int(time.time())}_{original_file_id}", base_name)
+        run_dir = run_dir or os.path.join("processed", f"run_{int(time.time())}_{original_file_id}")
+        relative_path = os.path.join(run_dir, base_name)
         full_output_dir = os.path.join(output_root, relative_path)
         os.makedirs(full_output_dir, exist_ok=True)
 
-        # 2. Run the Real Audio Pipeline (Trimming, denoising, etc.)
-        # This usually happens too fast to benchmark on small files
-        processor = CoreAudioProcessor(input_path)
-        final_output_path = processor.process_audio(
-            output_folder=full_output_dir,
-            min_silence_len=100,
-            silence_thresh=-40
-        )
-        
-        # 3. [CRITICAL STEP] Force Heavy Computation
-        # We simulate "Advanced Feature Extraction" to justify Parallelism
-        # This forces the task to take at least 3 seconds
-        print(f"File {original_file_id}: Starting Deep Analysis (CPU Bound)...")
-        simulate_heavy_computation(duration=3.0) 
-        print(f"File {original_file_id}: Deep Analysis Complete.")
-
-        # 4. Generate relative paths for frontend (media/processed/...)
+        mel_path = os.path.join(full_output_dir, f"{base_name}_mel_spectrogram.npy")
+
+        # 2. Reuse an earlier run of the same audio and pipeline if there is one
+        cache, cache_key, cached = None, None, None
+        if result_cache:
+            from .lib.pipeline import default_pipeline
+            from .lib.result_cache import ResultCache, result_key
+            cache = ResultCache(result_cache['path'], result_cache['max_bytes'])
+            cache_key = result_key(input_path, pipeline or default_pipeline(min_silence_len=100, silence_thresh=-40))
+            cached = cache.get(cache_key, full_output_dir, base_name)
+
+        checkpoint_stats, segments = None, None
+        if cached:
+            print(f"File {original_file_id}: Result cache hit, skipping processing.")
+            final_output_path = cached['output']
+            artifacts, pyramid = cached['artifacts'], cached['pyramid']
+            spectrogram_meta = cached['spectrogram_meta']
+        else:
+            # 3. Run the Real Audio Pipeline (Trimming, denoising, etc.)
+            # This usually happens too fast to benchmark on small files
+            if segmented:
+                streaming = False
+            elif streaming is None:
+                # Pipelines with a stage that has no block form run in memory
+                streaming = should_stream(input_path) and (pipeline is None or can_stream(pipeline))
+
+            checkpoint_store = None
+            if checkpoints and not segmented:
+                from .lib.checkpoints import CheckpointStore
+                checkpoint_store = CheckpointStore(checkpoints['path'], checkpoints['max_bytes'])
+
+            decoded_cache = None
+            if pcm_cache:
+                from .lib.decode import PCMCache
+                decoded_cache = PCMCache(pcm_cache['path'], pcm_cache['max_bytes'])
+
+            processor = CoreAudioProcessor(input_path)
+            final_output_path = processor.process_audio(
+                output_folder=full_output_dir,
+                min_silence_len=100,
+                silence_thresh=-40,
+                pipeline=pipeline,
+                streaming=streaming,
+                checkpoints=checkpoint_store,
+                segmented=segmented,
+                pcm_cache=decoded_cache
+            )
+
+            # 4. [CRITICAL STEP] Force Heavy Computation
+            # We simulate "Advanced Feature Extraction" to justify Parallelism
+            # This forces the task to take at least 3 seconds
+            print(f"File {original_file_id}: Starting Deep Analysis (CPU Bound)...")
+            simulate_heavy_computation(duration=3.0)
+            print(f"File {original_file_id}: Deep Analysis Complete.")
+            artifacts = dict(getattr(processor, 'artifacts', {}))
+            checkpoint_stats = artifacts.pop('checkpoint_stats', None)
+            segments = artifacts.pop('segments', None)
+
+            # Downsampled levels for the dashboard's spectrogram previews
+            pyramid, spectrogram_meta = {}, None
+            if os.path.exists(mel_path):
+                from .lib.spectrogram_tiles import write_pyramid
+                pyramid, spectrogram_meta = write_pyramid(mel_path, frame_rate=artifacts.get('feature_frame_rate'))
+
+            if cache:
+                cache.put(cache_key, final_output_path, artifacts, pyramid, spectrogram_meta)
+
+        # 5. Generate relative paths for frontend (media/processed/...)
         relative_processed_path = os.path.join(relative_path, os.path.basename(final_output_path))
         relative_spectrogram_path = os.path.join(relative_path, f"{base_name}_mel_spectrogram.npy")
-        
+        has_spectrogram = os.path.exists(mel_path)
+
+        arrays = feature_arrays(artifacts, pyramid)
+        if feature_store:
+            has_spectrogram, relative_spectrogram_path = store_features(
+                output_root, feature_store, original_file_id, arrays
+            )
+
         duration = time.time() - start_time
         
         return {
             "success": True,
             "original_id": original_file_id,
             "processed_path": relative_processed_path, 
-            "spectrogram_path": relative_spectrogram_path if os.path.exists(os.path.join(full_output_dir, f"{base_name}_mel_spectrogram.npy")) else None,
+            "spectrogram_path": relative_spectrogram_path if has_spectrogram else None,
+            "spectrogram_meta": spectrogram_meta,
+            "cache_hit": bool(cached) if cache else None,
+            "checkpoint_stats": checkpoint_stats,
+            "segments": segments,
+            "integrated_loudness": artifacts.get('integrated_loudness'),
+            "true_peak": artifacts.get('true_peak'),
             "duration": duration,
-            "relative_dir": relative_path 
+            "relative_dir": relative_path,
+            # Per-file feature files left on disk (none once they went to the store)
+            "arrays": {} if feature_store else {
+                name: os.path.relpath(path, output_root) for name, path in arrays.items()
+            }
         }
 
     except Exception as e: